@@ -0,0 +1,136 @@
+""" Benchmarks of the main processing stages on synthetic runs of increasing size """
+import os
+import json
+import time
+import platform
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from .. import io_funcs, df_handling, init_funcs, run_params, utils
+from ..instrumentation import peak_rss_mb
+from ..plot_dut_data.main import plot_manager
+from ..dut_tele_sync_merge.merge_sentel import merge_dut_tele
+from .synthetic_data import generate_run
+
+DEFAULT_EVENTS = [10_000, 100_000, 1_000_000, 10_000_000]
+STAGES = ["root_to_df", "flatten_calo_df", "plot_manager", "merge_sentel"]
+BENCHMARK_DIR = "./benchmark_data/"
+
+
+def run_benchmarks(event_counts=None, stages=None, data_dir=BENCHMARK_DIR, out_file=None, jobs=1):
+    """
+    Time the processing stages on synthetic runs of increasing size and save the results to a JSON file.
+    Every stage runs in a fresh process, so its peak RSS is not affected by the other stages. A stage that fails
+    (e.g. runs out of memory) is recorded with its error and does not stop the others.
+
+    :param list event_counts: numbers of events of the synthetic runs (default DEFAULT_EVENTS)
+    :param list stages: names of stages to time (default STAGES)
+    :param str data_dir: directory of the synthetic runs and results
+    :param str out_file: output JSON file. default is '<data_dir>benchmark_<label>.json'
+    :param int jobs: number of worker processes for rendering plots (plot_manager stage)
+    :return: dict of benchmark results
+    """
+    event_counts = event_counts if event_counts else DEFAULT_EVENTS
+    stages = stages if stages else STAGES
+    label = get_version_label()
+    report = {"version": label, "date": time.strftime("%Y-%m-%d %H:%M:%S"), "python": platform.python_version(),
+              "machine": platform.machine(), "cpus": os.cpu_count(), "results": []}
+
+    for num_events in event_counts:
+        run_number = num_events  # one synthetic run per size
+        dut_file, tele_file = get_synthetic_run(run_number, num_events, data_dir)
+        for stage in stages:
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                try:
+                    result = executor.submit(_run_stage, stage, run_number, dut_file, tele_file, data_dir,
+                                             jobs).result()
+                except Exception as e:  # stage failed, or its process died (e.g. killed for running out of memory)
+                    message = str(e).splitlines()
+                    result = {"status": f"failed: {type(e).__name__}" + (f": {message[0]}" if message else "")}
+            result = dict(stage=stage, events=num_events, **result)
+            print(result)
+            report["results"].append(result)
+
+    if out_file is None:
+        out_file = data_dir + f"benchmark_{label}.json"
+    os.makedirs(os.path.dirname(out_file) or ".", exist_ok=True)
+    with open(out_file, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Benchmark results saved to {out_file}")
+    return report
+
+
+def get_synthetic_run(run_number, num_events, data_dir):
+    """
+    Get the files of a synthetic run, generating them unless they already exist with the right number of events.
+
+    :param int run_number: run number
+    :param int num_events: number of events
+    :param str data_dir: base directory of the run's files
+    :return: path of DUT file, path of telescope file
+    """
+    dut_file = os.path.normpath(os.path.join(data_dir, run_params.DUT_FILE_PATH, f"TB_FIRE_{run_number}_hits.root"))
+    tele_file = os.path.normpath(os.path.join(data_dir, run_params.TELE_FILE_PATH, f"run_{run_number}_telescope.root"))
+    if os.path.exists(dut_file) and os.path.exists(tele_file):
+        if io_funcs.get_tree_size(dut_file, run_params.DUT_ROOT_TREE)[0] == num_events:
+            return dut_file, tele_file
+    return generate_run(run_number, num_events, out_dir=data_dir)
+
+
+def _run_stage(stage, run_number, dut_file, tele_file, data_dir, jobs):
+    """
+    Run a single stage (in a fresh worker process) and measure it.
+    Inputs of a stage (e.g. the DataFrame flattened by flatten_calo_df) are prepared before timing starts.
+
+    :return: dict of wall time, CPU time (s) and peak RSS (MB) of the stage, and the process's peak RSS before it
+    """
+    df = None
+    if stage in ("flatten_calo_df", "plot_manager"):
+        df = io_funcs.root_to_df(dut_file, run_params.DUT_ROOT_TREE)
+    if stage == "plot_manager":
+        df = df_handling.flatten_calo_df(df)
+        run_params.init_vars(run_number, ".root", data_dir + f"plots/run_{run_number}/", None, jobs)
+        init_funcs.make_plot_dirs()
+
+    rss_before = peak_rss_mb()
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    if stage == "root_to_df":
+        io_funcs.root_to_df(dut_file, run_params.DUT_ROOT_TREE)
+    elif stage == "flatten_calo_df":
+        df_handling.flatten_calo_df(df)
+    elif stage == "plot_manager":
+        plot_manager(df)
+    elif stage == "merge_sentel":
+        merge_dut_tele(run_number, dut_file=dut_file, tele_file=tele_file, out_dir=data_dir + "merged/")
+    else:
+        raise ValueError(f"Unknown stage: '{stage}'. Expected one of {STAGES}")
+    wall_time = time.perf_counter() - start
+    cpu_time = time.process_time() - cpu_start
+    return {"status": "ok", "wall_s": round(wall_time, 3), "cpu_s": round(cpu_time, 3),
+            "peak_rss_mb": round(peak_rss_mb(), 1), "rss_before_mb": round(rss_before, 1)}
+
+
+def get_version_label():
+    """
+    Label of the code version being benchmarked: short git commit hash (with '-dirty' for uncommitted changes).
+
+    :return: str. 'unknown' outside a git repository
+    """
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=repo_dir, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+if __name__ == "__main__":
+
+    # get args from user
+    arg_params = [["-n", "--events", str, "comma separated numbers of events (default 10000,100000,1000000,10000000)"],
+                  ["-s", "--stages", str, f"comma separated stages to time (default {','.join(STAGES)})"],
+                  ["-o", "--output", str, "output JSON file"],
+                  ["-j", "--jobs", int, "number of worker processes for rendering plots (default 1)"]]
+    args = utils.get_args(arg_params)
+    run_benchmarks(event_counts=[int(n) for n in args.events.split(",")] if args.events else None,
+                   stages=args.stages.split(",") if args.stages else None, out_file=args.output, jobs=args.jobs)
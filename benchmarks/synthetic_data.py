@@ -0,0 +1,196 @@
+""" Synthetic test-beam runs: DUT ('Hits') and telescope ('TrackingInfo/Tracks') trees with known content """
+import os
+import numpy as np
+import awkward as ak
+import uproot
+from .. import run_params
+
+DUT_CLOCK_TO_TELE = 10.0  # telescope timestamp units per DUT timestamp unit
+MEAN_TRIGGER_INTERVAL = 20000  # mean time between triggers (DUT timestamp units)
+
+
+def generate_run(run_number, num_events, out_dir="./", chunk_size=100000, seed=0, **kwargs):
+    """
+    Write a synthetic run: '<out_dir>/detector/Converted/ZS_Data/TB_FIRE_<run>_hits.root' and
+    '<out_dir>/telescope/run_<run>_telescope.root' (the layout expected by init_funcs and merge_sentel).
+    Events are generated and written in chunks, so any number of events can be written with bounded memory.
+
+    :param int run_number: run number
+    :param int num_events: number of events (triggers)
+    :param str out_dir: base directory
+    :param int chunk_size: number of events generated and written at once
+    :param int seed: random seed (identical arguments give identical files)
+    :param kwargs: shower, noise and telescope parameters (see generate_events and generate_tracks)
+    :return: path of DUT file, path of telescope file
+    """
+    dut_file = os.path.normpath(os.path.join(out_dir, run_params.DUT_FILE_PATH, f"TB_FIRE_{run_number}_hits.root"))
+    tele_file = os.path.normpath(os.path.join(out_dir, run_params.TELE_FILE_PATH, f"run_{run_number}_telescope.root"))
+    os.makedirs(os.path.dirname(dut_file), exist_ok=True)
+    os.makedirs(os.path.dirname(tele_file), exist_ok=True)
+
+    track_kwargs = {key: kwargs.pop(key) for key in ("efficiency", "tracks_per_event", "pad_size", "clock_drift")
+                    if key in kwargs}
+    rng = np.random.default_rng(seed)
+    with uproot.recreate(dut_file) as dut_out, uproot.recreate(tele_file) as tele_out:
+        last_time = 0.0
+        dut_tree = tele_tree = None
+        for first_event in range(0, num_events, chunk_size):
+            num_chunk = min(chunk_size, num_events - first_event)
+            hits, axis, timestamps = generate_events(num_chunk, rng, first_event=first_event, start_time=last_time,
+                                                     **kwargs)
+            last_time = timestamps[-1]
+            tracks = generate_tracks(hits[run_params.EVENT_ID_COL], axis, timestamps, rng, **track_kwargs)
+            dut_tree = _extend_tree(dut_out, run_params.DUT_ROOT_TREE, hits, dut_tree)
+            tele_tree = _extend_tree(tele_out, run_params.TELE_ROOT_TREE, tracks, tele_tree)
+    print(f"Wrote {num_events} synthetic events to {dut_file} and {tele_file}")
+    return dut_file, tele_file
+
+
+def generate_events(num_events, rng, first_event=0, start_time=0.0, mean_energy=3000.0, energy_spread=0.1,
+                    shower_max=3.0, shower_width=1.2, hits_per_mip=0.005, beam_center=(10.0, 6.5), beam_spread=2.0,
+                    noise_rate=0.5, noise_amplitude=8.0, hot_channels=None, hot_probability=0.3):
+    """
+    Generate the DUT hits of showering events.
+    Each event has a shower axis (beam_center + gaussian beam_spread, in pad units). Its energy (mean_energy with
+    relative spread energy_spread) is shared between the layers by a gamma profile peaking at layer slot
+    shower_max, and hits in each layer are spread around the axis with a gaussian of width shower_width (pads).
+    On top of the shower, each layer gets noise_rate (Poisson mean) random noise hits per event and each hot
+    channel fires with probability hot_probability.
+
+    :param int num_events: number of events
+    :param numpy.random.Generator rng: random generator
+    :param int first_event: TLU number of the first event
+    :param float start_time: DUT timestamp before the first event
+    :param float mean_energy: mean shower energy (ADC counts)
+    :param float energy_spread: relative spread of the shower energy
+    :param float shower_max: layer slot (index of run_params.LAYERS) of the shower maximum
+    :param float shower_width: transverse shower size (pads)
+    :param float hits_per_mip: number of hit pads per ADC count of layer energy
+    :param tuple beam_center: (column, row) of the beam centre on the sensor (pads)
+    :param float beam_spread: beam size (pads)
+    :param float noise_rate: mean number of noise hits per event and layer
+    :param float noise_amplitude: mean amplitude of noise hits (ADC counts)
+    :param list hot_channels: optional list of (layer, channel) that fire often
+    :param float hot_probability: probability of a hot channel to fire in an event
+    :return: dict of Hits branches, (events, 2) numpy.ndarray of shower axes (column, row), event timestamps
+    """
+    n_layers = len(run_params.LAYERS)
+    n_channels = len(run_params.CHANNELS)
+    layers = np.array(run_params.LAYERS)
+
+    # event energies and shower axes
+    energy = np.maximum(rng.normal(mean_energy, energy_spread * mean_energy, num_events), 0)
+    axis = rng.normal(beam_center, beam_spread, (num_events, 2))
+
+    # longitudinal profile: gamma distribution over layer slots, normalized to 1
+    depth = np.arange(n_layers) + 0.5
+    profile = depth ** shower_max * np.exp(-depth)
+    profile /= profile.sum()
+    layer_energy = energy[:, None] * profile[None, :]  # (events, layer slots)
+
+    # shower hits: Poisson number of pads per (event, layer slot), positions around the shower axis
+    num_hits = rng.poisson(layer_energy * hits_per_mip).ravel()
+    cell = np.repeat(np.arange(num_events * n_layers), num_hits)  # flat (event, layer slot) index of each hit
+    event = cell // n_layers
+    slot = cell % n_layers
+    pos = axis[event] + rng.normal(0, shower_width, (len(cell), 2))
+    amplitude = layer_energy.ravel()[cell] / np.maximum(num_hits[cell], 1) * rng.gamma(4.0, 0.25, len(cell))
+
+    # noise hits: uniform over the channels
+    num_noise = rng.poisson(noise_rate, num_events * n_layers)
+    noise_cell = np.repeat(np.arange(num_events * n_layers), num_noise)
+    noise_channel = rng.integers(0, n_channels, len(noise_cell))
+    noise_amp = rng.exponential(noise_amplitude, len(noise_cell))
+
+    # hot channels
+    hot_event, hot_slot, hot_channel = [], [], []
+    for layer, channel in (hot_channels or []):
+        fired = np.nonzero(rng.random(num_events) < hot_probability)[0]
+        hot_event.append(fired)
+        hot_slot.append(np.full(len(fired), list(layers).index(layer)))
+        hot_channel.append(np.full(len(fired), channel))
+
+    # shower positions to channels (positions outside the sensor are lost)
+    col = np.floor(pos[:, 0]).astype(np.int64)
+    row = np.floor(pos[:, 1]).astype(np.int64)
+    channel = row * run_params.COLS + col
+    inside = (col >= 0) & (col < run_params.COLS) & (row >= 0) & (channel < n_channels)
+
+    event = np.concatenate([event[inside], noise_cell // n_layers] + hot_event)
+    slot = np.concatenate([slot[inside], noise_cell % n_layers] + hot_slot)
+    channel = np.concatenate([channel[inside], noise_channel] + hot_channel)
+    hot_amp = rng.exponential(noise_amplitude, sum(len(fired) for fired in hot_event))
+    amplitude = np.concatenate([amplitude[inside], noise_amp, hot_amp])
+
+    # one hit per (event, layer, channel): sum the amplitudes of coinciding hits
+    key = (event * n_layers + slot) * n_channels + channel
+    key, inverse = np.unique(key, return_inverse=True)
+    amplitude = np.bincount(inverse.reshape(-1), weights=amplitude, minlength=len(key))
+    amplitude = np.clip(np.round(amplitude), 1, run_params.ADC_RANGE[1]).astype(np.int32)
+    event = key // (n_layers * n_channels)
+    plane = layers[(key // n_channels) % n_layers].astype(np.int32)
+    channel = (key % n_channels).astype(np.int32)
+    counts = np.bincount(event, minlength=num_events)
+
+    timestamps = start_time + np.cumsum(np.round(rng.exponential(MEAN_TRIGGER_INTERVAL, num_events)) + 1)
+    hits = {run_params.EVENT_ID_COL: np.arange(first_event, first_event + num_events, dtype=np.uint64),
+            "timestamp": ak.unflatten(timestamps, np.ones(num_events, dtype=np.int64)),
+            run_params.PLANE_COL: ak.unflatten(plane, counts),
+            run_params.CHANNEL_COL: ak.unflatten(channel, counts),
+            run_params.AMPLITUDE_COL: ak.unflatten(amplitude, counts),
+            "toa": ak.unflatten(rng.integers(0, 1024, len(key)).astype(np.int32), counts)}
+    return hits, axis, timestamps
+
+
+def generate_tracks(event_ids, axis, timestamps, rng, efficiency=0.95, tracks_per_event=1.0, pad_size=5.0,
+                    clock_drift=0.0):
+    """
+    Generate the telescope tracks of events generated by generate_events.
+    The telescope records a fraction (efficiency) of the triggers. Each recorded trigger has a Poisson number of
+    tracks; the first one points at the shower axis, the others are random. Track positions at the DUT (x_dut, y_dut)
+    are in mm with (0, 0) at the centre of the sensor.
+
+    :param numpy.ndarray event_ids: TLU numbers of the events
+    :param numpy.ndarray axis: (events, 2) shower axes (column, row)
+    :param numpy.ndarray timestamps: DUT timestamps of the events
+    :param numpy.random.Generator rng: random generator
+    :param float efficiency: fraction of triggers recorded by the telescope
+    :param float tracks_per_event: mean number of tracks per recorded trigger
+    :param float pad_size: pad pitch (mm)
+    :param float clock_drift: relative drift of the telescope clock with respect to the DUT clock
+    :return: dict of Tracks branches (ak.Arrays)
+    """
+    recorded = np.nonzero(rng.random(len(axis)) < efficiency)[0]
+    num_tracks = rng.poisson(tracks_per_event, len(recorded))
+
+    # first track of an event at the shower axis, others uniform over the sensor
+    track_event = np.repeat(recorded, num_tracks)
+    first = np.zeros(len(track_event), dtype=bool)
+    first[np.cumsum(num_tracks)[num_tracks > 0] - num_tracks[num_tracks > 0]] = True
+    pos = np.where(first[:, None], axis[track_event],
+                   rng.uniform((0, 0), (run_params.COLS, run_params.ROWS), (len(track_event), 2)))
+    pos = pos + rng.normal(0, 0.05, pos.shape)
+    x = (pos[:, 0] - run_params.COLS / 2) * pad_size
+    y = (pos[:, 1] - run_params.ROWS / 2) * pad_size
+
+    tele_time = timestamps[recorded] * DUT_CLOCK_TO_TELE * (1 + clock_drift)
+    one = np.ones(len(recorded), dtype=np.int64)
+    chi2 = rng.chisquare(6, len(track_event)) * 5
+    return {"timestamp": ak.unflatten(tele_time, one),
+            "triggerid": ak.unflatten(event_ids[recorded].astype(np.int64), one),
+            "trackid": ak.unflatten(np.arange(len(track_event)) - np.repeat(np.cumsum(num_tracks) - num_tracks,
+                                                                            num_tracks), num_tracks),
+            "x_dut": ak.unflatten(x, num_tracks),
+            "y_dut": ak.unflatten(y, num_tracks),
+            "chi2": ak.unflatten(chi2, num_tracks),
+            "ndof": ak.unflatten(np.full(len(track_event), 8, dtype=np.int64), num_tracks),
+            "num_cluster": ak.unflatten(rng.integers(3, 7, len(track_event)), num_tracks)}
+
+
+def _extend_tree(file, tree_name, branches, tree=None):
+    """ Append branches to a tree of an open ROOT file (created if tree is None). Returns the tree. """
+    branches = {name: ak.Array(arr) if not isinstance(arr, ak.Array) else arr for name, arr in branches.items()}
+    if tree is None:
+        tree = file.mktree(tree_name, {name: arr.type.content for name, arr in branches.items()})
+    tree.extend(branches)
+    return tree
@@ -0,0 +1,180 @@
+""" Automatic detection of hot and dead channels, and saving/loading of per-run channel masks """
+import os
+import json
+import warnings
+import numpy as np
+import awkward as ak
+from numpy.lib.stride_tricks import sliding_window_view
+from . import run_params
+from .df_handling import channel_mask_from_list
+from .tb_helpers_v2025 import channel_to_sensor_coord
+from .run_params import PLANE_COL, CHANNEL_COL, AMPLITUDE_COL, EVENT_ID_COL, LAYERS, CHANNELS, ROWS, COLS
+from .run_params import HOT_CHANNEL_FACTOR, DEAD_CHANNEL_FACTOR, MIN_CHANNEL_COUNTS
+
+
+class ChannelStats:
+    """
+    Occupancy and amplitude statistics of all channels of all layers, accumulated chunk by chunk from raw hits
+    (chunks must not split events).
+    """
+    def __init__(self):
+        self.shape = (max(LAYERS) + 1, len(CHANNELS))
+        self.num_events = 0
+        self.occupancy = np.zeros(self.shape, dtype=np.int64)  # number of events with a hit in the channel
+        self.hits = np.zeros(self.shape, dtype=np.int64)
+        self.amp_sum = np.zeros(self.shape)
+        self.amp_sum2 = np.zeros(self.shape)
+
+    def fill(self, planes, channels, amplitudes, event_ids, num_events):
+        """
+        Add the hits of a chunk of events.
+
+        :param numpy.ndarray planes: plane number per hit
+        :param numpy.ndarray channels: channel number per hit
+        :param numpy.ndarray amplitudes: amplitude per hit
+        :param numpy.ndarray event_ids: event number per hit
+        :param int num_events: number of events in the chunk (including events without hits)
+        :return:
+        """
+        planes = np.asarray(planes, dtype=np.int64)
+        channels = np.asarray(channels, dtype=np.int64)
+        valid = (planes >= 0) & (planes < self.shape[0]) & (channels >= 0) & (channels < self.shape[1])
+        idx = planes[valid] * self.shape[1] + channels[valid]
+        amplitudes = np.asarray(amplitudes, dtype=float)[valid]
+        size = self.hits.size
+
+        self.num_events += num_events
+        self.hits += np.bincount(idx, minlength=size).reshape(self.shape)
+        self.amp_sum += np.bincount(idx, weights=amplitudes, minlength=size).reshape(self.shape)
+        self.amp_sum2 += np.bincount(idx, weights=amplitudes ** 2, minlength=size).reshape(self.shape)
+        # one count per (event, channel)
+        _, event_idx = np.unique(np.asarray(event_ids)[valid], return_inverse=True)
+        occupied = np.unique(event_idx.reshape(-1) * size + idx) % size
+        self.occupancy += np.bincount(occupied, minlength=size).reshape(self.shape)
+
+    def fill_arrays(self, arrays):
+        """
+        Add the hits of a chunk of raw jagged data.
+
+        :param ak.Array arrays: raw jagged data (as returned by io_funcs.root_to_arrays)
+        :return:
+        """
+        counts = ak.to_numpy(ak.num(arrays[PLANE_COL], axis=1))
+        self.fill(ak.to_numpy(ak.flatten(arrays[PLANE_COL], axis=1)),
+                  ak.to_numpy(ak.flatten(arrays[CHANNEL_COL], axis=1)),
+                  ak.to_numpy(ak.flatten(arrays[AMPLITUDE_COL], axis=1)),
+                  np.repeat(ak.to_numpy(arrays[EVENT_ID_COL]), counts), len(arrays))
+
+    def fill_df(self, df):
+        """
+        Add the hits of a flattened pd.DataFrame.
+
+        :param pd.DataFrame df: flattened data (as returned by df_handling.flatten_calo_df)
+        :return:
+        """
+        self.fill(df[PLANE_COL].to_numpy(), df[CHANNEL_COL].to_numpy(), df[AMPLITUDE_COL].to_numpy(),
+                  df[EVENT_ID_COL].to_numpy(), df[EVENT_ID_COL].nunique())
+
+    def amplitude_stats(self):
+        """
+        Mean and standard deviation of the amplitude of every channel.
+
+        :return: mean, std (numpy.ndarrays, NaN for channels without hits)
+        """
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = self.amp_sum / self.hits
+            std = np.sqrt(np.maximum(self.amp_sum2 / self.hits - mean ** 2, 0))
+        return mean, std
+
+
+def neighbour_median(values):
+    """
+    Median of the values of the (up to 8) neighbouring pads of every channel, in the sensor's pad geometry.
+
+    :param numpy.ndarray values: (layers, channels) array
+    :return: (layers, channels) numpy.ndarray (NaN for channels without neighbours)
+    """
+    n_layers, n_channels = values.shape
+    col, row = channel_to_sensor_coord(np.arange(n_channels))
+    # pad map of each layer with a border of NaN (and NaN at positions without a channel)
+    grid = np.full((n_layers, ROWS + 2, COLS + 2), np.nan)
+    grid[:, row + 1, col + 1] = values
+    windows = sliding_window_view(grid, (3, 3), axis=(1, 2)).reshape(n_layers, ROWS, COLS, 9)
+    neighbours = np.delete(windows, 4, axis=-1)  # remove the pad itself
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # all-NaN windows
+        median = np.nanmedian(neighbours, axis=-1)
+    return median[:, row, col]
+
+
+def detect_bad_channels(stats, hot_factor=HOT_CHANNEL_FACTOR, dead_factor=DEAD_CHANNEL_FACTOR,
+                        min_counts=MIN_CHANNEL_COUNTS):
+    """
+    Flag hot and dead channels of all layers at once, by comparing the occupancy of every channel to the median
+    occupancy of its neighbouring pads (the beam profile varies smoothly between neighbouring pads):
+        - hot: occupancy above hot_factor times the neighbours' median (with at least min_counts hits),
+               or at least min_counts hits that all have the same amplitude (stuck channel)
+        - dead: occupancy below dead_factor times the neighbours' median, where at least min_counts hits
+                are expected
+
+    :param ChannelStats stats: statistics of the run's channels
+    :param float hot_factor: occupancy factor above which a channel is hot
+    :param float dead_factor: occupancy fraction below which a channel is dead
+    :param int min_counts: minimal number of hits (observed for hot, expected for dead) to flag a channel
+    :return: hot, dead (boolean (layers, channels) numpy.ndarrays)
+    """
+    reference = np.nan_to_num(neighbour_median(stats.occupancy.astype(float)))
+    _, amp_std = stats.amplitude_stats()
+    enough_hits = stats.occupancy >= min_counts
+    stuck = amp_std < 1e-3  # (up to rounding of the sums)
+    hot = enough_hits & ((stats.occupancy > hot_factor * reference) | stuck)
+    dead = (reference >= min_counts) & (stats.occupancy < dead_factor * reference)
+    return hot, dead
+
+
+def save_channel_mask(filename, hot, dead, stats=None, params=None):
+    """
+    Save the hot and dead channels of a run (and the channel statistics they were found from) to a '.npz' file.
+
+    :param str filename: path to output file
+    :param numpy.ndarray hot: boolean (layers, channels) array of hot channels
+    :param numpy.ndarray dead: boolean (layers, channels) array of dead channels
+    :param ChannelStats stats: optional statistics of the run's channels
+    :param dict params: optional JSON-serializable information saved with the mask (e.g. thresholds)
+    :return:
+    """
+    arrays = {"hot": hot, "dead": dead, "params": np.array(json.dumps(params if params else {}))}
+    if stats is not None:
+        amp_mean, amp_std = stats.amplitude_stats()
+        arrays.update(num_events=np.array(stats.num_events), occupancy=stats.occupancy, hits=stats.hits,
+                      amplitude_mean=amp_mean, amplitude_std=amp_std)
+    os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+    tmp_file = filename + ".tmp.npz"
+    np.savez_compressed(tmp_file, **arrays)
+    os.replace(tmp_file, filename)
+    print(f"Saved channel mask {filename}: {int(hot.sum())} hot and {int(dead.sum())} dead channels")
+
+
+def load_channel_mask(filename):
+    """
+    Load a channel mask saved with save_channel_mask.
+
+    :param str filename: path to '.npz' file
+    :return: hot, dead (boolean numpy.ndarrays), params dict
+    """
+    with np.load(filename) as npz:
+        return npz["hot"], npz["dead"], json.loads(npz["params"].item())
+
+
+def combine_masks(hot, dead, noisy_channels=None):
+    """
+    Channel mask of a run: its hot and dead channels and the hand-maintained noisy channels.
+
+    :param numpy.ndarray hot: boolean (layers, channels) array of hot channels
+    :param numpy.ndarray dead: boolean (layers, channels) array of dead channels
+    :param noisy_channels: collection of (layer, channel) tuples. Default is run_params.NOISY_CHANNELS
+    :return: boolean (layers, channels) numpy.ndarray
+    """
+    if noisy_channels is None:
+        noisy_channels = run_params.NOISY_CHANNELS
+    return hot | dead | channel_mask_from_list(noisy_channels)
@@ -1,8 +1,33 @@
+import numpy as np
 import pandas as pd
-from .run_params import NOISY_CHANNELS
+import awkward as ak
+from .instrumentation import instrumented
+from . import run_params
+from .run_params import LAYERS, CHANNELS, ADC_RANGE
 from .run_params import PLANE_COL, CHANNEL_COL, AMPLITUDE_COL, EVENT_ID_COL, PLANE_ENERGY_COL, SHOWER_ENERGY_COL
 
+HIT_COLS = [PLANE_COL, CHANNEL_COL, AMPLITUDE_COL]  # vector columns (one entry per hit)
+DROPPED_COLS = ["toa", "timestamp"]  # unnecessary columns removed when flattening
+DERIVED_COLS = [PLANE_ENERGY_COL, SHOWER_ENERGY_COL]  # columns added when flattening
 
+
+def raw_branches(columns=None):
+    """
+    Branches of the raw DUT tree needed to get the given columns of the flattened data: the event ID and hit
+    columns (always needed to flatten and for the derived energy columns) and any other requested column.
+    DROPPED_COLS and the counters of the vector branches are never read.
+
+    :param list columns: optional list of flattened columns (default is the event ID and hit columns only)
+    :return: list of branch names
+    """
+    branches = [EVENT_ID_COL] + HIT_COLS
+    for col in columns or []:
+        if col not in branches and col not in DERIVED_COLS and col not in DROPPED_COLS:
+            branches.append(col)
+    return branches
+
+
+@instrumented()
 def flatten_calo_df(df):
     """
     Flattens given pd.DataFrame (in case data is vectorized).
@@ -10,26 +35,276 @@ def flatten_calo_df(df):
         - planeEnergy - sum of energy in layer per event
         - showerEnergy - sum of energy in shower (sum per event)
 
-    :param pd.DataFrame df: raw vector data
+    :param pd.DataFrame df: raw vector data (as returned by io_funcs.root_to_df)
     :return: flattened pd.DataFrame
     """
     # remove unnecessary columns
-    df = df.drop(columns=["toa"], errors="ignore")
-    df = df.drop(columns=["timestamp"], errors="ignore")
-    # flatten df
-    flat_df = df.explode([PLANE_COL, CHANNEL_COL, AMPLITUDE_COL])
+    df = df.drop(columns=DROPPED_COLS, errors="ignore")
+    # get number of hits per event and concatenate the hit vectors
+    counts = df[PLANE_COL].map(len).to_numpy(dtype=np.int64)
+    hit_cols = {col: _concat_vectors(df[col].to_numpy(), counts) for col in HIT_COLS}
+    event_cols = {col: df[col].to_numpy() for col in df.columns if col not in HIT_COLS}
+    return _build_flat_df(df.columns, event_cols, hit_cols, counts)
+
+
+@instrumented()
+def flatten_calo_arrays(arrays):
+    """
+    Flattens jagged calorimeter data read with uproot (library="ak") into a pd.DataFrame.
+    Hits are taken directly from the jagged arrays' contents and offsets, no per-row python work is done.
+    Gives the same result as flatten_calo_df (including the planeEnergy and showerEnergy columns).
+
+    :param ak.Array arrays: raw jagged data (as returned by io_funcs.root_to_arrays)
+    :return: flattened pd.DataFrame
+    """
+    # remove unnecessary columns
+    fields = [field for field in arrays.fields if field not in DROPPED_COLS]
+    # get number of hits per event and the flat hit vectors
+    counts = ak.to_numpy(ak.num(arrays[PLANE_COL], axis=1)).astype(np.int64)
+    hit_cols = {col: ak.to_numpy(ak.flatten(arrays[col], axis=1)) for col in HIT_COLS}
+    event_cols = {}
+    for col in fields:
+        if col in HIT_COLS:
+            continue
+        if arrays[col].ndim > 1:  # other vector columns are kept as a vector per hit
+            event_cols[col] = _split_vectors(arrays[col])
+        else:
+            event_cols[col] = ak.to_numpy(arrays[col])
+    return _build_flat_df(fields, event_cols, hit_cols, counts)
+
+
+def _build_flat_df(columns, event_cols, hit_cols, counts):
+    """
+    Build the flattened pd.DataFrame (one row per hit) from per-event and per-hit columns.
+    Removes noisy channels and adds the planeEnergy and showerEnergy columns.
+
+    :param list columns: output column order
+    :param dict event_cols: per-event columns {name: numpy.ndarray of length num_events}
+    :param dict hit_cols: flat hit columns {name: numpy.ndarray of length sum(counts)}
+    :param numpy.ndarray counts: number of hits per event
+    :return: flattened pd.DataFrame
+    """
+    # event index of each hit
+    hit_event = np.repeat(np.arange(len(counts)), counts)
     # remove bad channels
-    clean_df = flat_df[~flat_df[[PLANE_COL, CHANNEL_COL]].apply(tuple, axis=1).isin(NOISY_CHANNELS)]
+    keep = ~noisy_hits_mask(hit_cols[PLANE_COL], hit_cols[CHANNEL_COL])
+    hit_event = hit_event[keep]
+    hit_cols = {col: vals[keep] for col, vals in hit_cols.items()}
+
+    # group hits by event id (several rows may share the same id)
+    event_ids = event_cols[EVENT_ID_COL]
+    _, event_inverse = np.unique(event_ids, return_inverse=True)
+    hit_group = event_inverse.reshape(-1)[hit_event]
+    amplitudes = hit_cols[AMPLITUDE_COL]
     # sum energy per shower (event)
-    shower_energy = clean_df.groupby([EVENT_ID_COL])[AMPLITUDE_COL].sum().reset_index()
-    shower_energy.rename(columns={AMPLITUDE_COL: SHOWER_ENERGY_COL}, inplace=True)
+    shower_energy = segment_sum(hit_group, amplitudes)
     # sum energy per layer
-    plane_energy = clean_df.groupby([EVENT_ID_COL, PLANE_COL])[AMPLITUDE_COL].sum().reset_index()
-    plane_energy.rename(columns={AMPLITUDE_COL: PLANE_ENERGY_COL}, inplace=True)
-    # merge plane energy back to df
-    clean_df = clean_df.merge(shower_energy, on=[EVENT_ID_COL], how="left")
-    clean_df = clean_df.merge(plane_energy, on=[EVENT_ID_COL, PLANE_COL], how="left")
-    return clean_df
+    planes = hit_cols[PLANE_COL]
+    plane_key = hit_group * (int(planes.max(initial=0)) + 1) + planes
+    plane_energy = segment_sum(plane_key, amplitudes)
+
+    # build flat df in the original column order
+    flat = {}
+    for col in columns:
+        if col in hit_cols:
+            flat[col] = hit_cols[col]
+        else:
+            flat[col] = event_cols[col][hit_event]
+    flat[SHOWER_ENERGY_COL] = shower_energy
+    flat[PLANE_ENERGY_COL] = plane_energy
+    # cast to the compact dtypes before building the DataFrame (compact_dtypes then has nothing to do)
+    dtypes = get_hit_table_dtypes()
+    for col, values in flat.items():
+        if np.issubdtype(values.dtype, np.integer):
+            flat[col] = _compact_values(col, values, dtypes.get(col))
+    return pd.DataFrame(flat)
+
+
+def segment_sum(keys, values):
+    """
+    Sum values of equal keys and return the sum for each entry (a vectorized groupby().transform("sum")).
+
+    :param numpy.ndarray keys: non-negative integer group key per entry
+    :param numpy.ndarray values: values to sum
+    :return: numpy.ndarray of the group sum for each entry (int64 for integer values, so that sums of compact
+             dtypes do not overflow; otherwise the dtype of values)
+    """
+    dtype = np.int64 if np.issubdtype(values.dtype, np.integer) else values.dtype
+    if len(keys) == 0:
+        return np.zeros(0, dtype=dtype)
+    _, inverse = np.unique(keys, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    sums = np.bincount(inverse, weights=values)
+    return sums[inverse].astype(dtype)
+
+
+def noisy_hits_mask(planes, channels, mask=None):
+    """
+    Vectorized lookup of hits in masked (noisy) channels.
+
+    :param numpy.ndarray planes: plane number per hit
+    :param numpy.ndarray channels: channel number per hit
+    :param numpy.ndarray mask: boolean (layers, channels) array of masked channels. Default is get_channel_mask()
+    :return: boolean numpy.ndarray, True for hits in a masked channel
+    """
+    if mask is None:
+        mask = get_channel_mask()
+    noisy = np.zeros(len(planes), dtype=bool)
+    if len(planes) == 0 or not mask.any():
+        return noisy
+    planes = np.asarray(planes, dtype=np.int64)
+    channels = np.asarray(channels, dtype=np.int64)
+    # hits outside the mask's geometry are never masked
+    inside = (planes >= 0) & (planes < mask.shape[0]) & (channels >= 0) & (channels < mask.shape[1])
+    noisy[inside] = mask[planes[inside], channels[inside]]
+    return noisy
+
+
+def get_channel_mask():
+    """
+    Boolean mask of the channels to ignore, of shape (max layer number + 1, number of channels):
+    run_params.CHANNEL_MASK if it is set (e.g. to the detected hot/dead channels of the run),
+    otherwise the channels in run_params.NOISY_CHANNELS.
+
+    :return: boolean numpy.ndarray
+    """
+    if run_params.CHANNEL_MASK is not None:
+        return run_params.CHANNEL_MASK
+    return channel_mask_from_list(run_params.NOISY_CHANNELS)
+
+
+def channel_mask_from_list(channels):
+    """
+    Convert a collection of (layer, channel) tuples to a boolean channel mask.
+
+    :param channels: collection of (layer, channel) tuples
+    :return: boolean numpy.ndarray of shape (max layer number + 1, number of channels)
+    """
+    mask = np.zeros((max(LAYERS) + 1, len(CHANNELS)), dtype=bool)
+    if len(channels) > 0:
+        channels = np.array(sorted(channels), dtype=np.int64).reshape(-1, 2)
+        mask[channels[:, 0], channels[:, 1]] = True
+    return mask
+
+
+def channel_mask_to_list(mask):
+    """
+    Convert a boolean channel mask to a sorted list of [layer, channel] pairs.
+
+    :param numpy.ndarray mask: boolean (layers, channels) array
+    :return: list of [layer, channel] lists
+    """
+    return np.argwhere(mask).tolist()
+
+
+def _concat_vectors(vectors, counts):
+    """
+    Concatenate an object array of per-event vectors into a single flat numpy.ndarray.
+
+    :param numpy.ndarray vectors: object array of per-event vectors
+    :param numpy.ndarray counts: number of hits per event
+    :return: flat numpy.ndarray
+    """
+    if counts.sum() == 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.concatenate(vectors[counts > 0])
+
+
+def _split_vectors(jagged):
+    """
+    Convert a jagged ak.Array into an object array of per-event numpy arrays (as uproot's library="np").
+
+    :param ak.Array jagged: jagged array
+    :return: object numpy.ndarray
+    """
+    offsets = np.cumsum(ak.to_numpy(ak.num(jagged, axis=1)))
+    out = np.empty(len(jagged), dtype=object)
+    for i, vector in enumerate(np.split(ak.to_numpy(ak.flatten(jagged, axis=1)), offsets[:-1])):
+        out[i] = vector
+    return out
+
+
+def get_hit_table_dtypes():
+    """
+    Compact dtypes of the columns of the flattened hit table, chosen from the detector geometry and ADC range
+    in run_params (e.g. uint8 plane and channel numbers and int16 amplitudes for 11 layers of 256 channels).
+
+    :return: dict of {column name: numpy.dtype}
+    """
+    max_amplitude = max(abs(ADC_RANGE[0]), abs(ADC_RANGE[1]))
+    max_plane_energy = len(CHANNELS) * max_amplitude
+    max_shower_energy = len(LAYERS) * max_plane_energy
+    return {EVENT_ID_COL: np.dtype(np.uint32),  # TLU trigger numbers are 32 bit
+            PLANE_COL: min_int_dtype(0, max(LAYERS)),
+            CHANNEL_COL: min_int_dtype(0, max(CHANNELS)),
+            AMPLITUDE_COL: min_int_dtype(-max_amplitude, max_amplitude),  # signed (pedestal subtracted data)
+            PLANE_ENERGY_COL: min_int_dtype(-max_plane_energy, max_plane_energy),
+            SHOWER_ENERGY_COL: min_int_dtype(-max_shower_energy, max_shower_energy)}
+
+
+def min_int_dtype(min_val, max_val):
+    """
+    Smallest integer dtype holding the range [min_val, max_val].
+
+    :param int min_val: minimal value
+    :param int max_val: maximal value
+    :return: numpy.dtype
+    """
+    for dtype in (np.uint8, np.int8, np.uint16, np.int16, np.uint32, np.int32, np.uint64, np.int64):
+        info = np.iinfo(dtype)
+        if info.min <= min_val and max_val <= info.max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+@instrumented()
+def compact_dtypes(df):
+    """
+    Cast the integer columns of the hit table to compact dtypes: the dtypes of get_hit_table_dtypes for its
+    known columns (object columns of numbers are converted too), and the smallest dtype holding their values for
+    other integer columns.
+    A known column with values outside the range of its dtype keeps a wider dtype.
+
+    :param pd.DataFrame df: input data
+    :return: pd.DataFrame with compact dtypes (df itself, not a copy, if its dtypes are compact already)
+    """
+    dtypes = get_hit_table_dtypes()
+    compact = {}
+    for col in df.columns:
+        values = df[col]
+        dtype = dtypes.get(col)
+        if dtype is not None and values.dtype == object:  # e.g. exploded vectors
+            values = pd.to_numeric(values)
+        elif not pd.api.types.is_integer_dtype(values) or values.dtype == dtype:
+            continue
+        if pd.api.types.is_integer_dtype(values):
+            values = _compact_values(col, values, dtype)
+        if values.dtype != df[col].dtype:
+            compact[col] = values
+    if not compact:
+        return df
+    return df.assign(**compact)
+
+
+def _compact_values(col, values, dtype=None):
+    """
+    Cast integer values to dtype, or to the smallest dtype holding them if dtype is None or they exceed it.
+
+    :param str col: column name (for messages)
+    :param values: numpy.ndarray or pd.Series of integers
+    :param numpy.dtype dtype: optional target dtype
+    :return: values cast to the compact dtype (values itself if it has that dtype)
+    """
+    if values.dtype == dtype:
+        return values
+    min_val, max_val = (int(values.min()), int(values.max())) if len(values) else (0, 0)
+    if dtype is not None:
+        info = np.iinfo(dtype)
+        if info.min <= min_val and max_val <= info.max:
+            return values.astype(dtype)
+        print(f"Values of column {col} exceed {dtype} - keeping a wider dtype")
+    dtype = min_int_dtype(min_val, max_val)
+    return values if values.dtype == dtype else values.astype(dtype)
 
 
 def group_hits(df, group_cols, list_cols=None, drop_cols=None):
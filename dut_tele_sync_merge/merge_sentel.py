@@ -1,130 +1,348 @@
-from .. import io_funcs, utils, run_params
+import os
+import numpy as np
 import awkward as ak
 import uproot
-from matplotlib import pyplot as plt
-import numpy as np
-import os
+from .. import io_funcs, utils, run_params
 
-# get args from user
-arg_params = [["-r", "--runnum", int, "the run number"]]
-args = utils.get_args(arg_params)
-run_number = args.runnum
-
-dut_df = io_funcs.root_to_df(file_name=run_params.DUT_FILE_PATH + f"TB_FIRE_{run_number}_hits.root", tree_name=run_params.DUT_ROOT_TREE)
-tele_df = io_funcs.root_to_df(file_name=run_params.TELE_FILE_PATH + f"run_{run_number}_telescope.root", tree_name=run_params.TELE_ROOT_TREE)
-
-dut_df["timestamp"] = [float(time[0]) for time in dut_df["timestamp"]]
-tele_df["timestamp"] = [float(time[0]) for time in tele_df["timestamp"]]
-tele_df["triggerid"] = [int(i[0]) for i in tele_df["triggerid"]]
-
-# rename common columns
-dut_df.rename(columns={'timestamp': 'timestamp_dut'}, inplace=True)
-tele_df.rename(columns={'timestamp': 'timestamp_tele'}, inplace=True)
-
-# Merge and reset index, but drop the index column
-full_merged_df = dut_df.merge(
-    tele_df, left_on="TLU_number", right_on="triggerid", how="inner"
-).reset_index(drop=True)
-
-# Remove any unwanted columns (like 'index' if present)
-if "index" in full_merged_df.columns:
-    full_merged_df = full_merged_df.drop(columns=["index"])
-
-# Remove columns with object dtype that are not valid jagged arrays
-for col in full_merged_df.columns:
-    if full_merged_df[col].dtype == "O":
-        # Check if all elements are lists/tuples/ndarrays of numbers (Python or NumPy types)
-        if all(
-            isinstance(x, (list, tuple, np.ndarray)) and
-            all(isinstance(y, (int, float, np.integer, np.floating)) for y in x)
-            for x in full_merged_df[col]
-        ):
-            # Convert each element to a numpy array with explicit dtype
-            def to_numeric_array(x):
-                return np.array(x, dtype=np.float64 if any(isinstance(y, float) or isinstance(y, np.floating) for y in x) else np.int64)
-            full_merged_df[col] = full_merged_df[col].apply(to_numeric_array)
-        else:
-            print(f"Column '{col}' has unsupported object dtype and will be dropped.")
-            full_merged_df = full_merged_df.drop(columns=[col])
-
-# Prepare data dictionary for ROOT writing
-data = {}
-for col in full_merged_df.columns:
-    first_elem = full_merged_df[col].iloc[0]
-    if isinstance(first_elem, (list, tuple, np.ndarray)):
-        # Jagged column: convert each element to a numpy array, then wrap as Awkward Array
-        jagged_list = [np.array(x, dtype=np.float64 if any(isinstance(y, float) or isinstance(y, np.floating) for y in x) else np.int64) for x in full_merged_df[col]]
-        data[col] = ak.Array(jagged_list)
-    else:
-        # Scalar column: use .to_numpy() directly
-        data[col] = full_merged_df[col].to_numpy()
-
-# Write to a new ROOT file
-out_dir = "./merged_dut_tele/"
-os.makedirs(out_dir, exist_ok=True)
-output_file = out_dir + f"TB25_Run_{run_number}.root"
-with uproot.recreate(output_file) as fout:
-    fout["HitTracks"] = data
-
-print(f"Merged tree written to {output_file}")
-
-# Test: Verify ROOT file contents
-with uproot.open(output_file) as fin:
-    tree = fin["HitTracks"]
-    print("\nOutput ROOT file verification:")
-    print(f"Number of entries: {tree.num_entries}")
-    print(f"Branch names: {list(tree.keys())}")
-    print(f"Number of branches: {len(tree.keys())}")
-
-    expected_branches = list(data.keys())
-    missing = set(expected_branches) - set(tree.keys())
-    extra = set(tree.keys()) - set(expected_branches)
+DUT_EVENT_COL = "TLU_number"  # trigger number in the DUT tree
+TELE_EVENT_COL = "triggerid"  # trigger number in the telescope tree
+MERGED_ROOT_TREE = "HitTracks"  # name of the merged ROOT tree
+MERGED_FILE_PATH = "./merged_dut_tele/"
+
+
+def merge_dut_tele(run_number, dut_file=None, tele_file=None, out_dir=MERGED_FILE_PATH, tele_branches=None):
+    """
+    Merge the DUT and telescope trees of a run by trigger number and write the merged tree to a new ROOT file.
+    Only triggers found in both trees are kept.
+
+    :param int run_number: run number
+    :param str dut_file: optional path to DUT file. default is in run_params.DUT_FILE_PATH
+    :param str tele_file: optional path to telescope file. default is in run_params.TELE_FILE_PATH
+    :param str out_dir: directory of output file
+    :param list tele_branches: optional list of telescope branches to merge (default is all branches). Other
+                               branches are not read
+    :return: path of output file
+    """
+    if dut_file is None:
+        dut_file = run_params.DUT_FILE_PATH + f"TB_FIRE_{run_number}_hits.root"
+    if tele_file is None:
+        tele_file = run_params.TELE_FILE_PATH + f"run_{run_number}_telescope.root"
+
+    dut = io_funcs.root_to_arrays(file_name=dut_file, tree_name=run_params.DUT_ROOT_TREE,
+                                  branches=get_branches(dut_file, run_params.DUT_ROOT_TREE, DUT_EVENT_COL))
+    tele = io_funcs.root_to_arrays(file_name=tele_file, tree_name=run_params.TELE_ROOT_TREE,
+                                   branches=get_branches(tele_file, run_params.TELE_ROOT_TREE, TELE_EVENT_COL,
+                                                         tele_branches))
+    dut_cols = prepare_columns(dut, rename={"timestamp": "timestamp_dut"})
+    tele_cols = prepare_columns(tele, rename={"timestamp": "timestamp_tele"})
+
+    # match triggers
+    dut_idx, tele_idx = match_sorted(dut_cols[DUT_EVENT_COL], tele_cols[TELE_EVENT_COL])
+    print(f"Matched {len(dut_idx)} triggers (DUT: {len(dut)} entries, telescope: {len(tele)} entries)")
+    print(f"Unmatched triggers - DUT: {len(dut) - len(np.unique(dut_idx))}, "
+          f"telescope: {len(tele) - len(np.unique(tele_idx))}")
+    data = join_columns(dut_cols, tele_cols, dut_idx, tele_idx)
+
+    # write to a new ROOT file
+    os.makedirs(out_dir, exist_ok=True)
+    output_file = out_dir + f"TB25_Run_{run_number}.root"
+    write_tree(output_file, MERGED_ROOT_TREE, data)
+    print(f"Merged tree written to {output_file}")
+    verify_tree(output_file, MERGED_ROOT_TREE, list(data.keys()))
+    return output_file
+
+
+def merge_dut_tele_streaming(run_number, dut_file=None, tele_file=None, out_dir=MERGED_FILE_PATH,
+                             step_size=run_params.STREAM_STEP_SIZE, tele_branches=None):
+    """
+    Merge the DUT and telescope trees of a run by trigger number, reading both trees in chunks.
+    Both trees must be ordered by trigger number. A cursor is advanced on each tree, and matched entries are
+    appended to the output tree batch by batch, so memory is bounded by the chunk size, not the run length.
+
+    :param int run_number: run number
+    :param str dut_file: optional path to DUT file. default is in run_params.DUT_FILE_PATH
+    :param str tele_file: optional path to telescope file. default is in run_params.TELE_FILE_PATH
+    :param str out_dir: directory of output file
+    :param step_size: number of entries per chunk, or memory size string (e.g. "100 MB")
+    :param list tele_branches: optional list of telescope branches to merge (default is all branches)
+    :return: path of output file, dict of counts (matched, dut_unmatched, tele_unmatched)
+    """
+    if dut_file is None:
+        dut_file = run_params.DUT_FILE_PATH + f"TB_FIRE_{run_number}_hits.root"
+    if tele_file is None:
+        tele_file = run_params.TELE_FILE_PATH + f"run_{run_number}_telescope.root"
+
+    counts = {"matched": 0, "dut_unmatched": 0, "tele_unmatched": 0}
+    streams = {
+        "dut": _sorted_chunks(dut_file, run_params.DUT_ROOT_TREE, step_size, DUT_EVENT_COL,
+                              {"timestamp": "timestamp_dut"}, counts, "dut_unmatched",
+                              get_branches(dut_file, run_params.DUT_ROOT_TREE, DUT_EVENT_COL)),
+        "tele": _sorted_chunks(tele_file, run_params.TELE_ROOT_TREE, step_size, TELE_EVENT_COL,
+                               {"timestamp": "timestamp_tele"}, counts, "tele_unmatched",
+                               get_branches(tele_file, run_params.TELE_ROOT_TREE, TELE_EVENT_COL, tele_branches)),
+    }
+    key_cols = {"dut": DUT_EVENT_COL, "tele": TELE_EVENT_COL}
+    buffers = {"dut": None, "tele": None}
+    done = {"dut": False, "tele": False}
+    need = {"dut": True, "tele": True}
+
+    os.makedirs(out_dir, exist_ok=True)
+    output_file = out_dir + f"TB25_Run_{run_number}.root"
+    branches = None
+    with uproot.recreate(output_file) as fout:
+        while True:
+            # advance cursors
+            for side in streams:
+                if need[side] and not done[side]:
+                    chunk = next(streams[side], None)
+                    if chunk is None:
+                        done[side] = True
+                    else:
+                        buffers[side] = chunk if buffers[side] is None else _concat_columns(buffers[side], chunk)
+            if any(not done[side] and _num_rows(buffers[side]) == 0 for side in streams):
+                need = {side: not done[side] and _num_rows(buffers[side]) == 0 for side in streams}
+                continue
+            if any(done[side] and buffers[side] is None for side in streams):
+                # a tree without valid entries: nothing can be matched, all entries of the other tree are unmatched
+                for side in streams:
+                    counts[side + "_unmatched"] += _num_rows(buffers[side]) + sum(_num_rows(chunk)
+                                                                                  for chunk in streams[side])
+                break
+
+            # entries below the horizon are complete in both buffers (an unfinished stream may still hold
+            # entries with its last key), so they can be matched now
+            last_keys = {side: buffers[side][key_cols[side]][-1] for side in streams if not done[side]}
+            horizon = min(last_keys.values()) if last_keys else None
+            ready = {}
+            for side in streams:
+                ready[side], buffers[side] = _split_columns(buffers[side], key_cols[side], horizon)
+
+            # match and write
+            dut_idx, tele_idx = match_sorted(ready["dut"][DUT_EVENT_COL], ready["tele"][TELE_EVENT_COL])
+            batch = join_columns(ready["dut"], ready["tele"], dut_idx, tele_idx)
+            if branches is None:
+                fout.mktree(MERGED_ROOT_TREE, {col: ak.Array(arr).type.content for col, arr in batch.items()})
+                branches = list(batch.keys())
+            if len(dut_idx) > 0:
+                fout[MERGED_ROOT_TREE].extend(batch)
+            counts["matched"] += len(dut_idx)
+            counts["dut_unmatched"] += _num_rows(ready["dut"]) - len(np.unique(dut_idx))
+            counts["tele_unmatched"] += _num_rows(ready["tele"]) - len(np.unique(tele_idx))
+
+            if horizon is None:
+                break
+            need = {side: side in last_keys and last_keys[side] == horizon for side in streams}
+
+    print(f"Matched {counts['matched']} triggers")
+    print(f"Unmatched triggers - DUT: {counts['dut_unmatched']}, telescope: {counts['tele_unmatched']}")
+    if branches is None:
+        print(f"No valid triggers in one of the trees - no tree written to {output_file}")
+        return output_file, counts
+    print(f"Merged tree written to {output_file}")
+    verify_tree(output_file, MERGED_ROOT_TREE, branches)
+    return output_file, counts
+
+
+def _sorted_chunks(file_name, tree_name, step_size, key_col, rename, counts, unmatched_key, branches=None):
+    """
+    Iterate over a tree in chunks of prepared columns, verifying the entries are ordered by key_col.
+    Entries without a valid key are dropped (and counted as unmatched).
+
+    :return: generator of dicts of columns (see prepare_columns)
+    """
+    last_key = None
+    for arrays in io_funcs.iterate_root(file_name, tree_name, step_size, branches=branches):
+        cols = prepare_columns(arrays, rename)
+        valid = cols[key_col].astype(np.int64) >= 0
+        if not np.all(valid):
+            counts[unmatched_key] += int(np.sum(~valid))
+            cols = {col: arr[valid] for col, arr in cols.items()}
+        keys = cols[key_col].astype(np.int64)
+        if len(keys) == 0:
+            continue
+        if np.any(np.diff(keys) < 0) or (last_key is not None and keys[0] < last_key):
+            raise ValueError(f"'{tree_name}' in {file_name} is not ordered by {key_col} - "
+                             f"use merge_dut_tele (in memory) instead")
+        last_key = keys[-1]
+        yield cols
+
+
+def _num_rows(cols):
+    """ Number of entries in a dict of columns (0 for None) """
+    if cols is None:
+        return 0
+    return len(next(iter(cols.values())))
+
+
+def _concat_columns(cols_a, cols_b):
+    """ Concatenate two dicts of columns with the same keys """
+    return {col: ak.concatenate([arr, cols_b[col]]) if isinstance(arr, ak.Array)
+            else np.concatenate([arr, cols_b[col]]) for col, arr in cols_a.items()}
+
+
+def _split_columns(cols, key_col, horizon):
+    """
+    Split sorted columns into entries with key below horizon and the rest.
+
+    :param dict cols: dict of columns sorted by key_col
+    :param str key_col: key column
+    :param horizon: key value. if None, all entries are taken
+    :return: dict of entries below horizon, dict of the remaining entries
+    """
+    if horizon is None:
+        return cols, None
+    split = np.searchsorted(cols[key_col].astype(np.int64), np.int64(horizon), side="left")
+    return {col: arr[:split] for col, arr in cols.items()}, {col: arr[split:] for col, arr in cols.items()}
+
+
+def join_columns(dut_cols, tele_cols, dut_idx, tele_idx):
+    """
+    Select matched entries of both trees into a single dict of columns (DUT columns first).
+
+    :param dict dut_cols: DUT columns (see prepare_columns)
+    :param dict tele_cols: telescope columns (see prepare_columns)
+    :param numpy.ndarray dut_idx: indices of matched DUT entries
+    :param numpy.ndarray tele_idx: indices of matched telescope entries
+    :return: dict of {column name: ak.Array or numpy.ndarray}
+    """
+    data = {col: arr[dut_idx] for col, arr in dut_cols.items()}
+    for col, arr in tele_cols.items():
+        if col in data:
+            print(f"Column '{col}' exists in both trees - keeping the DUT column")
+            continue
+        data[col] = arr[tele_idx]
+    return data
+
+
+def get_branches(file_name, tree_name, key_col, branches=None):
+    """
+    Branches of a tree to read for merging: the given branches (default is all branches) plus the trigger number
+    and timestamp, without the counters of vector branches (they are recreated when writing).
+
+    :param str file_name: path to input file
+    :param str tree_name: name of ROOT tree
+    :param str key_col: trigger number branch
+    :param list branches: optional list of branches to merge
+    :return: list of branch names
+    """
+    available = io_funcs.data_branches(file_name, tree_name)
+    if branches is None:
+        return available
+    missing = set(branches) - set(available)
     if missing:
-        print(f"Missing branches: {missing}")
-    if extra:
-        print(f"Extra branches: {extra}")
+        print(f"Branches {sorted(missing)} not found in {file_name}")
+    keep = {key_col, "timestamp", *branches}
+    return [branch for branch in available if branch in keep]
 
 
+def prepare_columns(arrays, rename=None):
+    """
+    Prepare the branches of a tree for merging:
+        - single value vectors (timestamp, triggerid) are replaced by their first element
+        - counters of vector branches ('n<branch>') are removed - they are recreated when writing
+        - vectors are cast to int64 / float64
 
-# ------------------ check sync between DUT and Telescope data ------------------ #
+    :param ak.Array arrays: tree data (as returned by io_funcs.root_to_arrays)
+    :param dict rename: optional {old name: new name} of columns
+    :return: dict of {column name: ak.Array or numpy.ndarray}
+    """
+    if rename is None:
+        rename = {}
+    jagged = [field for field in arrays.fields if arrays[field].ndim > 1]
+    counters = {"n" + field for field in jagged}
+    cols = {}
+    for field in arrays.fields:
+        if field in counters:
+            continue
+        arr = arrays[field]
+        name = rename.get(field, field)
+        if field in ("timestamp", TELE_EVENT_COL) and arr.ndim > 1:
+            # keep first value (entries without a value cannot be matched and are marked invalid)
+            first = ak.fill_none(ak.firsts(arr, axis=1), -1)
+            cols[name] = ak.to_numpy(first).astype(np.float64 if field == "timestamp" else np.int64)
+        elif arr.ndim > 1:
+            is_float = np.issubdtype(ak.to_numpy(ak.flatten(arr, axis=None)[:0]).dtype, np.floating)
+            cols[name] = ak.values_astype(arr, np.float64 if is_float else np.int64)
+        else:
+            cols[name] = ak.to_numpy(arr)
+    return cols
 
-# dut_time = dut_df[["timestamp", "TLU_number"]].reset_index(inplace=False)
-# tele_time = tele_df[["timestamp", "triggerid"]].reset_index(inplace=False)
 
-# merged_df = tele_time.merge(dut_time, left_on="triggerid", right_on="TLU_number").reset_index(inplace=False)
-# print(len(merged_df))
+def match_sorted(left_keys, right_keys):
+    """
+    Inner join of two key arrays by sorted-index matching (like pd.merge(how="inner")).
+    The result keeps the order of left_keys; duplicate keys give all pairs (right matches in their original order).
 
-# merged_df = merged_df.loc[merged_df.index < 500]
+    :param numpy.ndarray left_keys: keys of left table
+    :param numpy.ndarray right_keys: keys of right table
+    :return: indices into left, indices into right of matched pairs (numpy.ndarrays)
+    """
+    left_keys = np.asarray(left_keys).astype(np.int64)
+    right_keys = np.asarray(right_keys).astype(np.int64)
+    order = np.argsort(right_keys, kind="stable")
+    sorted_right = right_keys[order]
+    start = np.searchsorted(sorted_right, left_keys, side="left")
+    stop = np.searchsorted(sorted_right, left_keys, side="right")
+    num_matches = stop - start
 
-# plt.scatter(merged_df["timestamp_x"].to_numpy(), merged_df["timestamp_y"].to_numpy(), s=1)
-# plt.xlabel("DUT timestamp")
-# plt.ylabel("Telescope timestamp")
-# plt.show()
+    left_idx = np.repeat(np.arange(len(left_keys)), num_matches)
+    # position of each pair within the matches of its left key
+    pair_offsets = np.arange(len(left_idx)) - np.repeat(np.cumsum(num_matches) - num_matches, num_matches)
+    right_idx = order[np.repeat(start, num_matches) + pair_offsets]
+    return left_idx, right_idx
 
-# plt.scatter(merged_df["TLU_number"].to_numpy(), merged_df["timestamp_x"].to_numpy() / merged_df["timestamp_y"].to_numpy(), s=1)
-# plt.show()
 
-# dut_df["num_hits"] = [len(ch) for ch in dut_df["ch_ID"]]
-# dut_single_hits = dut_df[dut_df["num_hits"] == 1].reset_index(inplace=False)
-# dut_single_hits["ch_ID"] = [ch[0] for ch in dut_single_hits["ch_ID"]]
+def write_tree(output_file, tree_name, data):
+    """
+    Write columns (scalar numpy arrays and jagged ak.Arrays) to a TTree in a new ROOT file.
 
-# tele_df["num_tracks"] = [len(tr) for tr in tele_df["trackid"]]
-# tele_single_tracks = tele_df[tele_df["num_tracks"] == 1].reset_index(inplace=False)
-# tele_single_tracks["x_dut"] = [x[0] for x in tele_single_tracks["x_dut"]]
-# tele_single_tracks["y_dut"] = [y[0] for y in tele_single_tracks["y_dut"]]
+    :param str output_file: path of output file
+    :param str tree_name: name of tree
+    :param dict data: {branch name: ak.Array or numpy.ndarray}
+    :return:
+    """
+    data = {col: ak.Array(arr) if not isinstance(arr, ak.Array) else arr for col, arr in data.items()}
+    with uproot.recreate(output_file) as fout:
+        fout.mktree(tree_name, {col: arr.type.content for col, arr in data.items()})
+        fout[tree_name].extend(data)
 
-# merged_pos = dut_single_hits.merge(tele_single_tracks, left_on="TLU_number", right_on="triggerid").reset_index(inplace=False)
-# print(len(merged_pos))
 
-# channels = [89, 90, 109, 110]
-# fig, ax = plt.subplots(1)
-# for ch in channels:
-#     ch_df = merged_pos[merged_pos["ch_ID"] == ch].reset_index(inplace=False)
-#     x = ch_df["x_dut"].to_numpy()
-#     y = ch_df["y_dut"].to_numpy()
-#     ax.scatter(x, y, s=1)
+def verify_tree(output_file, tree_name, expected_branches):
+    """
+    Print number of entries and branches of a written tree, and any missing/extra branches.
 
-# plt.xlabel("x_dut [mm]")
-# plt.ylabel("y_dut [mm]")
-# plt.title("Channel based color")
-# plt.show()
+    :param str output_file: path of ROOT file
+    :param str tree_name: name of tree
+    :param list expected_branches: list of branch names written
+    :return:
+    """
+    with uproot.open(output_file) as fin:
+        tree = fin[tree_name]
+        print("\nOutput ROOT file verification:")
+        print(f"Number of entries: {tree.num_entries}")
+        print(f"Branch names: {list(tree.keys())}")
+        print(f"Number of branches: {len(tree.keys())}")
+
+        # counters of vector branches are added by the writer
+        counters = {"n" + branch for branch in expected_branches}
+        missing = set(expected_branches) - set(tree.keys())
+        extra = set(tree.keys()) - set(expected_branches) - counters
+        if missing:
+            print(f"Missing branches: {missing}")
+        if extra:
+            print(f"Extra branches: {extra}")
+
+
+if __name__ == "__main__":
+
+    # get args from user
+    arg_params = [["-r", "--runnum", int, "the run number"],
+                  ["-s", "--step", str, "read both files in chunks of this size (e.g. '100 MB' or '100000')"],
+                  ["-b", "--branches", str, "comma-separated telescope branches to merge (default is all)"]]
+    args = utils.get_args(arg_params)
+    tele_branches = args.branches.split(",") if args.branches else None
+    if args.step is None:
+        merge_dut_tele(args.runnum, tele_branches=tele_branches)
+    else:
+        merge_dut_tele_streaming(args.runnum, step_size=int(args.step) if args.step.isdigit() else args.step,
+                                 tele_branches=tele_branches)
@@ -0,0 +1,501 @@
+""" DUT/telescope synchronization check of a run: timestamp drift, offset jumps and trigger slips """
+import os
+import json
+import numpy as np
+import matplotlib
+import matplotlib.pyplot as plt
+from numpy.lib.stride_tricks import sliding_window_view
+from .. import io_funcs, utils, run_params
+from ..instrumentation import instrumented
+from .merge_sentel import DUT_EVENT_COL, TELE_EVENT_COL, prepare_columns, match_sorted
+
+SYNC_CHECK_PATH = "./analysis_results/sync_check/"
+SYNC_WINDOW = 2000  # number of paired triggers per linear fit (consecutive windows overlap by half)
+SLIP_MAX_SHIFT = 3  # largest trigger slip (in triggers) that is identified
+SLIP_MIN_TRIGGERS = 5  # minimal number of consecutive slipped triggers reported as a slip
+SLIP_MAX_GAP = 10  # largest number of unslipped triggers inside a slip (e.g. around triggers the telescope missed)
+JUMP_LEVEL_TRIGGERS = 50  # number of triggers on each side of an offset jump used to measure it
+TOLERANCE_SIGMAS = 10  # time tolerance of a match, in robust standard deviations of the timestamp residuals
+TOLERANCE_FRACTION = 0.1  # upper limit of the time tolerance, as a fraction of the median time between triggers
+TOLERANCE_MIN = 1.0  # lower limit of the time tolerance (telescope timestamp units)
+MAX_MISMATCHED_FRACTION = 0.01  # fraction of matched triggers outside the tolerance above which the sync is not ok
+
+
+@instrumented()
+def check_sync(run_number, dut_file=None, tele_file=None, out_dir=SYNC_CHECK_PATH, window=SYNC_WINDOW):
+    """
+    Check the synchronization of the DUT and telescope trees of a run before merging them: read only the trigger
+    numbers and timestamps of both trees, fit the telescope timestamps against the DUT timestamps of the triggers
+    matched by trigger number (see sync_stats), and save a report ('sync_check_run_<run number>.json') and a
+    summary plot ('sync_check_run_<run number>.png') to out_dir.
+
+    :param int run_number: run number
+    :param str dut_file: optional path to DUT file. default is in run_params.DUT_FILE_PATH
+    :param str tele_file: optional path to telescope file. default is in run_params.TELE_FILE_PATH
+    :param str out_dir: directory of output files
+    :param int window: number of paired triggers per linear fit
+    :return: dict of the report
+    """
+    if dut_file is None:
+        dut_file = run_params.DUT_FILE_PATH + f"TB_FIRE_{run_number}_hits.root"
+    if tele_file is None:
+        tele_file = run_params.TELE_FILE_PATH + f"run_{run_number}_telescope.root"
+
+    dut = prepare_columns(io_funcs.root_to_arrays(dut_file, run_params.DUT_ROOT_TREE,
+                                                  branches=[DUT_EVENT_COL, "timestamp"]))
+    tele = prepare_columns(io_funcs.root_to_arrays(tele_file, run_params.TELE_ROOT_TREE,
+                                                   branches=[TELE_EVENT_COL, "timestamp"]))
+    report, fits = sync_stats(dut[DUT_EVENT_COL], dut["timestamp"], tele[TELE_EVENT_COL], tele["timestamp"], window)
+    report = dict(run=run_number, **report)
+
+    os.makedirs(out_dir, exist_ok=True)
+    out_prefix = out_dir + f"sync_check_run_{run_number}"
+    with open(out_prefix + ".json", "w") as f:
+        json.dump(report, f, indent=2)
+    plot_sync_summary(fits, report, out_prefix + ".png")
+    print_sync_report(report)
+    return report
+
+
+def sync_stats(dut_triggers, dut_times, tele_triggers, tele_times, window=SYNC_WINDOW):
+    """
+    Timestamp relationship of the DUT and telescope over a whole run.
+    Triggers are matched by trigger number and paired with the DUT timestamp their telescope timestamp belongs to
+    by the time intervals around them (see pair_by_intervals). The telescope timestamps of the paired triggers are
+    fitted as a linear function of their DUT timestamps in windows of consecutive paired triggers, so that clock
+    drift (change of slope), offset jumps (the timestamp offset changes between consecutive triggers, see
+    find_offset_jumps) and trigger slips (a trigger's telescope timestamp fits the DUT timestamp of a neighbouring
+    trigger instead of its own, i.e. trigger numbers stopped matching, up to the end of the run) are found.
+
+    :param numpy.ndarray dut_triggers: DUT trigger numbers (TLU_number). Entries with negative values are ignored
+    :param numpy.ndarray dut_times: DUT timestamps
+    :param numpy.ndarray tele_triggers: telescope trigger numbers (triggerid). Entries with negative values are
+                                        ignored
+    :param numpy.ndarray tele_times: telescope timestamps
+    :param int window: number of paired triggers per linear fit
+    :return: dict of the report, dict of per-trigger and per-window arrays (for plot_sync_summary)
+    """
+    dut_triggers, dut_times = _valid_sorted(dut_triggers, dut_times)
+    tele_triggers, tele_times = _valid_sorted(tele_triggers, tele_times)
+    dut_idx, tele_idx = match_sorted(dut_triggers, tele_triggers)
+    report = {"dut_triggers": len(dut_triggers), "tele_triggers": len(tele_triggers), "matched": len(dut_idx),
+              "dut_unmatched": len(dut_triggers) - len(np.unique(dut_idx)),
+              "tele_unmatched": len(tele_triggers) - len(np.unique(tele_idx))}
+    if len(dut_idx) < 3:  # (a window fit needs at least 3 triggers)
+        report["sync_ok"] = False
+        return report, None
+
+    x, y = dut_times[dut_idx], tele_times[tele_idx]
+    triggers = dut_triggers[dut_idx]
+
+    # anchors: triggers paired with the DUT timestamp their telescope timestamp belongs to (their own, or that of a
+    # neighbouring trigger if they slipped) by the time intervals around them. only anchors are fitted, each against
+    # its paired DUT timestamp, so the fits do not follow slipped triggers however long a slip lasts
+    paired_shift, paired = pair_by_intervals(dut_times, dut_idx, y)
+    anchors = np.flatnonzero(paired)
+    if len(anchors) < 3:
+        report["sync_ok"] = False
+        return report, None
+    xa, ya = dut_times[dut_idx[anchors] + paired_shift[anchors]], y[anchors]
+
+    # robust windowed fits of the anchors, used to find the offset jumps
+    window = int(max(min(window, len(anchors)), 3))
+    starts, slope, intercept = rolling_median_fits(xa, ya, window)
+    tolerance = get_tolerance(ya - predict(xa, starts, slope, intercept, window), ya)
+    nearest = nearest_window(len(xa), starts, window)
+    jump_idx, jumps = find_offset_jumps(xa, ya, slope[nearest], intercept[nearest], tolerance)
+    # remove the jumps, so that windows around them are fitted well, then least-squares fits of the anchors that
+    # follow the robust fits within the tolerance
+    offsets = np.zeros(len(ya))
+    offsets[jump_idx + 1] = jumps
+    ya = ya - np.cumsum(offsets)
+    starts, slope, intercept = rolling_median_fits(xa, ya, window)
+    inliers = np.abs(ya - predict(xa, starts, slope, intercept, window)) <= tolerance
+    if inliers.sum() >= 2:
+        starts, slope, intercept = rolling_linear_fits(xa, ya, window, weights=inliers)
+    # (the least-squares fits are more precise)
+    tolerance = min(tolerance, get_tolerance(ya - predict(xa, starts, slope, intercept, window), ya))
+
+    # every trigger is predicted by the fit of its nearest anchor, with the offset jumps removed
+    nearest = nearest_window(len(xa), starts, window)[_nearest_anchor(anchors, len(x))]
+    offsets = np.zeros(len(y))
+    offsets[anchors[jump_idx + 1]] = jumps
+    y = y - np.cumsum(offsets)
+    residuals = y - (slope[nearest] * x + intercept[nearest])
+
+    shift = find_trigger_slips(dut_times, dut_idx, y, slope[nearest], intercept[nearest], tolerance)
+    slips = _slip_segments(shift, triggers)
+
+    # drift: slope of each window relative to the run's median slope (parts per million)
+    valid = np.isfinite(slope)
+    clock_ratio = float(np.median(slope[valid]))
+    drift_ppm = (slope / clock_ratio - 1) * 1e6
+
+    matched_res = residuals[(shift == 0) & (np.abs(residuals) <= tolerance)]
+    report.update({
+        "window": window,
+        "tolerance": tolerance,
+        "clock_ratio": clock_ratio,
+        "offset": float(np.median(ya - clock_ratio * xa)),
+        "drift_ppm_min": float(np.nanmin(drift_ppm)),
+        "drift_ppm_max": float(np.nanmax(drift_ppm)),
+        "residual_rms": float(np.sqrt(np.mean(matched_res ** 2))) if len(matched_res) else None,
+        "offset_jumps": [{"trigger": int(triggers[anchors[i + 1]]), "jump": float(jump)}
+                         for i, jump in zip(jump_idx, jumps)],
+        "slipped_triggers": int(np.count_nonzero(shift)),
+        # triggers whose telescope timestamp fits neither their own nor a neighbouring DUT timestamp
+        "mismatched_triggers": int(len(x) - len(matched_res) - np.count_nonzero(shift)),
+        "slips": slips,
+    })
+    # (triggers missing from one of the trees, e.g. by telescope inefficiency, do not break the sync)
+    report["sync_ok"] = bool(not slips and not report["offset_jumps"] and
+                             report["mismatched_triggers"] <= MAX_MISMATCHED_FRACTION * len(x))
+
+    fits = {"triggers": triggers, "residuals": residuals, "shift": shift,
+            "window_triggers": triggers[anchors[np.minimum(starts + window // 2, len(xa) - 1)]],
+            "drift_ppm": drift_ppm}
+    return report, fits
+
+
+def get_tolerance(residuals, y):
+    """
+    Time tolerance of a match: TOLERANCE_SIGMAS robust standard deviations (from the median absolute deviation) of
+    the residuals, at most TOLERANCE_FRACTION of the median time between triggers (so that neighbouring triggers
+    can still be told apart) and at least TOLERANCE_MIN.
+
+    :param numpy.ndarray residuals: residuals of the timestamps from a robust fit
+    :param numpy.ndarray y: timestamps (in trigger order)
+    :return: float
+    """
+    sigma = 1.4826 * float(np.median(np.abs(residuals - np.median(residuals))))
+    intervals = np.diff(y)
+    intervals = intervals[intervals > 0]
+    upper = TOLERANCE_FRACTION * float(np.median(intervals)) if len(intervals) else np.inf
+    return max(min(TOLERANCE_SIGMAS * sigma, upper), TOLERANCE_MIN)
+
+
+def rolling_median_fits(x, y, window):
+    """
+    Robust linear fits of y(x) in windows of consecutive entries (see rolling_linear_fits): the slope is the median
+    of the slopes between consecutive entries, and the intercept the median of y - slope * x, so up to half of the
+    entries of a window can be outliers.
+
+    :param numpy.ndarray x: x values
+    :param numpy.ndarray y: y values
+    :param int window: number of entries per window
+    :return: window starts, slopes, intercepts (numpy.ndarrays)
+    """
+    starts = window_starts(len(x), window)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        local = np.diff(y) / np.diff(x)
+    local = np.append(local, np.nan)  # (one value less than entries)
+    slope = np.nanmedian(sliding_window_view(local, window)[starts][:, :-1], axis=1)
+    xw = sliding_window_view(x, window)[starts]
+    yw = sliding_window_view(y, window)[starts]
+    # centred on the window's first entry, so large timestamps keep their precision
+    intercept = np.median(yw - yw[:, :1] - slope[:, None] * (xw - xw[:, :1]), axis=1)
+    intercept += yw[:, 0] - slope * xw[:, 0]
+    return starts, slope, intercept
+
+
+def find_offset_jumps(x, y, slope, intercept, tolerance, n_level=JUMP_LEVEL_TRIGGERS):
+    """
+    Find offset jumps: the residual of the telescope timestamps changes by more than the tolerance between
+    consecutive triggers, and stays at its new level. The levels are the medians of the residuals of the n_level
+    triggers before and after (from the fit of the trigger before the jump); a jump is only reported if the
+    residuals on both sides are consistent (median absolute deviation within the tolerance), so that slipped
+    triggers are not taken for jumps.
+
+    :param numpy.ndarray x: DUT timestamps of the matched triggers (in trigger number order)
+    :param numpy.ndarray y: telescope timestamps of the matched triggers
+    :param numpy.ndarray slope: slope of the fit of every trigger (see nearest_window)
+    :param numpy.ndarray intercept: intercept of the fit of every trigger
+    :param float tolerance: largest difference between a telescope timestamp and its prediction for a match
+    :param int n_level: number of triggers on each side used to measure the levels
+    :return: numpy.ndarray of the last trigger index before each jump, numpy.ndarray of the jumps
+    """
+    # candidates: residuals of consecutive triggers differ by more than the tolerance
+    candidates = np.flatnonzero(np.abs(np.diff(y - (slope * x + intercept))) > tolerance)
+    candidates = candidates[(candidates >= n_level - 1) & (candidates < len(y) - n_level - 1)]
+    if len(candidates) == 0:
+        return candidates, np.zeros(0)
+    s, c = slope[candidates, None], intercept[candidates, None]
+    before_idx = candidates[:, None] + np.arange(-n_level + 1, 1)
+    after_idx = candidates[:, None] + np.arange(1, n_level + 1)
+    before = y[before_idx] - (s * x[before_idx] + c)
+    after = y[after_idx] - (s * x[after_idx] + c)
+    level_before, level_after = np.median(before, axis=1), np.median(after, axis=1)
+    consistent = ((np.median(np.abs(before - level_before[:, None]), axis=1) <= tolerance) &
+                  (np.median(np.abs(after - level_after[:, None]), axis=1) <= tolerance))
+    jumps = level_after - level_before
+    is_jump = consistent & (np.abs(jumps) > tolerance)
+    return candidates[is_jump], jumps[is_jump]
+
+
+def window_starts(n, window):
+    """
+    First entry of each window: windows start every window // 2 entries, and the last window ends at the last entry.
+
+    :param int n: number of entries
+    :param int window: number of entries per window
+    :return: numpy.ndarray
+    """
+    step = max(window // 2, 1)
+    starts = np.arange(0, n - window + 1, step)
+    if starts[-1] != n - window:
+        starts = np.append(starts, n - window)
+    return starts
+
+
+def rolling_linear_fits(x, y, window, weights=None):
+    """
+    Least-squares linear fits of y(x) in windows of consecutive entries, all computed at once (see window_starts).
+    Each window is centred before fitting, so large timestamps keep their precision.
+
+    :param numpy.ndarray x: x values
+    :param numpy.ndarray y: y values
+    :param int window: number of entries per window
+    :param numpy.ndarray weights: optional weights (e.g. boolean mask of entries to use)
+    :return: window starts, slopes, intercepts (numpy.ndarrays. NaN for windows without enough entries)
+    """
+    starts = window_starts(len(x), window)
+    weights = np.ones(len(x)) if weights is None else np.asarray(weights, dtype=float)
+    xw = sliding_window_view(x, window)[starts]
+    yw = sliding_window_view(y, window)[starts]
+    ww = sliding_window_view(weights, window)[starts]
+
+    sum_w = ww.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        x_mean = (ww * xw).sum(axis=1) / sum_w
+        y_mean = (ww * yw).sum(axis=1) / sum_w
+        dx = xw - x_mean[:, None]
+        dy = yw - y_mean[:, None]
+        slope = (ww * dx * dy).sum(axis=1) / (ww * dx ** 2).sum(axis=1)
+    intercept = y_mean - slope * x_mean
+    return starts, slope, intercept
+
+
+def nearest_window(n, starts, window):
+    """
+    Index of the window centred nearest to every entry.
+
+    :param int n: number of entries
+    :param numpy.ndarray starts: window starts (see window_starts)
+    :param int window: number of entries per window
+    :return: numpy.ndarray
+    """
+    centres = starts + window / 2
+    idx = np.arange(n)
+    nearest = np.clip(np.searchsorted(centres, idx + 0.5), 0, len(starts) - 1)
+    previous = np.maximum(nearest - 1, 0)
+    closer = np.abs(centres[previous] - idx) < np.abs(centres[nearest] - idx)
+    return np.where(closer, previous, nearest)
+
+
+def predict(x, starts, slope, intercept, window):
+    """
+    Predict y of every entry from the fit of the window centred nearest to it.
+
+    :param numpy.ndarray x: x values
+    :param numpy.ndarray starts: window starts (see rolling_linear_fits)
+    :param numpy.ndarray slope: slope of each window
+    :param numpy.ndarray intercept: intercept of each window
+    :param int window: number of entries per window
+    :return: numpy.ndarray of predicted y values
+    """
+    nearest = nearest_window(len(x), starts, window)
+    return slope[nearest] * x + intercept[nearest]
+
+
+def pair_by_intervals(dut_times, dut_idx, y, max_shift=SLIP_MAX_SHIFT):
+    """
+    Pair the telescope timestamp of every matched trigger with the DUT timestamp it belongs to, from the time
+    intervals to the matched triggers before and after it: the telescope interval of a trigger that slipped by k
+    triggers matches the interval of the DUT timestamps k DUT entries away (times the clock ratio), not its own.
+    Intervals do not depend on the timestamp offset, so triggers are paired without a fit, inside slips of any
+    length. Shifts count DUT entries, so triggers missing from the telescope tree do not change them.
+    A trigger is paired if its intervals match a single shift (not at a slip's edge or at an offset jump).
+
+    :param numpy.ndarray dut_times: DUT timestamps (of all DUT entries, in trigger number order)
+    :param numpy.ndarray dut_idx: DUT entry of every matched trigger
+    :param numpy.ndarray y: telescope timestamps of the matched triggers
+    :param int max_shift: largest shift tested
+    :return: numpy.ndarray of the shift of every trigger (its telescope timestamp belongs to DUT entry
+             dut_idx + shift), boolean numpy.ndarray of the triggers paired
+    """
+    n = len(y)
+    shifts = np.arange(-max_shift, max_shift + 1)
+    # (shifts, triggers) shifted DUT timestamps
+    positions = dut_idx[None, :] + shifts[:, None]
+    inside = (positions >= 0) & (positions < len(dut_times))
+    shifted = dut_times[np.clip(positions, 0, len(dut_times) - 1)]
+    dx, dy = np.diff(shifted, axis=1), np.diff(y)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        own = dx[max_shift] > 0
+        ratio = np.median(dy[own] / dx[max_shift][own]) if np.any(own) else np.nan
+    # (shifts, intervals) differences of the telescope intervals from the shifted DUT intervals
+    diff = np.where(inside[:, 1:] & inside[:, :-1], dy[None, :] - ratio * dx, np.inf)
+    best_diff = diff[np.argmin(np.abs(diff), axis=0), np.arange(n - 1)]
+    if not np.all(np.isfinite(best_diff)):
+        return np.zeros(n, dtype=np.int64), np.zeros(n, dtype=bool)
+    fits = np.abs(diff) <= get_tolerance(best_diff, y)
+    # shifts matching the interval before or after each trigger
+    matching = np.zeros((len(shifts), n), dtype=bool)
+    matching[:, 1:] |= fits
+    matching[:, :-1] |= fits
+    return shifts[np.argmax(matching, axis=0)], matching.sum(axis=0) == 1
+
+
+def _nearest_anchor(anchors, n):
+    """ Index (into anchors) of the anchor nearest to every entry """
+    idx = np.arange(n)
+    after = np.clip(np.searchsorted(anchors, idx), 0, len(anchors) - 1)
+    before = np.maximum(after - 1, 0)
+    return np.where(np.abs(anchors[before] - idx) < np.abs(anchors[after] - idx), before, after)
+
+
+def find_trigger_slips(dut_times, dut_idx, y, slope, intercept, tolerance, max_shift=SLIP_MAX_SHIFT):
+    """
+    Find triggers whose telescope timestamp does not fit their own DUT timestamp but that of a neighbouring
+    DUT entry (shifted by up to max_shift entries).
+
+    :param numpy.ndarray dut_times: DUT timestamps (of all DUT entries, in trigger number order)
+    :param numpy.ndarray dut_idx: DUT entry of every matched trigger
+    :param numpy.ndarray y: telescope timestamps of the matched triggers
+    :param numpy.ndarray slope: slope of the fit of every trigger
+    :param numpy.ndarray intercept: intercept of the fit of every trigger
+    :param float tolerance: largest difference between a telescope timestamp and its prediction for a match
+    :param int max_shift: largest shift tested
+    :return: numpy.ndarray of the shift of each trigger (0 for triggers that fit their own DUT timestamp)
+    """
+    shifts = np.arange(-max_shift, max_shift + 1)
+    # (shifts, triggers) residuals of the telescope timestamps against the shifted DUT timestamps
+    positions = dut_idx[None, :] + shifts[:, None]
+    inside = (positions >= 0) & (positions < len(dut_times))
+    predicted = slope[None, :] * dut_times[np.clip(positions, 0, len(dut_times) - 1)] + intercept[None, :]
+    residuals = np.where(inside, np.abs(y[None, :] - predicted), np.inf)
+    fits = residuals <= tolerance
+    own = fits[max_shift]
+    best = np.argmin(np.where(np.arange(len(shifts))[:, None] == max_shift, np.inf, residuals), axis=0)
+    shift = np.where(~own & fits[best, np.arange(len(y))], shifts[best], 0)
+
+    # triggers that fit both their own and a shifted DUT timestamp (close triggers) are ambiguous: they take the
+    # shift of the triggers around them if both sides agree
+    ambiguous = own & fits[best, np.arange(len(y))]
+    if ambiguous.any():
+        known = np.flatnonzero(~ambiguous)
+        if len(known):
+            idx = np.arange(len(y))
+            prev_known = known[np.clip(np.searchsorted(known, idx) - 1, 0, len(known) - 1)]
+            next_known = known[np.clip(np.searchsorted(known, idx), 0, len(known) - 1)]
+            fill = ambiguous & (shift[prev_known] == shift[next_known]) & (shifts[best] == shift[prev_known])
+            shift = np.where(fill, shift[prev_known], shift)
+    return shift
+
+
+def _slip_segments(shift, triggers, min_triggers=SLIP_MIN_TRIGGERS, max_gap=SLIP_MAX_GAP):
+    """
+    Group the triggers with the same non-zero shift into slips. Triggers of the same shift separated by at most
+    max_gap other triggers are a single slip (a trigger missing from one of the trees breaks a slip up: the triggers
+    next to it fit neither their own nor the slipped DUT timestamp, or fit another shift).
+
+    :param numpy.ndarray shift: shift of each trigger (see find_trigger_slips)
+    :param numpy.ndarray triggers: trigger number of each trigger
+    :param int min_triggers: minimal number of slipped triggers of a slip
+    :param int max_gap: largest number of other triggers between two triggers of the same shift of a slip
+    :return: list of dicts of first trigger, last trigger, shift and number of slipped triggers of each slip
+             (ordered by first trigger)
+    """
+    slips = []
+    for value in np.unique(shift[shift != 0]):
+        idx = np.flatnonzero(shift == value)
+        # a trigger continues the slip of the previous trigger of the same shift if at most max_gap triggers apart
+        first = np.concatenate([[True], np.diff(idx) > max_gap + 1])
+        last = np.concatenate([first[1:], [True]])
+        num_slipped = np.diff(np.append(np.flatnonzero(first), len(idx)))
+        keep = num_slipped >= min_triggers
+        slips += [{"first_trigger": int(triggers[start]), "last_trigger": int(triggers[stop]),
+                   "shift": int(value), "triggers": int(count)}
+                  for start, stop, count in zip(idx[first][keep], idx[last][keep], num_slipped[keep])]
+    return sorted(slips, key=lambda slip: slip["first_trigger"])
+
+
+def _valid_sorted(triggers, times):
+    """ Entries with a valid (non-negative) trigger number, sorted by trigger number """
+    triggers = np.asarray(triggers).astype(np.int64)
+    times = np.asarray(times, dtype=np.float64)
+    valid = triggers >= 0
+    triggers, times = triggers[valid], times[valid]
+    order = np.argsort(triggers, kind="stable")
+    return triggers[order], times[order]
+
+
+def plot_sync_summary(fits, report, filename):
+    """
+    Plot the residuals of the telescope timestamps, the clock drift of each window and the trigger slips against
+    the trigger number in a single figure.
+
+    :param dict fits: per-trigger and per-window arrays (see sync_stats)
+    :param dict report: sync report (see sync_stats)
+    :param str filename: path of output '.png' file
+    :return:
+    """
+    if fits is None:
+        print("Not enough matched triggers to plot")
+        return
+    fig, ax = plt.subplots(3, 1, figsize=(12, 10), sharex=True, constrained_layout=True)
+    ax[0].plot(fits["triggers"], fits["residuals"], ",", rasterized=True)
+    tolerance = report["tolerance"]
+    for limit in (-tolerance, tolerance):
+        ax[0].axhline(limit, color="gray", linewidth=0.5, linestyle="--")
+    ax[0].set_ylabel("Telescope timestamp residual\n(offset jumps removed)")
+    ax[0].set_yscale("symlog", linthresh=max(tolerance, 1e-12))
+    ax[1].plot(fits["window_triggers"], fits["drift_ppm"], ".-")
+    ax[1].set_ylabel("Clock ratio deviation [ppm]")
+    for jump in report["offset_jumps"]:
+        ax[1].axvline(jump["trigger"], color="red", linewidth=0.8)
+    ax[2].plot(fits["triggers"], fits["shift"], drawstyle="steps-post")
+    ax[2].set_ylabel("Trigger slip [triggers]")
+    ax[2].set_xlabel("Trigger number")
+    status = "OK" if report["sync_ok"] else "NOT OK"
+    fig.suptitle(f"Run {report.get('run', '')} DUT/telescope sync: {status} - clock ratio "
+                 f"{report['clock_ratio']:.9g}, {len(report['slips'])} slips, "
+                 f"{len(report['offset_jumps'])} offset jumps")
+    for axis in ax:
+        axis.grid(alpha=0.5)
+    fig.savefig(filename)
+    plt.close(fig)
+
+
+def print_sync_report(report):
+    """
+    Print a sync report (see sync_stats).
+
+    :param dict report: sync report
+    :return:
+    """
+    print("\nDUT/telescope sync check:")
+    print(f"Triggers - DUT: {report['dut_triggers']}, telescope: {report['tele_triggers']}, "
+          f"matched: {report['matched']}")
+    print(f"Unmatched triggers - DUT: {report['dut_unmatched']}, telescope: {report['tele_unmatched']}")
+    if "clock_ratio" in report:
+        print(f"Clock ratio (telescope/DUT): {report['clock_ratio']:.9g}, offset: {report['offset']:.6g}")
+        print(f"Drift of the clock ratio: {report['drift_ppm_min']:.3g} to {report['drift_ppm_max']:.3g} ppm")
+        residual_rms = f"{report['residual_rms']:.3g}" if report["residual_rms"] is not None else "n/a"
+        print(f"Residual RMS: {residual_rms} (tolerance {report['tolerance']:.3g}), "
+              f"triggers outside the tolerance: {report['mismatched_triggers']}")
+        for jump in report["offset_jumps"]:
+            print(f"Offset jump of {jump['jump']:.6g} at trigger {jump['trigger']}")
+        for slip in report["slips"]:
+            print(f"Trigger slip of {slip['shift']} triggers: triggers {slip['first_trigger']} to "
+                  f"{slip['last_trigger']} ({slip['triggers']} slipped triggers)")
+    print(f"Sync {'OK' if report['sync_ok'] else 'NOT OK'}")
+
+
+if __name__ == "__main__":
+
+    matplotlib.use("Agg")
+    arg_params = [["-r", "--runnum", int, "the run number"],
+                  ["-w", "--window", int, f"number of paired triggers per linear fit (default {SYNC_WINDOW})"]]
+    args = utils.get_args(arg_params)
+    check_sync(args.runnum, window=args.window if args.window else SYNC_WINDOW)
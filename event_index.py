@@ -0,0 +1,111 @@
+""" Per-run index of the events in a flattened hit table, for O(1) lookup of the hits of single events """
+import os
+import numpy as np
+
+
+class EventIndex:
+    """
+    Maps event IDs (TLU numbers) to the rows of their hits in a flattened hit table.
+    The hits of each event must be contiguous in the table (as written by df_handling.flatten_calo_arrays).
+    Lookups go through a dense table indexed by event ID - min event ID, so they take constant time.
+    """
+    def __init__(self, event_ids, starts, stops, shower_energy=None):
+        """
+        :param numpy.ndarray event_ids: event IDs, in table order
+        :param numpy.ndarray starts: first row of each event
+        :param numpy.ndarray stops: row after the last row of each event
+        :param numpy.ndarray shower_energy: optional shower energy of each event (to find the most energetic events)
+        """
+        self.event_ids = np.asarray(event_ids, dtype=np.int64)
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.stops = np.asarray(stops, dtype=np.int64)
+        self.shower_energy = None if shower_energy is None else np.asarray(shower_energy)
+        self._min_id = int(self.event_ids.min()) if len(self.event_ids) else 0
+        span = int(self.event_ids.max()) - self._min_id + 1 if len(self.event_ids) else 0
+        self._position = np.full(span, -1, dtype=np.int64)
+        self._position[self.event_ids - self._min_id] = np.arange(len(self.event_ids))
+
+    def __len__(self):
+        return len(self.event_ids)
+
+    @classmethod
+    def from_hits(cls, event_ids, shower_energy=None):
+        """
+        Build the index from the event ID column of a hit table (one value per hit).
+
+        :param numpy.ndarray event_ids: event ID of every hit, in table order
+        :param numpy.ndarray shower_energy: optional shower energy of every hit (constant within an event)
+        :return: EventIndex
+        """
+        event_ids = np.asarray(event_ids)
+        if len(event_ids) == 0:
+            return cls(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+        # an event starts where the event ID changes
+        starts = np.flatnonzero(np.concatenate([[True], event_ids[1:] != event_ids[:-1]]))
+        stops = np.append(starts[1:], len(event_ids))
+        ids = event_ids[starts]
+        if len(np.unique(ids)) != len(ids):
+            raise ValueError("The hits of each event must be contiguous in the hit table")
+        energy = None if shower_energy is None else np.asarray(shower_energy)[starts]
+        return cls(ids, starts, stops, energy)
+
+    def rows(self, event_id):
+        """
+        Rows of the hits of an event.
+
+        :param int event_id: event ID
+        :return: (start, stop) row range, or None if the event has no hits in the table
+        """
+        pos = event_id - self._min_id
+        if pos < 0 or pos >= len(self._position) or self._position[pos] < 0:
+            return None
+        i = self._position[pos]
+        return int(self.starts[i]), int(self.stops[i])
+
+    def top_events(self, n):
+        """
+        Event IDs of the n events with the highest shower energy (highest first).
+
+        :param int n: number of events
+        :return: numpy.ndarray of event IDs
+        """
+        if self.shower_energy is None:
+            raise ValueError("The index was built without shower energies")
+        n = min(n, len(self))
+        top = np.argpartition(-self.shower_energy, n - 1)[:n] if n > 0 else np.zeros(0, dtype=np.int64)
+        return self.event_ids[top[np.argsort(-self.shower_energy[top], kind="stable")]]
+
+    def save(self, filename, source=None):
+        """
+        Save the index to a '.npz' file.
+
+        :param str filename: path to output file
+        :param dict source: optional fingerprint of the hit table the index was built from (see load)
+        :return:
+        """
+        arrays = {"event_ids": self.event_ids, "starts": self.starts, "stops": self.stops,
+                  "source": np.array(repr(sorted(source.items())) if source else "")}
+        if self.shower_energy is not None:
+            arrays["shower_energy"] = self.shower_energy
+        os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+        tmp_file = filename + ".tmp.npz"
+        np.savez(tmp_file, **arrays)
+        os.replace(tmp_file, filename)
+
+    @classmethod
+    def load(cls, filename, source=None):
+        """
+        Load an index saved with EventIndex.save.
+
+        :param str filename: path to '.npz' file
+        :param dict source: optional fingerprint of the current hit table. The index is only returned if it was
+                            saved with the same fingerprint
+        :return: EventIndex, or None if the file does not exist or the hit table changed
+        """
+        if not os.path.exists(filename):
+            return None
+        with np.load(filename) as npz:
+            if source is not None and npz["source"].item() != repr(sorted(source.items())):
+                return None
+            return cls(npz["event_ids"], npz["starts"], npz["stops"],
+                       npz["shower_energy"] if "shower_energy" in npz.files else None)
@@ -0,0 +1,492 @@
+""" Histograms of a run, filled in a single pass over the flattened hits (and incrementally, chunk by chunk) """
+import os
+import json
+from functools import partial
+import numpy as np
+import uproot
+from uproot.writing.identify import to_TH1x, to_TH2x, to_TAxis, to_THashList, to_TObjString
+from .instrumentation import instrumented
+from .shared_hits import SharedHitTable
+from .tb_helpers_v2025 import channel_to_sensor_coord
+from .run_params import PLANE_COL, CHANNEL_COL, AMPLITUDE_COL, EVENT_ID_COL, PLANE_ENERGY_COL, SHOWER_ENERGY_COL
+from .run_params import ROWS, COLS, LAYERS, LAYERS_NAMES, CHANNELS, ADC_RANGE, LAYER_ENERGY_BIN_STEP
+from .run_params import SHOWER_ENERGY_BIN_STEP, STORE_VERSION
+
+HIST_ARRAY_KEYS = ["counts", "entries", "sum", "sum2", "min", "max"]
+HIST_COLUMNS = [EVENT_ID_COL, PLANE_COL, CHANNEL_COL, AMPLITUDE_COL, PLANE_ENERGY_COL, SHOWER_ENERGY_COL]  # fill_df
+
+
+class HistArray:
+    """
+    An array of 1D histograms with identical binning.
+    Entries, mean and std are kept from exact running sums (including values outside the binned range,
+    which are counted in the first/last bin).
+    """
+    def __init__(self, shape, bin_step, value_range):
+        """
+        :param tuple shape: shape of the array of histograms
+        :param bin_step: bin width
+        :param tuple value_range: (low edge of first bin, high edge of last bin)
+        """
+        self.shape = tuple(shape)
+        self.bin_step = bin_step
+        self.low = value_range[0]
+        n_bins = int((value_range[1] - value_range[0]) // bin_step) + 1
+        self.counts = np.zeros(self.shape + (n_bins,), dtype=np.int64)
+        self.entries = np.zeros(self.shape, dtype=np.int64)
+        self.sum = np.zeros(self.shape)
+        self.sum2 = np.zeros(self.shape)
+        self.min = np.full(self.shape, np.inf)
+        self.max = np.full(self.shape, -np.inf)
+        self._stats = None
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """
+        Create histograms from saved arrays (see to_arrays).
+
+        :param dict arrays: dict of numpy.ndarrays
+        :return: HistArray
+        """
+        hist = cls.__new__(cls)
+        for key in HIST_ARRAY_KEYS:
+            setattr(hist, key, arrays[key])
+        hist.shape = hist.entries.shape
+        hist.bin_step = arrays["bin_step"].item()
+        hist.low = arrays["low"].item()
+        hist._stats = None
+        return hist
+
+    def to_arrays(self):
+        """
+        Get all contents as a dict of numpy.ndarrays (for saving).
+
+        :return: dict of numpy.ndarrays
+        """
+        arrays = {key: getattr(self, key) for key in HIST_ARRAY_KEYS}
+        arrays["bin_step"] = np.array(self.bin_step)
+        arrays["low"] = np.array(self.low)
+        return arrays
+
+    def fill(self, idx, values):
+        """
+        Add values to the histograms.
+
+        :param numpy.ndarray idx: flat index of the histogram of each value (see numpy.ravel_multi_index)
+        :param numpy.ndarray values: values to add
+        :return:
+        """
+        idx = np.asarray(idx, dtype=np.int64)
+        values = np.asarray(values)
+        n_bins = self.counts.shape[-1]
+        value_bin = np.clip(np.floor((values - self.low) / self.bin_step).astype(np.int64), 0, n_bins - 1)
+        self.counts += np.bincount(idx * n_bins + value_bin, minlength=self.counts.size).reshape(self.counts.shape)
+
+        size = self.entries.size
+        self.entries += np.bincount(idx, minlength=size).reshape(self.shape)
+        self.sum += np.bincount(idx, weights=values, minlength=size).reshape(self.shape)
+        self.sum2 += np.bincount(idx, weights=values.astype(float) ** 2, minlength=size).reshape(self.shape)
+        np.minimum.at(self.min.reshape(-1), idx, values)
+        np.maximum.at(self.max.reshape(-1), idx, values)
+        self._stats = None
+
+    def merge(self, other):
+        """
+        Add the contents of another (identically binned) HistArray.
+
+        :param HistArray other: histograms to add
+        :return:
+        """
+        self.counts += other.counts
+        self.entries += other.entries
+        self.sum += other.sum
+        self.sum2 += other.sum2
+        np.minimum(self.min, other.min, out=self.min)
+        np.maximum(self.max, other.max, out=self.max)
+        self._stats = None
+
+    def stats(self):
+        """
+        Statistics of all histograms, computed at once.
+        x_lim_max is the upper x-axis limit used for plotting (mean + 5 std) and overflow counts the entries of the
+        bins above the bin of x_lim_max: exact for integer values binned with bin_step 1, otherwise entries above
+        x_lim_max in its bin are not counted (see HistCube.overflow for the exact counts of the energy histograms).
+
+        :return: dict of numpy.ndarray of the array's shape: entries, mean, std, min, max, x_lim_max, overflow
+        """
+        if self._stats is None:
+            with np.errstate(invalid="ignore", divide="ignore"):
+                mean = self.sum / self.entries
+                std = np.sqrt(np.maximum(self.sum2 / self.entries - mean ** 2, 0))
+            x_lim_max = mean + 5 * std
+            # count entries in bins above x_lim_max: tail sums of the histograms
+            tail = np.cumsum(self.counts[..., ::-1], axis=-1)[..., ::-1]
+            tail = np.concatenate([tail, np.zeros(self.shape + (1,), dtype=tail.dtype)], axis=-1)
+            first_bin = np.floor((np.nan_to_num(x_lim_max) - self.low) / self.bin_step).astype(np.int64) + 1
+            first_bin = np.clip(first_bin, 0, tail.shape[-1] - 1)
+            overflow = np.take_along_axis(tail, first_bin[..., None], axis=-1)[..., 0]
+            overflow[~(x_lim_max > self.min)] = 0  # no x-axis limits are set in that case
+            self._stats = {"entries": self.entries, "mean": mean, "std": std, "min": self.min, "max": self.max,
+                           "x_lim_max": x_lim_max, "overflow": overflow}
+        return self._stats
+
+    def hist(self, idx=()):
+        """
+        Get a single histogram, trimmed to the range of its data (starting at 0 for non-negative data).
+
+        :param idx: index of the histogram in the array
+        :return: bin counts, bin edges (numpy.ndarrays). Empty arrays if the histogram has no entries.
+        """
+        if self.entries[idx] == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        n_bins = self.counts.shape[-1]
+        first = int(np.clip((min(self.min[idx], 0) - self.low) // self.bin_step, 0, n_bins - 1))
+        last = int(np.clip((self.max[idx] - self.low) // self.bin_step, 0, n_bins - 1))
+        counts = self.counts[idx][first:last + 1]
+        edges = self.low + np.arange(first, last + 2) * self.bin_step
+        return counts, edges
+
+    def x_lim(self, idx=()):
+        """
+        x-axis limits of a histogram: (min, mean + 5 std).
+
+        :param idx: index of the histogram in the array
+        :return: tuple of limits, or None if they cannot be set
+        """
+        stats = self.stats()
+        x_min, x_max = stats["min"][idx], stats["x_lim_max"][idx]
+        if x_max > x_min:
+            return x_min, x_max
+        return None
+
+    def to_th1(self, name, title, idx=(), x_label="", y_label="Entries"):
+        """
+        Get a single histogram as a ROOT TH1D (for writing with uproot), with the exact entries, mean and std.
+
+        :param str name: name of the histogram
+        :param str title: title of the histogram
+        :param idx: index of the histogram in the array
+        :param str x_label: title of the x-axis
+        :param str y_label: title of the y-axis
+        :return: uproot TH1D model
+        """
+        counts = self.counts[idx].astype(float)
+        n_bins = len(counts)
+        # values outside the binned range are already counted in the first/last bin: under/overflow are empty
+        data = np.concatenate([[0.0], counts, [0.0]])
+        x_axis = to_TAxis("xaxis", x_label, n_bins, self.low, self.low + n_bins * self.bin_step)
+        entries = float(self.entries[idx])
+        return to_TH1x(name, title, data, entries, entries, entries, float(self.sum[idx]), float(self.sum2[idx]),
+                       data, x_axis, _label_axis("yaxis", y_label))
+
+    def plot_spec(self, idx=(), overflow=None):
+        """
+        Get the data arguments of plotting.plot_1d_hist_binned for a single histogram.
+
+        :param idx: index of the histogram in the array
+        :param int overflow: optional exact number of entries above the x-axis limit. default is the count from the
+                             bins (see stats)
+        :return: dict of keyword arguments (counts, edges, entries, mean, std, overflow, x_lim)
+        """
+        counts, edges = self.hist(idx)
+        stats = self.stats()
+        if overflow is None:
+            overflow = stats["overflow"][idx]
+        return dict(counts=counts, edges=edges, entries=stats["entries"][idx], mean=stats["mean"][idx],
+                    std=stats["std"][idx], overflow=overflow, x_lim=self.x_lim(idx))
+
+
+class HistCube:
+    """
+    Histograms of a run: energy of every (layer, channel), energy of every layer (per event) and shower energy,
+    plus the channel occupancy (number of events with a hit) of every layer and the per-event shower and
+    layer energies.
+    Layers and channels are indexed by their number (as numbered by the electronics).
+
+    Filling is additive, so a run can be accumulated chunk by chunk (as long as events are not split).
+    The reduced run can be saved to a single '.npz' file and loaded back for re-plotting.
+    """
+    def __init__(self, adc_range=ADC_RANGE, layer_bin_step=LAYER_ENERGY_BIN_STEP,
+                 shower_bin_step=SHOWER_ENERGY_BIN_STEP):
+        self.n_layers = max(LAYERS) + 1
+        self.n_channels = len(CHANNELS)
+        max_layer_energy = self.n_channels * adc_range[1]
+        self.channels = HistArray((self.n_layers, self.n_channels), 1, adc_range)
+        self.layers = HistArray((self.n_layers,), layer_bin_step, (0, max_layer_energy))
+        self.showers = HistArray((), shower_bin_step, (0, self.n_layers * max_layer_energy))
+        self.occupancy = np.zeros((self.n_layers, self.n_channels), dtype=np.int64)
+        # per-event (event id, shower energy, plane energies) arrays of each fill (energies as int32 ADC counts).
+        # they grow with the number of events filled (about 50 bytes per event), also when a run is streamed
+        self._event_chunks = []
+
+    @classmethod
+    def from_df(cls, df, jobs=1, **kwargs):
+        """
+        Create and fill histograms from a flattened pd.DataFrame.
+        With several jobs, the hits are shared with the worker processes through a memory-mapped table
+        (see shared_hits.SharedHitTable), each worker fills the histograms of a range of events, and the results
+        are merged.
+
+        :param pd.DataFrame df: flattened data (as returned by df_handling.flatten_calo_df)
+        :param int jobs: number of worker processes. 1 (or None) fills in the current process
+        :return: HistCube
+        """
+        if not jobs or jobs <= 1:
+            cube = cls(**kwargs)
+            cube.fill_df(df)
+            return cube
+        with SharedHitTable(df[HIST_COLUMNS]) as table:
+            cubes = table.map(partial(_fill_rows, **kwargs), table.event_ranges(jobs), jobs)
+        cube = cubes[0] if cubes else cls(**kwargs)
+        for other in cubes[1:]:
+            cube.merge(other)
+        return cube
+
+    @instrumented("HistCube.fill_df")
+    def fill_df(self, df):
+        """
+        Fill all histograms from a flattened pd.DataFrame (a whole run or a chunk of whole events).
+
+        :param pd.DataFrame df: flattened data (as returned by df_handling.flatten_calo_df)
+        :return:
+        """
+        planes = df[PLANE_COL].to_numpy().astype(np.int64)
+        channels = df[CHANNEL_COL].to_numpy().astype(np.int64)
+        # ignore hits outside the detector geometry
+        valid = (planes >= 0) & (planes < self.n_layers) & (channels >= 0) & (channels < self.n_channels)
+        planes = planes[valid]
+        channels = channels[valid]
+        _, event_idx = np.unique(df[EVENT_ID_COL].to_numpy()[valid], return_inverse=True)
+        event_idx = event_idx.reshape(-1)
+
+        # channel energies
+        channel_idx = planes * self.n_channels + channels
+        self.channels.fill(channel_idx, df[AMPLITUDE_COL].to_numpy()[valid])
+        # layer energies: one per (event, plane)
+        _, first_hit = np.unique(event_idx * self.n_layers + planes, return_index=True)
+        self.layers.fill(planes[first_hit], df[PLANE_ENERGY_COL].to_numpy()[valid][first_hit])
+        plane_energies = np.zeros((event_idx.max(initial=-1) + 1, self.n_layers), dtype=np.int32)
+        plane_energies[event_idx[first_hit], planes[first_hit]] = df[PLANE_ENERGY_COL].to_numpy()[valid][first_hit]
+        # shower energies: one per event
+        _, first_hit = np.unique(event_idx, return_index=True)
+        shower_energies = df[SHOWER_ENERGY_COL].to_numpy()[valid][first_hit].astype(np.int32)
+        self.showers.fill(np.zeros(len(first_hit), dtype=np.int64), shower_energies)
+        self._event_chunks.append((df[EVENT_ID_COL].to_numpy()[valid][first_hit], shower_energies, plane_energies))
+        # occupancy: one count per (event, plane, channel)
+        n_flat = self.n_layers * self.n_channels
+        occupied = np.unique(event_idx * n_flat + channel_idx) % n_flat
+        self.occupancy += np.bincount(occupied, minlength=n_flat).reshape(self.occupancy.shape)
+
+    def merge(self, other):
+        """
+        Add the contents of another HistCube (e.g. of another chunk of the run).
+
+        :param HistCube other: histograms to add
+        :return:
+        """
+        self.channels.merge(other.channels)
+        self.layers.merge(other.layers)
+        self.showers.merge(other.showers)
+        self.occupancy += other.occupancy
+        self._event_chunks.extend(other._event_chunks)
+
+    def events(self):
+        """
+        Per-event energies of all events filled.
+
+        :return: dict of numpy.ndarrays: event_id, shower_energy, plane_energy (shape (events, layers))
+        """
+        if len(self._event_chunks) != 1:
+            event_ids, showers, planes = zip(*self._event_chunks) if self._event_chunks else ([], [], [])
+            self._event_chunks = [(np.concatenate(event_ids) if event_ids else np.zeros(0, dtype=np.int64),
+                                   np.concatenate(showers) if showers else np.zeros(0, dtype=np.int32),
+                                   np.concatenate(planes) if planes else np.zeros((0, self.n_layers), dtype=np.int32))]
+        event_ids, showers, planes = self._event_chunks[0]
+        return {"event_id": event_ids, "shower_energy": showers, "plane_energy": planes}
+
+    def overflow(self, name, idx=()):
+        """
+        Exact number of entries above the x-axis limit (x_lim_max, see HistArray.stats) of a layer or shower energy
+        histogram, counted from the per-event energies (the bins of these histograms are wider than 1 ADC count).
+
+        :param str name: 'layers' or 'showers'
+        :param idx: layer number for 'layers'
+        :return: int
+        """
+        stats = getattr(self, name).stats()
+        x_lim_max = stats["x_lim_max"][idx]
+        if not x_lim_max > stats["min"][idx]:
+            return 0  # no x-axis limits are set in that case
+        events = self.events()
+        if name == "layers":
+            energies = events["plane_energy"][:, idx]
+            # (layers without hits in an event have zero energy in plane_energy, and are not entries)
+            return int(np.count_nonzero((energies > x_lim_max) & (energies != 0)))
+        return int(np.count_nonzero(events["shower_energy"] > x_lim_max))
+
+    def longitudinal_profile(self):
+        """
+        Average energy in each layer (over events with hits in the layer) and its error, in LAYERS order.
+
+        :return: mean values, errors of the mean (numpy.ndarrays, NaN for layers without events)
+        """
+        stats = self.layers.stats()
+        layers = np.array(LAYERS)
+        entries = stats["entries"][layers]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            errors = stats["std"][layers] / np.sqrt(entries)
+        return stats["mean"][layers], errors
+
+    @instrumented("HistCube.save")
+    def save(self, filename, metadata=None):
+        """
+        Save the histograms to a compressed '.npz' file.
+
+        :param str filename: path to output file
+        :param dict metadata: optional JSON-serializable information saved with the histograms
+        :return:
+        """
+        arrays = {"store_version": np.array(STORE_VERSION), "occupancy": self.occupancy,
+                  "metadata": np.array(json.dumps(metadata if metadata is not None else {}))}
+        for name in ("channels", "layers", "showers"):
+            for key, arr in getattr(self, name).to_arrays().items():
+                arrays[f"{name}__{key}"] = arr
+        for key, arr in self.events().items():
+            arrays[f"events__{key}"] = arr
+        profile_mean, profile_err = self.longitudinal_profile()
+        arrays["profile__mean"] = profile_mean
+        arrays["profile__error"] = profile_err
+
+        os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+        tmp_file = filename + ".tmp.npz"
+        np.savez_compressed(tmp_file, **arrays)
+        os.replace(tmp_file, filename)
+
+    @instrumented("HistCube.save_root")
+    def save_root(self, filename, title=""):
+        """
+        Write all histograms to a single ROOT file (TH1D/TH2D, readable with ROOT or uproot), for analysis outside
+        of this package:
+            shower_energy                                       TH1D
+            layer_energy/layer_slot_<name>                      TH1D per layer
+            channel_energy/layer_slot_<name>/channel_<number>   TH1D per channel
+            occupancy/layer_slot_<name>                         TH2D per layer (column, row of the pads)
+            longitudinal_profile                                TH1D of the mean layer energy (bin errors are the
+                                                                errors of the mean), in LAYERS order
+        The histograms keep the exact entries, mean and std of the data.
+
+        :param str filename: path to output '.root' file
+        :param str title: optional prefix of the histogram titles (e.g. run number)
+        :return:
+        """
+        prefix = f"{title} " if title else ""
+        hists = {"shower_energy": self.showers.to_th1("shower_energy", f"{prefix}Total energy distribution (showers)",
+                                                      x_label="ADC counts")}
+        for i, layer in enumerate(LAYERS):
+            name = f"layer_slot_{LAYERS_NAMES[i]}"
+            hists[f"layer_energy/{name}"] = self.layers.to_th1(
+                name, f"{prefix}Total energy distribution - layer slot {LAYERS_NAMES[i]}", layer, "ADC counts")
+            hists[f"occupancy/{name}"] = _occupancy_th2(name, f"{prefix}Occupancy - layer slot {LAYERS_NAMES[i]}",
+                                                        self.occupancy[layer])
+            for ch in range(self.n_channels):
+                hists[f"channel_energy/{name}/channel_{ch}"] = self.channels.to_th1(
+                    f"channel_{ch}", f"{prefix}Channel {ch} Layer slot {LAYERS_NAMES[i]}", (layer, ch), "ADC counts")
+        profile_mean, profile_err = self.longitudinal_profile()
+        hists["longitudinal_profile"] = _profile_th1("longitudinal_profile", f"{prefix}Average Longitudinal Profile",
+                                                     profile_mean, profile_err, LAYERS_NAMES, x_label="Layer Slot",
+                                                     y_label="ADC Average")
+
+        os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+        tmp_file = filename + ".tmp.root"
+        with uproot.recreate(tmp_file) as file:
+            for path, hist in hists.items():
+                file[path] = hist
+        os.replace(tmp_file, filename)
+        print(f"Saved {len(hists)} histograms to {filename}")
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Load histograms saved with HistCube.save.
+
+        :param str filename: path to '.npz' file
+        :return: HistCube, metadata dict. (None, None) if the file was saved by a different STORE_VERSION
+        """
+        with np.load(filename) as npz:
+            if npz["store_version"].item() != STORE_VERSION:
+                return None, None
+            arrays = {key: npz[key] for key in npz.files}
+        cube = cls.__new__(cls)
+        for name in ("channels", "layers", "showers"):
+            prefix = f"{name}__"
+            setattr(cube, name, HistArray.from_arrays({key[len(prefix):]: arr for key, arr in arrays.items()
+                                                       if key.startswith(prefix)}))
+        cube.n_layers, cube.n_channels = cube.channels.shape
+        cube.occupancy = arrays["occupancy"]
+        cube._event_chunks = [(arrays["events__event_id"], arrays["events__shower_energy"].astype(np.int32, copy=False),
+                               arrays["events__plane_energy"].astype(np.int32, copy=False))]
+        return cube, json.loads(arrays["metadata"].item())
+
+
+def _fill_rows(df, rows, **kwargs):
+    """
+    Fill histograms from a row range of a flattened hit table (run by SharedHitTable workers).
+
+    :param pd.DataFrame df: flattened data
+    :param tuple rows: (start, stop) row range of whole events
+    :return: HistCube
+    """
+    start, stop = rows
+    return HistCube.from_df(df.iloc[start:stop], **kwargs)
+
+
+def _occupancy_th2(name, title, occupancy):
+    """
+    Get the channel occupancy of a layer as a ROOT TH2D of the pads (x: column, y: row).
+
+    :param str name: name of the histogram
+    :param str title: title of the histogram
+    :param numpy.ndarray occupancy: number of events with a hit per channel
+    :return: uproot TH2D model
+    """
+    cols, rows = channel_to_sensor_coord(np.arange(len(occupancy)))
+    counts = np.zeros((COLS + 2, ROWS + 2))  # with under/overflow bins
+    counts[cols + 1, rows + 1] = occupancy
+    x_axis = to_TAxis("xaxis", "Column", COLS, -0.5, COLS - 0.5)
+    y_axis = to_TAxis("yaxis", "Row", ROWS, -0.5, ROWS - 0.5)
+    weights = occupancy.astype(float)
+    data = counts.T.reshape(-1)  # ROOT bin order: x fastest
+    total = float(weights.sum())
+    return to_TH2x(name, title, data, total, total, total, float(weights @ cols), float(weights @ cols ** 2),
+                   float(weights @ rows), float(weights @ rows ** 2), float(weights @ (cols * rows)), data,
+                   x_axis, y_axis, _label_axis("zaxis", "Events with a hit"))
+
+
+def _profile_th1(name, title, values, errors, labels, x_label="", y_label=""):
+    """
+    Get values with errors (e.g. a longitudinal profile) as a ROOT TH1D with one labelled bin per value.
+
+    :param str name: name of the histogram
+    :param str title: title of the histogram
+    :param numpy.ndarray values: bin contents (NaN values are written as empty bins)
+    :param numpy.ndarray errors: bin errors
+    :param list labels: bin labels
+    :param str x_label: title of the x-axis
+    :param str y_label: title of the y-axis
+    :return: uproot TH1D model
+    """
+    values = np.nan_to_num(np.asarray(values, dtype=float))
+    errors = np.nan_to_num(np.asarray(errors, dtype=float))
+    data = np.concatenate([[0.0], values, [0.0]])
+    sumw2 = np.concatenate([[0.0], errors ** 2, [0.0]])
+    x_axis = to_TAxis("xaxis", x_label, len(values), -0.5, len(values) - 0.5,
+                      fLabels=to_THashList([to_TObjString(str(label)) for label in labels]))
+    centers = np.arange(len(values))
+    return to_TH1x(name, title, data, float(len(values)), float(values.sum()), float((values ** 2).sum()),
+                   float(values @ centers), float(values @ centers ** 2), sumw2, x_axis,
+                   _label_axis("yaxis", y_label))
+
+
+def _label_axis(name, label):
+    """ A ROOT axis that only holds a title (for the axes of a histogram that are not binned) """
+    return to_TAxis(name, label, 1, 0.0, 1.0)
@@ -1,12 +1,26 @@
 import gc
 import re
 import os
+import json
 import glob
 import time
+import traceback
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
 from . import utils
 from . import df_handling
 from . import run_params
-from .io_funcs import root_to_df, save_df, load_df
+from .hist_cube import HistCube, HIST_COLUMNS
+from . import instrumentation
+from .instrumentation import instrumented
+from .channel_mask import ChannelStats, detect_bad_channels, save_channel_mask, load_channel_mask, combine_masks
+from .io_funcs import root_to_arrays, iterate_root, get_tree_size, load_df, save_df_cache, load_df_cache
+from .io_funcs import file_fingerprint, read_new_entries, is_df_cache_valid, verify_file_extension, cache_manifest_path
+from .prefetch import RunPrefetcher
+from .plot_renderer import shared_pool
+from .event_index import EventIndex
+from .shower_shape import shower_shapes, SHAPE_COLUMNS
 
 
 class InvalidFileTypeError(ValueError):
@@ -16,7 +30,23 @@ class InvalidFileTypeError(ValueError):
         super().__init__(message)
 
 
-def init_process(file_type, process, res_dir='./analysis_results/', parquet_filter=None):
+def uses_columns(*columns):
+    """
+    Decorator declaring the columns of the flattened data a process needs, e.g. @uses_columns(EVENT_ID_COL, ...).
+    Only the branches needed for them are read from ROOT input files (see df_handling.raw_branches), and only
+    these columns are read from '.parquet' files. Processes without it are given the event ID and hit columns,
+    the energy columns and any other column of '.parquet' input files.
+
+    :param str columns: names of the flattened columns
+    :return: decorator
+    """
+    def decorator(func):
+        func.columns = list(columns)
+        return func
+    return decorator
+
+
+def init_process(file_type, process, res_dir='./analysis_results/', parquet_filter=None, streamable=False):
     """
     Finds run numbers in directory and initializes given process.
 
@@ -24,10 +54,23 @@ def init_process(file_type, process, res_dir='./analysis_results/', parquet_filt
     :param function process: the process to run
     :param str res_dir: relative directory to save results
     :param str parquet_filter: Optional filters for data retrieval from a ".parquet" file
+    :param bool streamable: True if process also accepts a HistCube (allows streaming runs too large for memory)
     :return:
     """
     # get args from user
-    arg_params = [["-r", "--runnum", int, "the run number"]]
+    arg_params = [["-r", "--runnum", int, "the run number"],
+                  ["-j", "--jobs", int, "number of worker processes for histograms and plots (default 1)"],
+                  ["-w", "--workers", int, "number of runs processed in parallel (default 1)"],
+                  ["-a", "--prefetch", int, "number of runs read ahead on a background thread while a run is "
+                                            "processed (default 0)"],
+                  ["-m", "--memory", float, "memory budget per run in GB (larger runs are streamed)"],
+                  ["-f", "--follow", float, "follow a run that is still being taken, polling every FOLLOW seconds"],
+                  ["-p", "--profile", str, "save a profile of each run: 'cpu' (cProfile), 'memory' (tracemalloc) "
+                                           "or 'all'"],
+                  ["-c", "--channel_mask", str, "'auto' to detect and mask hot/dead channels of each run, or path "
+                                                "of a saved channel mask"],
+                  ["-o", "--output", str, "'all' (default) to write the histograms file and render the plots, "
+                                          "or 'root' to only write the histograms file"]]
     args = utils.get_args(arg_params)
 
     # check if run number is given
@@ -42,13 +85,200 @@ def init_process(file_type, process, res_dir='./analysis_results/', parquet_filt
     else:  # specific run given
         run_numbers = [args.runnum]
 
-    # run code for each file
-    for run in run_numbers:
-        # init variables
-        run_dir = res_dir + f"run_{run}/"
-        run_params.init_vars(run, file_type, run_dir, parquet_filter)
-        # init run
-        init_run(process)
+    if args.follow:  # live monitoring of a single run (the given one, or the latest found)
+        if not streamable:
+            print("Follow mode requires a process that accepts a HistCube")
+            return
+        run = max(run_numbers)
+        run_params.init_vars(run, file_type, res_dir + f"run_{run}/", parquet_filter, args.jobs)
+        run_params.CHANNEL_MASK_SOURCE = args.channel_mask
+        run_params.OUTPUT = args.output if args.output else "all"
+        follow_run(process, args.follow)
+        return
+
+    memory_budget = args.memory * 1024 ** 3 if args.memory else run_params.MEMORY_BUDGET
+    run_args = [(run, file_type, res_dir + f"run_{run}/", parquet_filter, args.jobs, memory_budget, process,
+                 streamable, args.profile, args.channel_mask, args.output) for run in run_numbers]
+
+    if args.workers and args.workers > 1 and len(run_numbers) > 1:
+        # run files concurrently, each in its own worker process (with its own run_params state)
+        results = run_batch(run_args, args.workers)
+    elif args.prefetch and len(run_numbers) > 1:
+        # run files one after the other, reading the next runs while each run is processed
+        results = run_prefetched(run_args, args.prefetch)
+    else:
+        # run code for each file
+        results = []
+        for run_arg in run_args:
+            results.append(run_single(*run_arg))
+
+    if len(results) > 1:
+        print_batch_summary(results, res_dir)
+
+
+def run_single(run, file_type, run_dir, parquet_filter, jobs, memory_budget, process, streamable, profile=None,
+               channel_mask=None, output=None, prefetched=None):
+    """
+    Initialize variables of a single run and run the process on it.
+
+    :param int run: run number
+    :param str file_type: ".root" or ".parquet"
+    :param str run_dir: relative directory to save results of the run
+    :param str parquet_filter: Optional filters for data retrieval from a ".parquet" file
+    :param int jobs: number of worker processes for filling histograms and rendering plots
+    :param float memory_budget: memory budget of the run in bytes
+    :param function process: the process to run
+    :param bool streamable: True if process also accepts a HistCube
+    :param str profile: optional profiling of the run: 'cpu', 'memory' or 'all' (see instrumentation.profile)
+    :param str channel_mask: optional 'auto' or path of a saved channel mask (see init_channel_mask)
+    :param str output: 'all' (default) or 'root' (see run_params.OUTPUT)
+    :param dict prefetched: optional input of the run read ahead (see read_ahead)
+    :return: dict summarizing the run (see init_run)
+    """
+    # init variables
+    run_params.init_vars(run, file_type, run_dir, parquet_filter, jobs)
+    run_params.MEMORY_BUDGET = memory_budget
+    run_params.PROFILE = profile
+    run_params.CHANNEL_MASK_SOURCE = channel_mask
+    run_params.OUTPUT = output if output else "all"
+    run_params.PREFETCHED = prefetched
+    # init run
+    try:
+        return init_run(process, streamable)
+    finally:
+        run_params.PREFETCHED = None  # release prefetched input that was not used
+
+
+def run_prefetched(run_args, depth):
+    """
+    Process runs one after the other, while the input of the next runs is read (and decompressed) on a background
+    thread (see prefetch.RunPrefetcher), so that the batch time approaches max(reading, processing) instead of
+    their sum. At most depth runs are held in memory besides the run being processed.
+    Stages measured on the prefetch thread (read_ahead) are reported with the run processed while they ran.
+
+    :param list run_args: list of run_single arguments (one tuple per run)
+    :param int depth: number of runs read ahead
+    :return: list of run summaries, in the order of run_args
+    """
+    print(f"Processing {len(run_args)} runs, reading up to {depth} runs ahead")
+    results = []
+    with RunPrefetcher(lambda i: read_ahead(*run_args[i]), range(len(run_args)), depth) as prefetcher:
+        for i, run_arg in enumerate(run_args):
+            results.append(run_single(*run_arg, prefetched=prefetcher.get(i)))
+    return results
+
+
+@instrumented()
+def read_ahead(run, file_type, run_dir, parquet_filter, jobs, memory_budget, process, streamable, *args):
+    """
+    Read the input of a run before it is processed (takes the arguments of run_single).
+    Only reads what the run would read itself - its '.parquet' cache if there is one with the process' columns,
+    otherwise the raw ROOT branches - and nothing for runs that are streamed or loaded from their histogram store.
+    Does not use the run_params state of the run being processed (it runs on the prefetch thread). The cache is
+    validated when the run takes its input (see take_prefetched), as that depends on the run's channel mask.
+
+    :return: dict with the input file, columns and filter it was read for, and the data read ('cache'
+             pd.DataFrame, 'arrays' ak.Array or 'df' pd.DataFrame of a '.parquet' input file). None if nothing
+             was read
+    """
+    input_file = run_params.get_input_file(run, file_type)
+    columns = getattr(process, "columns", None)
+    if columns is None and streamable:
+        columns = HIST_COLUMNS  # (see get_hists)
+    prefetched = {"file": input_file, "columns": columns, "filter": parquet_filter}
+    if streamable and run_params.USE_CACHE and os.path.exists(get_hist_store_path(run_dir, run)):
+        return None
+    if file_type.lower() == ".parquet":
+        prefetched["df"] = df_handling.compact_dtypes(load_df(input_file, filters=parquet_filter, columns=columns))
+        return prefetched
+    if file_type.lower() != ".root":
+        return None
+    if streamable and exceeds_memory_budget(input_file, file_type, run_params.DUT_ROOT_TREE, columns,
+                                            memory_budget):
+        return None
+
+    manifest_file = cache_manifest_path(input_file)
+    if run_params.USE_CACHE and os.path.exists(manifest_file):
+        with open(manifest_file) as f:
+            cached_columns = json.load(f).get("columns", [])
+        if set(columns or cached_columns) <= set(cached_columns):
+            prefetched["cache"] = load_df(verify_file_extension(input_file, ".parquet"), columns=columns)
+            return prefetched
+    prefetched["arrays"] = root_to_arrays(input_file, run_params.DUT_ROOT_TREE,
+                                          branches=df_handling.raw_branches(columns))
+    return prefetched
+
+
+def take_prefetched(input_file, columns=None, parquet_filter=None):
+    """
+    Take the input of the current run read ahead by read_ahead, if it was read for the same file, columns and
+    filter. It is handed over only once.
+
+    :param str input_file: path to input file
+    :param list columns: columns requested
+    :param str parquet_filter: filter requested
+    :return: dict of the prefetched input (see read_ahead), empty if there is none
+    """
+    prefetched = run_params.PREFETCHED
+    if (not prefetched or prefetched["file"] != input_file or prefetched["columns"] != columns or
+            prefetched["filter"] != parquet_filter):
+        return {}
+    run_params.PREFETCHED = None
+    return prefetched
+
+
+def _run_batch_worker(*run_arg):
+    """ Run a single run in a worker process. Failures are returned in the summary instead of being raised. """
+    start_time = time.time()
+    try:
+        return run_single(*run_arg)
+    except Exception as e:
+        traceback.print_exc()
+        return {"run": run_arg[0], "status": _failure_status(e), "events": 0,
+                "time_s": round(time.time() - start_time, 1)}
+
+
+def run_batch(run_args, workers):
+    """
+    Process several runs concurrently on a pool of worker processes.
+
+    :param list run_args: list of run_single arguments (one tuple per run)
+    :param int workers: number of worker processes
+    :return: list of run summaries, in the order of run_args
+    """
+    print(f"Processing {len(run_args)} runs on {workers} workers")
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_run_batch_worker, *run_arg): run_arg[0] for run_arg in run_args}
+        for future in as_completed(futures):
+            run = futures[future]
+            try:
+                results[run] = future.result()
+            except Exception as e:  # worker died (e.g. killed for running out of memory)
+                results[run] = {"run": run, "status": _failure_status(e), "events": 0, "time_s": None}
+    return [results[run_arg[0]] for run_arg in run_args]
+
+
+def _failure_status(error):
+    """ Single line status of a failed run """
+    message = str(error).splitlines()
+    return f"failed: {type(error).__name__}" + (f": {message[0]}" if message else "")
+
+
+def print_batch_summary(results, res_dir):
+    """
+    Print a table of the runs' status, number of events and time, and save it to '<res_dir>batch_summary.csv'.
+
+    :param list results: list of run summaries (see init_run)
+    :param str res_dir: relative directory to save results
+    :return: pd.DataFrame of the summary
+    """
+    summary = pd.DataFrame(results, columns=["run", "status", "events", "time_s"])
+    print("\nBatch summary:")
+    print(summary.to_string(index=False))
+    os.makedirs(res_dir, exist_ok=True)
+    summary.to_csv(res_dir + "batch_summary.csv", index=False)
+    return summary
 
 
 def get_run_numbers(filename_regex):
@@ -72,14 +302,21 @@ def get_run_numbers(filename_regex):
     return runs
 
 
-def init_run(func_to_run):
+def init_run(func_to_run, streamable=False):
     """
     Initializing function for each file.
     Opens input file and extracts data to a pd.DataFrame.
     Runs given code using that df.
+    If func_to_run is streamable, it is given the run's HistCube instead (loaded from the run's histogram store
+    if it is up to date; otherwise built - in chunks if the run is too large for run_params.MEMORY_BUDGET - and
+    saved to the store).
+    Wall time, CPU time, calls and peak memory of each stage (data reading, flattening, plotting functions...)
+    are saved to 'run_<run number>_stages.json' in the results directory (see instrumentation).
+    If run_params.PROFILE is set, a cProfile/tracemalloc profile of the run is saved there too.
 
     :param function func_to_run: A function of the desired procedure to occur (the "analysis manager")
-    :return:
+    :param bool streamable: True if func_to_run also accepts a HistCube
+    :return: dict summarizing the run: run number, status, number of events and execution time in seconds
     """
 
     # print args
@@ -89,37 +326,184 @@ def init_run(func_to_run):
 
     # start timing
     start_time = time.time()
+    status = "ok"
+    num_events = 0
+    instrumentation.reset()
+    run_prefix = run_params.RESULTS_DIR + f"run_{run_params.RUN_NUM}"
+    if run_params.PROFILE:
+        profiler = instrumentation.profile(run_prefix, run_params.PROFILE)
+    else:
+        profiler = contextlib.nullcontext()
 
     try:
-        # get TB data
-        df = get_data(run_params.DUT_INPUT_FILE, run_params.INPUT_FILE_TYPE,
-                      root_tree=run_params.DUT_ROOT_TREE, parquet_filter=run_params.PARQUET_FILTER)
-
-        # Create folders for plots
-        path = run_params.RESULTS_DIR + "/energy_per_channel"
-        os.makedirs(path, exist_ok=True)  # general run folder
-        for i in range(len(run_params.LAYERS)):
-            os.makedirs(path + f'/layer_slot_{run_params.LAYERS_NAMES[i]}/', exist_ok=True)  # folder for 1D hists
-
-        # run function
-        func_to_run(df)
+        with profiler:
+            # set channels to ignore
+            init_channel_mask(run_params.DUT_INPUT_FILE, run_params.INPUT_FILE_TYPE, run_params.DUT_ROOT_TREE)
+
+            # get TB data (only the columns the process uses, see uses_columns)
+            columns = getattr(func_to_run, "columns", None)
+            if streamable:
+                data = get_hists(run_params.DUT_INPUT_FILE, run_params.INPUT_FILE_TYPE, run_params.DUT_ROOT_TREE,
+                                 parquet_filter=run_params.PARQUET_FILTER, columns=columns)
+            else:
+                data = get_data(run_params.DUT_INPUT_FILE, run_params.INPUT_FILE_TYPE,
+                                root_tree=run_params.DUT_ROOT_TREE, parquet_filter=run_params.PARQUET_FILTER,
+                                columns=columns)
+
+            # Create folders for plots
+            make_plot_dirs()
+
+            # run function
+            num_events = count_events(data)
+            with instrumentation.stage(func_to_run.__name__):
+                func_to_run(data)
     except ZeroDivisionError:
         print(f"Run {run_params.RUN_NUM} failed due to a zero division error")
+        status = "failed: zero division error"
     finally:
         gc.collect()
 
     # time
     execution_time = (time.time() - start_time)
+    summary = {"run": run_params.RUN_NUM, "status": status, "events": num_events, "time_s": round(execution_time, 1)}
+
+    # per stage timing and memory
+    print("\nStages:")
+    instrumentation.save_report(run_prefix + "_stages.json", summary)
 
     # declare successful process and finish
     print("\nDone.")
     print('\nExecution time: ' + str(round(execution_time/60, 1)) + " minutes")
     print("###############################\n")
 
-    return
+    return summary
+
 
+def make_plot_dirs():
+    """
+    Create the folders for the plots of the current run (per-channel plots get a folder per layer).
+
+    :return:
+    """
+    os.makedirs(run_params.RESULTS_DIR, exist_ok=True)  # general run folder
+    if run_params.CHANNEL_PLOTS != "single":
+        return
+    path = run_params.RESULTS_DIR + "/energy_per_channel"
+    for i in range(len(run_params.LAYERS)):
+        os.makedirs(path + f'/layer_slot_{run_params.LAYERS_NAMES[i]}/', exist_ok=True)  # folder for 1D hists
+
+
+def follow_run(func_to_run, poll_interval, max_idle_polls=None):
+    """
+    Live monitoring of a run that is still being taken.
+    Every poll_interval seconds, the events added to the run's input since the last poll are filled into the run's
+    histograms, and func_to_run is run on them (only figures that changed are re-rendered).
+    Stops on Ctrl+C (or after max_idle_polls polls without new events) and saves the run's histograms to their ROOT
+    file and histogram store.
 
-def get_data(input_file, ext, root_tree=None, parquet_filter=None):
+    :param function func_to_run: A function of the desired procedure to occur. Must accept a HistCube
+    :param float poll_interval: seconds between polls
+    :param int max_idle_polls: optional number of polls without new events after which to stop
+    :return: dict summarizing the run (see init_run)
+    """
+    print("###############################")
+    print(f"Following run {run_params.RUN_NUM} (every {poll_interval} s, Ctrl+C to stop)")
+
+    if run_params.INPUT_FILE_TYPE.lower() != ".root":
+        raise InvalidFileTypeError(run_params.INPUT_FILE_TYPE, [".root"])
+
+    start_time = time.time()
+    run_params.FOLLOW_INTERVAL = poll_interval
+    make_plot_dirs()
+    if run_params.CHANNEL_MASK_SOURCE == "auto":
+        print("Hot/dead channels cannot be detected while following a run - only NOISY_CHANNELS are masked")
+        run_params.CHANNEL_MASK = None
+    else:
+        init_channel_mask(run_params.DUT_INPUT_FILE, run_params.INPUT_FILE_TYPE, run_params.DUT_ROOT_TREE)
+    hists = HistCube()
+    entries_read = {}  # input file -> number of entries already filled
+    idle_polls = 0
+    try:
+        # the plot worker processes are started once, and used by every update
+        with shared_pool(run_params.PLOT_JOBS):
+            while max_idle_polls is None or idle_polls < max_idle_polls:
+                poll_time = time.time()
+                num_new = poll_new_events(hists, run_params.DUT_INPUT_FILE, run_params.DUT_ROOT_TREE, entries_read)
+                if num_new:
+                    idle_polls = 0
+                    func_to_run(hists)
+                    print(f"{time.strftime('%H:%M:%S')}: {num_new} new events ({count_events(hists)} in total), "
+                          f"updated in {time.time() - poll_time:.1f} s")
+                else:
+                    idle_polls += 1
+                time.sleep(max(poll_interval - (time.time() - poll_time), 0))
+    except KeyboardInterrupt:
+        print("\nStopped following run")
+    finally:
+        run_params.FOLLOW_INTERVAL = None
+
+    if count_events(hists):
+        # the histograms' ROOT file is not rewritten on every poll
+        hists.save_root(get_hists_root_path(), f"Run {run_params.RUN_NUM}")
+        if run_params.USE_CACHE:
+            params = dict(get_cache_params(), parquet_filter=str(None))
+            save_hist_store(hists, get_hist_store_path(), run_params.DUT_INPUT_FILE, params)
+
+    execution_time = time.time() - start_time
+    print("###############################\n")
+    return {"run": run_params.RUN_NUM, "status": "ok", "events": count_events(hists),
+            "time_s": round(execution_time, 1)}
+
+
+def poll_new_events(hists, input_file, root_tree, entries_read):
+    """
+    Fill the events added to a run's input since the last poll into its histograms.
+    The input is the run's ROOT file or, if it does not exist (yet), the ROOT chunk files in the directory
+    '<input file name without extension>/', in name order.
+
+    :param HistCube hists: histograms of the run
+    :param str input_file: path to input file
+    :param str root_tree: name of relevant ROOT tree
+    :param dict entries_read: input file -> number of entries already filled (updated in place)
+    :return: number of new events
+    """
+    if os.path.exists(input_file):
+        files = [input_file]
+    else:
+        files = sorted(glob.glob(os.path.join(os.path.splitext(input_file)[0], "*.root")))
+
+    num_new = 0
+    for file in files:
+        try:
+            arrays, num_entries = read_new_entries(file, root_tree, entries_read.get(file, 0),
+                                                   branches=df_handling.raw_branches(HIST_COLUMNS))
+        except Exception as e:  # file is still being created - retry on the next poll
+            print(f"Could not read {file} yet ({type(e).__name__})")
+            continue
+        if arrays is None:
+            continue
+        hists.fill_df(df_handling.flatten_calo_arrays(arrays))
+        entries_read[file] = num_entries
+        num_new += len(arrays)
+    return num_new
+
+
+def count_events(data):
+    """
+    Count the events in the data given to a process.
+
+    :param data: flattened pd.DataFrame or HistCube
+    :return: number of events
+    """
+    if isinstance(data, HistCube):
+        return int(data.showers.entries)
+    if data is None or run_params.EVENT_ID_COL not in data.columns:
+        return 0
+    return data[run_params.EVENT_ID_COL].nunique()
+
+
+@instrumented()
+def get_data(input_file, ext, root_tree=None, parquet_filter=None, columns=None, use_cache=None):
     """
     Get data from input file and into a pd.DataFrame
 
@@ -127,16 +511,339 @@ def get_data(input_file, ext, root_tree=None, parquet_filter=None):
     :param str ext: file type.
     :param str root_tree: name of relevant ROOT tree. Needed when ext == '.root'
     :param str parquet_filter: optional filters when extracting data from a '.parquet' file
+    :param list columns: optional list of columns to return (default is all columns). Only the branches needed
+                         for them are read from a '.root' input file (see df_handling.raw_branches)
+    :param bool use_cache: read/write the flattened data from/to a '.parquet' cache next to a '.root' input file.
+                           default is run_params.USE_CACHE
     :return: pd.DataFrame with the data in input_file
     """
+    if use_cache is None:
+        use_cache = run_params.USE_CACHE
+    prefetched = take_prefetched(input_file, columns, parquet_filter)
     if ext.lower() == ".root":
-        orig_df = root_to_df(input_file, root_tree)  # get raw df
-        df = df_handling.flatten_calo_df(orig_df)  # fully flatten df - planeEnergy and showerEnergy columns are added
-        # save_df(df, input_file)  # save flattened DataFrame to .parquet file
+        df = None
+        if use_cache:
+            if "cache" in prefetched and is_df_cache_valid(input_file, get_cache_params(), columns):
+                df = prefetched["cache"]
+            else:
+                df = load_df_cache(input_file, get_cache_params(), columns=columns)
+        if df is None:
+            # get raw jagged arrays of the needed branches
+            arrays = prefetched.get("arrays")
+            if arrays is None:
+                arrays = root_to_arrays(input_file, root_tree, branches=df_handling.raw_branches(columns))
+            df = df_handling.flatten_calo_arrays(arrays)  # fully flatten - adds planeEnergy and showerEnergy
+            if use_cache:
+                save_df_cache(df, input_file, get_cache_params())  # save flattened DataFrame to .parquet file
+            if columns is not None:
+                df = df[columns]
     elif ext.lower() == ".parquet":
-        df = load_df(input_file, filters=parquet_filter)  # get df (file should be the result of the above flattening)
+        # get df (file should be the result of the above flattening)
+        df = prefetched.get("df")
+        if df is None:
+            df = df_handling.compact_dtypes(load_df(input_file, filters=parquet_filter, columns=columns))
     else:
         print(f"Unsupported file type {ext}")
         return
     return df
 
+
+@instrumented()
+def get_event_index(input_file, ext, root_tree=None):
+    """
+    Get the event index of a run's flattened hit table (see event_index.EventIndex).
+    The hit table of a '.root' input file is its '.parquet' cache (built if it is missing or outdated).
+    The index is saved next to the hit table ('<hit table name>_event_index.npz') and rebuilt when the hit table
+    changes.
+
+    :param str input_file: path to input file
+    :param str ext: file type
+    :param str root_tree: name of relevant ROOT tree. Needed when ext == '.root'
+    :return: EventIndex, path of the hit table ('.parquet' file)
+    """
+    if ext.lower() == ".root":
+        table_file = verify_file_extension(input_file, ".parquet")
+        if not is_df_cache_valid(input_file, get_cache_params()):
+            get_data(input_file, ext, root_tree, columns=[run_params.EVENT_ID_COL], use_cache=True)
+    elif ext.lower() == ".parquet":
+        table_file = input_file
+    else:
+        raise InvalidFileTypeError(ext, run_params.ALLOWED_INPUT_EXT)
+
+    index_file = os.path.splitext(table_file)[0] + "_event_index.npz"
+    source = file_fingerprint(table_file, with_hash=False)
+    index = EventIndex.load(index_file, source)
+    if index is None:
+        df = load_df(table_file, columns=[run_params.EVENT_ID_COL, run_params.SHOWER_ENERGY_COL])
+        index = EventIndex.from_hits(df[run_params.EVENT_ID_COL].to_numpy(),
+                                     df[run_params.SHOWER_ENERGY_COL].to_numpy())
+        index.save(index_file, source)
+        print(f"Saved event index {index_file} ({len(index)} events)")
+    return index, table_file
+
+
+@instrumented()
+def get_shower_shapes(input_file, ext, root_tree=None, parquet_filter=None, use_cache=None):
+    """
+    Get the per-event shower shape table of a run (see shower_shape.shower_shapes).
+    The table is cached next to the input file ('<input file name>_shower_shapes.parquet') and rebuilt when the
+    input file or the processing parameters change.
+
+    :param str input_file: path to input file
+    :param str ext: file type
+    :param str root_tree: name of relevant ROOT tree. Needed when ext == '.root'
+    :param str parquet_filter: optional filters when extracting data from a '.parquet' file
+    :param bool use_cache: read/write the table from/to its cache. default is run_params.USE_CACHE
+    :return: pd.DataFrame with one row per event
+    """
+    if use_cache is None:
+        use_cache = run_params.USE_CACHE
+    shapes_file = os.path.splitext(input_file)[0] + "_shower_shapes.parquet"
+    params = dict(get_cache_params(), shape_version=run_params.SHAPE_VERSION, parquet_filter=str(parquet_filter))
+    if use_cache:
+        shapes = load_df_cache(input_file, params, cache_file=shapes_file)
+        if shapes is not None:
+            return shapes
+
+    data = get_data(input_file, ext, root_tree=root_tree, parquet_filter=parquet_filter, columns=SHAPE_COLUMNS)
+    shapes = shower_shapes(data)
+    if use_cache:
+        save_df_cache(shapes, input_file, params, cache_file=shapes_file)
+    return shapes
+
+
+def get_cache_params():
+    """
+    Parameters the flattened data depends on (a change in any of them invalidates cached data).
+
+    :return: dict of parameters
+    """
+    return {"version": run_params.CACHE_VERSION,
+            "noisy_channels": df_handling.channel_mask_to_list(df_handling.get_channel_mask())}
+
+
+@instrumented()
+def init_channel_mask(input_file, ext, root_tree=None, source=None):
+    """
+    Set the channels to ignore in the current run (run_params.CHANNEL_MASK), according to source:
+        - None: only the hand-maintained run_params.NOISY_CHANNELS
+        - 'auto': hot and dead channels are detected from the run's hits (see channel_mask.detect_bad_channels)
+                  and saved to 'run_<run number>_channel_mask.npz' in the results directory. Later passes load
+                  them, unless the input file or the detection thresholds changed.
+        - path of a saved channel mask (e.g. detected on another run): its hot and dead channels
+    run_params.NOISY_CHANNELS are always masked.
+
+    :param str input_file: path to input file
+    :param str ext: file type
+    :param str root_tree: name of relevant ROOT tree. Needed when ext == '.root'
+    :param str source: None, 'auto' or path to '.npz' file. default is run_params.CHANNEL_MASK_SOURCE
+    :return: boolean (layers, channels) numpy.ndarray of masked channels
+    """
+    if source is None:
+        source = run_params.CHANNEL_MASK_SOURCE
+    run_params.CHANNEL_MASK = None
+    if not source:
+        return df_handling.get_channel_mask()
+
+    mask_file = get_channel_mask_path() if source == "auto" else source
+    thresholds = {"hot_factor": run_params.HOT_CHANNEL_FACTOR, "dead_factor": run_params.DEAD_CHANNEL_FACTOR,
+                  "min_counts": run_params.MIN_CHANNEL_COUNTS}
+    input_source = file_fingerprint(input_file, with_hash=False) if os.path.exists(input_file) else None
+    hot = dead = None
+    if os.path.exists(mask_file):
+        hot, dead, params = load_channel_mask(mask_file)
+        if source == "auto" and (params.get("thresholds") != thresholds or
+                                 (input_source is not None and params.get("source") != input_source)):
+            print("Input file or thresholds changed - detecting hot/dead channels again")
+            hot = dead = None
+        else:
+            print(f"Loaded channel mask {mask_file}: {int(hot.sum())} hot and {int(dead.sum())} dead channels")
+    elif source != "auto":
+        raise FileNotFoundError(f"Channel mask {mask_file} not found")
+
+    if hot is None:
+        stats = scan_channels(input_file, ext, root_tree)
+        hot, dead = detect_bad_channels(stats)
+        save_channel_mask(mask_file, hot, dead, stats, {"thresholds": thresholds, "source": input_source})
+    run_params.CHANNEL_MASK = combine_masks(hot, dead)
+    return run_params.CHANNEL_MASK
+
+
+def get_channel_mask_path():
+    """
+    Path of the channel mask of the current run (in its results directory).
+
+    :return: path to '.npz' file
+    """
+    return run_params.RESULTS_DIR + f"run_{run_params.RUN_NUM}_channel_mask.npz"
+
+
+@instrumented()
+def scan_channels(input_file, ext, root_tree=None):
+    """
+    Accumulate the occupancy and amplitude statistics of all channels of a run, from its unmasked hits.
+    ROOT files are read in chunks of run_params.STREAM_STEP_SIZE.
+
+    :param str input_file: path to input file
+    :param str ext: file type
+    :param str root_tree: name of relevant ROOT tree. Needed when ext == '.root'
+    :return: ChannelStats of the run
+    """
+    stats = ChannelStats()
+    prefetched = run_params.PREFETCHED or {}
+    if prefetched.get("file") == input_file and prefetched.get("arrays") is not None:
+        stats.fill_arrays(prefetched["arrays"])  # the run's raw hits were read ahead (see read_ahead)
+    elif ext.lower() == ".root":
+        for arrays in iterate_root(input_file, root_tree, run_params.STREAM_STEP_SIZE,
+                                   branches=df_handling.raw_branches()):
+            stats.fill_arrays(arrays)
+    else:
+        stats.fill_df(load_df(input_file, columns=[run_params.EVENT_ID_COL, run_params.PLANE_COL,
+                                                   run_params.CHANNEL_COL, run_params.AMPLITUDE_COL]))
+    print(f"Scanned {stats.num_events} events for hot/dead channels")
+    return stats
+
+
+def get_hists(input_file, ext, root_tree=None, parquet_filter=None, use_cache=None, columns=None):
+    """
+    Get the histograms (HistCube) of a run.
+    Loaded from the run's histogram store when it is up to date (the input file is not needed in that case).
+    Otherwise they are built from the input file (streamed if needed) and saved to the store.
+
+    :param str input_file: path to input file.
+    :param str ext: file type.
+    :param str root_tree: name of relevant ROOT tree. Needed when ext == '.root'
+    :param str parquet_filter: optional filters when extracting data from a '.parquet' file
+    :param bool use_cache: use the histogram store. default is run_params.USE_CACHE
+    :param list columns: optional list of columns to read (default is the columns HistCube.fill_df uses)
+    :return: HistCube of the run
+    """
+    if use_cache is None:
+        use_cache = run_params.USE_CACHE
+    store_file = get_hist_store_path()
+    params = dict(get_cache_params(), parquet_filter=str(parquet_filter))
+    if use_cache:
+        hists = load_hist_store(store_file, input_file, params)
+        if hists is not None:
+            return hists
+
+    if columns is None:
+        columns = HIST_COLUMNS
+    if exceeds_memory_budget(input_file, ext, root_tree, columns):
+        hists = stream_data(input_file, root_tree, run_params.STREAM_STEP_SIZE, columns)
+    else:
+        hists = HistCube.from_df(get_data(input_file, ext, root_tree=root_tree, parquet_filter=parquet_filter,
+                                          columns=columns), jobs=run_params.PLOT_JOBS)
+    if use_cache:
+        save_hist_store(hists, store_file, input_file, params)
+    return hists
+
+
+def get_hist_store_path(results_dir=None, run=None):
+    """
+    Path of the histogram store of a run (in its results directory).
+
+    :param str results_dir: optional results directory of the run. default is that of the current run
+    :param int run: optional run number. default is the current run
+    :return: path to '.npz' file
+    """
+    if results_dir is None:
+        results_dir, run = run_params.RESULTS_DIR, run_params.RUN_NUM
+    return results_dir + f"run_{run}_hists.npz"
+
+
+def get_hists_root_path():
+    """
+    Path of the ROOT file of the histograms of the current run (in its results directory).
+
+    :return: path to '.root' file
+    """
+    return run_params.RESULTS_DIR + f"run_{run_params.RUN_NUM}_hists.root"
+
+
+def save_hist_store(hists, store_file, input_file, params):
+    """
+    Save the histograms of a run to its histogram store, with what they were built from.
+
+    :param HistCube hists: histograms of the run
+    :param str store_file: path to store
+    :param str input_file: path to the input file the histograms were built from
+    :param dict params: parameters the histograms depend on
+    :return:
+    """
+    source = file_fingerprint(input_file, with_hash=False) if os.path.exists(input_file) else None
+    hists.save(store_file, {"source": source, "params": params})
+    print(f"Saved histogram store {store_file}")
+
+
+def load_hist_store(store_file, input_file, params):
+    """
+    Load a histogram store, if it is up to date: same store version and parameters, and the input file
+    (if it still exists) has the same size and modification time.
+
+    :param str store_file: path to store
+    :param str input_file: path to the input file the store was built from
+    :param dict params: parameters the histograms depend on
+    :return: HistCube, or None if there is no valid store
+    """
+    if not os.path.exists(store_file):
+        return None
+    hists, metadata = HistCube.load(store_file)
+    if hists is None:
+        print("Histogram store version changed - rebuilding")
+        return None
+    if metadata.get("params") != json.loads(json.dumps(params)):
+        print("Histogram store parameters changed - rebuilding")
+        return None
+    if os.path.exists(input_file) and metadata.get("source") != file_fingerprint(input_file, with_hash=False):
+        print("Input file changed - rebuilding histogram store")
+        return None
+    print(f"Loaded histogram store {store_file}")
+    return hists
+
+
+def exceeds_memory_budget(input_file, ext, root_tree, columns=None, memory_budget=None):
+    """
+    Estimate whether the flattened data of a ROOT file would exceed the memory budget.
+
+    :param str input_file: path to input file.
+    :param str ext: file type. Only '.root' files can be streamed.
+    :param str root_tree: name of relevant ROOT tree
+    :param list columns: optional list of flattened columns to read (see df_handling.raw_branches)
+    :param float memory_budget: optional memory budget in bytes. default is run_params.MEMORY_BUDGET
+    :return: True if the run should be streamed
+    """
+    if ext.lower() != ".root":
+        return False
+    if memory_budget is None:
+        memory_budget = run_params.MEMORY_BUDGET
+    num_entries, tree_bytes = get_tree_size(input_file, root_tree, df_handling.raw_branches(columns))
+    event_size = tree_bytes / max(num_entries, 1) * run_params.FLAT_MEMORY_FACTOR
+    estimate = num_entries * event_size
+    if estimate > memory_budget:
+        print(f"Estimated memory {estimate / 1024 ** 3:.1f} GB exceeds budget "
+              f"({memory_budget / 1024 ** 3:.1f} GB) - streaming run")
+        return True
+    return False
+
+
+@instrumented()
+def stream_data(input_file, root_tree, step_size, columns=None):
+    """
+    Read a ROOT file in chunks, flatten each chunk and accumulate its histograms.
+    The memory held for the hits depends on the chunk size, not on the length of the run. Only the per-event
+    energies (about 50 bytes per event, see HistCube) are kept for the whole run.
+
+    :param str input_file: path to input file.
+    :param str root_tree: name of relevant ROOT tree
+    :param step_size: number of entries per chunk, or memory size string (e.g. "100 MB")
+    :param list columns: optional list of flattened columns to read (see df_handling.raw_branches)
+    :return: HistCube of the whole run
+    """
+    hists = HistCube()
+    num_events = 0
+    for arrays in iterate_root(input_file, root_tree, step_size, branches=df_handling.raw_branches(columns)):
+        hists.fill_df(df_handling.flatten_calo_arrays(arrays))
+        num_events += len(arrays)
+        print(f"Processed {num_events} events")
+    return hists
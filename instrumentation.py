@@ -0,0 +1,198 @@
+""" Lightweight stage-level instrumentation: wall time, CPU time, call count and peak memory per stage """
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import threading
+import functools
+import tracemalloc
+from contextlib import contextmanager
+try:
+    import resource  # Unix only
+except ImportError:
+    resource = None
+
+_stats = {}  # stage name -> dict of accumulated measurements
+_lock = threading.Lock()
+_local = threading.local()  # stack of the stages open in the current thread
+
+
+@contextmanager
+def stage(name):
+    """
+    Measure a block of code as a stage. Measurements of repeated calls are accumulated.
+    Stages can be nested; times of a stage include the stages nested in it. Measurements merged from worker
+    processes (see merge_stats) are summed, so a stage's total time can exceed the run's wall time.
+    Peak memory is the process's peak RSS at the end of the stage, and (while tracemalloc is tracing) the peak
+    memory allocated by Python during the stage.
+
+    Usage:
+        with stage("flatten"):
+            df = flatten_calo_df(df)
+
+    :param str name: name of the stage
+    :return:
+    """
+    stack = _stack()
+    frame = {"traced_peak": 0}
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        _, peak = tracemalloc.get_traced_memory()
+        if stack:
+            stack[-1]["traced_peak"] = max(stack[-1]["traced_peak"], peak)
+        tracemalloc.reset_peak()
+    stack.append(frame)
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    try:
+        yield
+    finally:
+        wall = time.perf_counter() - start_wall
+        cpu = time.process_time() - start_cpu
+        stack.pop()
+        if tracing and tracemalloc.is_tracing():
+            _, peak = tracemalloc.get_traced_memory()
+            frame["traced_peak"] = max(frame["traced_peak"], peak)
+            if stack:
+                stack[-1]["traced_peak"] = max(stack[-1]["traced_peak"], frame["traced_peak"])
+            tracemalloc.reset_peak()
+        _add(name, {"calls": 1, "wall_s": wall, "cpu_s": cpu, "max_wall_s": wall, "peak_rss_mb": peak_rss_mb(),
+                    "peak_traced_mb": frame["traced_peak"] / 1024 ** 2})
+
+
+def instrumented(name=None):
+    """
+    Decorator measuring every call of a function as a stage (see stage).
+
+    :param str name: name of the stage. default is the function's name
+    :return: decorator
+    """
+    def decorator(func):
+        stage_name = name if name else func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(stage_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def get_stats(clear=False):
+    """
+    Get the measurements of all stages.
+
+    :param bool clear: reset the measurements after getting them
+    :return: dict of {stage name: {calls, wall_s, cpu_s, max_wall_s, peak_rss_mb, peak_traced_mb}}
+    """
+    global _stats
+    with _lock:
+        stats = {name: dict(values) for name, values in _stats.items()}
+        if clear:
+            _stats = {}
+    return stats
+
+
+def merge_stats(stats):
+    """
+    Add measurements (e.g. returned by a worker process) to those of the current process.
+
+    :param dict stats: measurements as returned by get_stats
+    :return:
+    """
+    for name, values in stats.items():
+        _add(name, values)
+
+
+def reset():
+    """ Clear all measurements """
+    get_stats(clear=True)
+
+
+def save_report(filename, summary=None):
+    """
+    Save the measurements of all stages to a JSON report (stages sorted by total wall time) and print them.
+
+    :param str filename: path to output '.json' file
+    :param dict summary: optional information saved with the stages (e.g. run summary)
+    :return: dict of the report
+    """
+    stages = sorted(get_stats().items(), key=lambda item: -item[1]["wall_s"])
+    report = dict(summary if summary else {})
+    report["stages"] = {name: {key: round(value, 4) if isinstance(value, float) else value
+                               for key, value in values.items()} for name, values in stages}
+
+    print(f"{'stage':<35}{'calls':>8}{'wall [s]':>10}{'cpu [s]':>10}{'peak RSS [MB]':>15}")
+    for name, values in stages:
+        print(f"{name:<35}{values['calls']:>8}{values['wall_s']:>10.2f}{values['cpu_s']:>10.2f}"
+              f"{values['peak_rss_mb']:>15.0f}")
+
+    os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+    with open(filename, "w") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+@contextmanager
+def profile(out_prefix, mode="all"):
+    """
+    Profile a block of code and dump the results next to out_prefix:
+    cProfile statistics to '<out_prefix>_profile.prof' (readable with pstats or snakeviz) and
+    the top memory allocations (tracemalloc) to '<out_prefix>_tracemalloc.txt'.
+
+    :param str out_prefix: path and prefix of the output files
+    :param str mode: 'cpu' (cProfile), 'memory' (tracemalloc) or 'all'
+    :return:
+    """
+    if mode not in ("cpu", "memory", "all"):
+        raise ValueError(f"Invalid profile mode: '{mode}'. Expected 'cpu', 'memory' or 'all'")
+    os.makedirs(os.path.dirname(out_prefix) or ".", exist_ok=True)
+    profiler = cProfile.Profile() if mode in ("cpu", "all") else None
+    trace_memory = mode in ("memory", "all") and not tracemalloc.is_tracing()
+    if trace_memory:
+        tracemalloc.start()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(out_prefix + "_profile.prof")
+            with open(out_prefix + "_profile.txt", "w") as f:
+                pstats.Stats(profiler, stream=f).sort_stats("cumulative").print_stats(50)
+        if trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            with open(out_prefix + "_tracemalloc.txt", "w") as f:
+                for line in snapshot.statistics("lineno")[:50]:
+                    f.write(f"{line}\n")
+        print(f"Profile saved to {out_prefix}_*")
+
+
+def peak_rss_mb():
+    """ Peak resident memory of the current process (MB), NaN where it is not available (e.g. on Windows) """
+    if resource is None:
+        return float("nan")
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024  # bytes on macOS, KB on Linux
+
+
+def _stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+def _add(name, values):
+    with _lock:
+        stats = _stats.get(name)
+        if stats is None:
+            _stats[name] = dict(values)
+            return
+        for key in ("calls", "wall_s", "cpu_s"):
+            stats[key] += values[key]
+        for key in ("max_wall_s", "peak_rss_mb", "peak_traced_mb"):
+            stats[key] = max(stats[key], values[key])
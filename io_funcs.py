@@ -1,8 +1,15 @@
 import os
+import json
+import hashlib
 import uproot
+import numpy as np
 import pandas as pd
 import scipy.io as sio
+import pyarrow as pa
 import pyarrow.parquet as pq
+import pyarrow.feather as feather
+from .instrumentation import instrumented
+from .df_handling import compact_dtypes
 
 
 def verify_file_extension(filename, extension):
@@ -17,12 +24,14 @@ def verify_file_extension(filename, extension):
     return root + extension
 
 
-def root_to_df(file_name, tree_name):
+@instrumented()
+def root_to_df(file_name, tree_name, branches=None):
     """
     Get data from a ROOT file and into pd.DataFrame
 
     :param str file_name: path to input file (directory + name)
     :param str tree_name: name of ROOT tree to extract data from
+    :param list branches: optional list of branches to read (default is all branches)
     :return: pd.DataFrame containing the data in tree
     """
     # verify correct file extension
@@ -31,10 +40,11 @@ def root_to_df(file_name, tree_name):
     # open file and tree
     file = uproot.open(file_name)
     tree = file[tree_name]
-    branches = tree.keys()
-    print(f"Tree branches: {branches}")
+    if branches is None:
+        branches = tree.keys()
+    print(f"Tree branches: {tree.keys()}, reading: {branches}")
 
-    # Load all branches into a pandas DataFrame
+    # Load the branches into a pandas DataFrame (other branches are not read)
     arrays = tree.arrays(branches, library="np")
 
     # Create DataFrame directly from NumPy arrays
@@ -43,9 +53,107 @@ def root_to_df(file_name, tree_name):
     return df
 
 
+@instrumented()
+def root_to_arrays(file_name, tree_name, branches=None):
+    """
+    Get data from a ROOT file as jagged arrays (no per-event python objects are created)
+
+    :param str file_name: path to input file (directory + name)
+    :param str tree_name: name of ROOT tree to extract data from
+    :param list branches: optional list of branches to read (default is all branches)
+    :return: ak.Array containing the data in tree
+    """
+    # verify correct file extension
+    file_name = verify_file_extension(file_name, ".root")
+
+    # open file and tree
+    with uproot.open(file_name) as file:
+        tree = file[tree_name]
+        print(f"Tree branches: {tree.keys()}" + (f", reading: {branches}" if branches is not None else ""))
+        arrays = tree.arrays(filter_name=branches, library="ak")
+    print(f"Read {len(arrays)} events from root file")
+    return arrays
+
+
+def iterate_root(file_name, tree_name, step_size, branches=None):
+    """
+    Iterate over a ROOT tree in chunks of jagged arrays, so that only one chunk is in memory at a time.
+
+    :param str file_name: path to input file (directory + name)
+    :param str tree_name: name of ROOT tree to extract data from
+    :param step_size: number of entries per chunk, or memory size string (e.g. "100 MB")
+    :param list branches: optional list of branches to read (default is all branches)
+    :return: generator of ak.Array chunks
+    """
+    # verify correct file extension
+    file_name = verify_file_extension(file_name, ".root")
+    for arrays in uproot.iterate({file_name: tree_name}, filter_name=branches, step_size=step_size, library="ak"):
+        yield arrays
+
+
+@instrumented()
+def read_new_entries(file_name, tree_name, entry_start, branches=None):
+    """
+    Read the entries of a ROOT tree from entry_start on (e.g. the entries added to a file that is still being written).
+
+    :param str file_name: path to input file (directory + name)
+    :param str tree_name: name of ROOT tree to extract data from
+    :param int entry_start: number of entries already read
+    :param list branches: optional list of branches to read (default is all branches)
+    :return: ak.Array of the new entries (None if there are none), total number of entries in the tree
+    """
+    # verify correct file extension
+    file_name = verify_file_extension(file_name, ".root")
+    with uproot.open(file_name) as file:
+        tree = file[tree_name]
+        num_entries = tree.num_entries
+        if num_entries <= entry_start:
+            return None, num_entries
+        arrays = tree.arrays(filter_name=branches, library="ak", entry_start=entry_start, entry_stop=num_entries)
+    return arrays, num_entries
+
+
+def data_branches(file_name, tree_name):
+    """
+    Get the names of the branches of a ROOT tree, without the counters of its vector branches ('n<branch>').
+    Vectors are read without their counters, and uproot recreates the counters when writing vectors.
+
+    :param str file_name: path to input file (directory + name)
+    :param str tree_name: name of ROOT tree
+    :return: list of branch names
+    """
+    # verify correct file extension
+    file_name = verify_file_extension(file_name, ".root")
+    with uproot.open(file_name) as file:
+        tree = file[tree_name]
+        keys = tree.keys()
+        counters = {branch.count_branch.name for branch in tree.values()
+                    if getattr(branch, "count_branch", None) is not None}
+    return [key for key in keys if key not in counters]
+
+
+def get_tree_size(file_name, tree_name, branches=None):
+    """
+    Get number of entries and uncompressed size of a ROOT tree (without reading its data).
+
+    :param str file_name: path to input file (directory + name)
+    :param str tree_name: name of ROOT tree
+    :param list branches: optional list of branches to count the size of (default is the whole tree)
+    :return: number of entries, uncompressed size in bytes
+    """
+    # verify correct file extension
+    file_name = verify_file_extension(file_name, ".root")
+    with uproot.open(file_name) as file:
+        tree = file[tree_name]
+        if branches is None:
+            return tree.num_entries, tree.uncompressed_bytes
+        return tree.num_entries, sum(tree[branch].uncompressed_bytes for branch in branches if branch in tree)
+
+
+@instrumented()
 def save_df(df, filename):
     """
-    Save df to new'.parquet' file.
+    Save df to new'.parquet' file, with the compact column dtypes of the hit table (see df_handling.compact_dtypes).
 
     :param pd.DataFrame df: data to save
     :param str filename: path to output file (directory + name)
@@ -53,29 +161,224 @@ def save_df(df, filename):
     """
     # verify correct file extension
     filename = verify_file_extension(filename, ".parquet")
-    df.to_parquet(filename, compression="snappy")
+    compact_dtypes(df).to_parquet(filename, compression="snappy")
     return
 
 
-def load_df(filename, filters=None):
+@instrumented()
+def load_df(filename, filters=None, columns=None):
     """
     Load data from a '.parquet' file to a pf.DataFrame.
 
     :param str filename: path to input file (directory + name)
     :param str filters: optional filters for extracting data
+    :param list columns: optional list of columns to read (default is all columns)
     :return: pd.DataFrame of the file contents
     """
     # verify correct file extension
     filename = verify_file_extension(filename, ".parquet")
     if filters:
-        table = pq.read_table(filename, filters=filters)
+        table = pq.read_table(filename, filters=filters, columns=columns)
     else:
-        table = pq.read_table(filename)
+        table = pq.read_table(filename, columns=columns)
     df = table.to_pandas()
     print(f"Loaded .parquet file with columns {df.columns.tolist()}")
     return df
 
 
+@instrumented()
+def save_shared_df(df, filename):
+    """
+    Save df to a new uncompressed Arrow IPC ('.arrow', Feather v2) file, with the compact column dtypes of the
+    hit table, as a single record batch so that map_shared_df gets its columns without copying them.
+    The file is written under a temporary name first, so readers never see a partial file.
+
+    :param pd.DataFrame df: data to save
+    :param str filename: path to output file (directory + name). a file in /dev/shm is kept in shared memory
+    :return: path of the saved file
+    """
+    # verify correct file extension
+    filename = verify_file_extension(filename, ".arrow")
+    tmp_file = filename + ".tmp"
+    table = pa.Table.from_pandas(compact_dtypes(df), preserve_index=False)
+    feather.write_feather(table, tmp_file, compression="uncompressed", chunksize=max(len(df), 1))
+    os.replace(tmp_file, filename)
+    return filename
+
+
+@instrumented()
+def map_shared_df(filename, columns=None):
+    """
+    Memory-map an Arrow IPC file written by save_shared_df into a pd.DataFrame.
+    Numeric columns are read-only views of the mapped file: nothing is copied or deserialized, and processes that
+    map the same file share its pages instead of each holding a copy.
+
+    :param str filename: path to input file (directory + name)
+    :param list columns: optional list of columns to map (default is all columns)
+    :return: pd.DataFrame of the file contents
+    """
+    # verify correct file extension
+    filename = verify_file_extension(filename, ".arrow")
+    table = pa.ipc.open_file(pa.memory_map(filename)).read_all()
+    if columns is not None:
+        table = table.select(columns)
+    return table.to_pandas(split_blocks=True, use_threads=False)
+
+
+@instrumented()
+def read_rows(filename, row_ranges, columns=None):
+    """
+    Read row ranges of a '.parquet' file, reading only the row groups that contain them.
+
+    :param str filename: path to input file (directory + name)
+    :param list row_ranges: list of (start, stop) row ranges
+    :param list columns: optional list of columns to read (default is all columns)
+    :return: pd.DataFrame of the rows of all ranges, in the given order
+    """
+    # verify correct file extension
+    filename = verify_file_extension(filename, ".parquet")
+    if len(row_ranges) == 0:
+        schema = pq.read_schema(filename)
+        return (schema.empty_table().select(columns) if columns else schema.empty_table()).to_pandas()
+    parquet_file = pq.ParquetFile(filename)
+    metadata = parquet_file.metadata
+    group_starts = np.cumsum([0] + [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)])
+    rows = np.concatenate([np.arange(start, stop) for start, stop in row_ranges])
+    groups = np.unique(np.searchsorted(group_starts, rows, side="right") - 1)
+    table = parquet_file.read_row_groups(groups.tolist(), columns=columns)
+    # row numbers in the table of the read row groups
+    read_starts = np.cumsum(np.append(0, group_starts[groups + 1] - group_starts[groups]))[:-1]
+    group_of_row = np.searchsorted(group_starts, rows, side="right") - 1
+    local = rows - group_starts[group_of_row] + read_starts[np.searchsorted(groups, group_of_row)]
+    return table.take(local).to_pandas()
+
+
+def file_fingerprint(filename, with_hash=True):
+    """
+    Get size, modification time and (optionally) content hash of a file.
+
+    :param str filename: path to file
+    :param bool with_hash: compute the sha256 hash of the file contents (reads the whole file)
+    :return: dict of file properties
+    """
+    stat = os.stat(filename)
+    fingerprint = {"size": stat.st_size, "mtime": stat.st_mtime}
+    if with_hash:
+        sha = hashlib.sha256()
+        with open(filename, "rb") as f:
+            for block in iter(lambda: f.read(16 * 1024 * 1024), b""):
+                sha.update(block)
+        fingerprint["sha256"] = sha.hexdigest()
+    return fingerprint
+
+
+def cache_manifest_path(source_file):
+    """
+    Get path of the manifest file of the cache built from source_file.
+
+    :param str source_file: path to source file
+    :return: path of manifest ('<source file name>_manifest.json')
+    """
+    root, ext = os.path.splitext(source_file)
+    return root + "_manifest.json"
+
+
+@instrumented()
+def save_df_cache(df, source_file, params, cache_file=None):
+    """
+    Save df (the processed contents of source_file) to a '.parquet' cache next to source_file, with a manifest
+    recording the source file's size, modification time and hash, and the parameters used to process it.
+
+    :param pd.DataFrame df: data to save
+    :param str source_file: path to the file df was created from
+    :param dict params: JSON-serializable processing parameters the cache depends on
+    :param str cache_file: optional path of the cache (for several caches of one source file).
+                           default is '<source file name>.parquet'
+    :return:
+    """
+    cache_file, manifest_file = _cache_paths(source_file, cache_file)
+    # remove old manifest first, so that an interrupted write never leaves a valid-looking cache
+    if os.path.exists(manifest_file):
+        os.remove(manifest_file)
+    tmp_file = cache_file + ".tmp"
+    compact_dtypes(df).to_parquet(tmp_file, compression="snappy", index=False)
+    os.replace(tmp_file, cache_file)
+
+    manifest = {"source": os.path.basename(source_file), "source_file": file_fingerprint(source_file),
+                "params": params, "columns": df.columns.tolist(), "num_rows": len(df)}
+    with open(manifest_file, "w") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"Saved cache {cache_file}")
+
+
+@instrumented()
+def load_df_cache(source_file, params, columns=None, cache_file=None):
+    """
+    Load the '.parquet' cache of source_file, if it is up to date.
+    The cache is valid if its manifest's parameters match params and the source file is unchanged
+    (same size and modification time, or same content hash).
+
+    :param str source_file: path to the file the cache was created from
+    :param dict params: JSON-serializable processing parameters the cache depends on
+    :param list columns: optional list of columns to read (default is all columns)
+    :param str cache_file: optional path of the cache (see save_df_cache)
+    :return: pd.DataFrame of the cache, or None if there is no valid cache (or it lacks some of the columns)
+    """
+    if not is_df_cache_valid(source_file, params, columns, cache_file):
+        return None
+    return load_df(_cache_paths(source_file, cache_file)[0], columns=columns)
+
+
+def is_df_cache_valid(source_file, params, columns=None, cache_file=None):
+    """
+    Check whether the '.parquet' cache of source_file is up to date (see load_df_cache), without reading it.
+
+    :param str source_file: path to the file the cache was created from
+    :param dict params: JSON-serializable processing parameters the cache depends on
+    :param list columns: optional list of columns the cache must hold
+    :param str cache_file: optional path of the cache (see save_df_cache)
+    :return: True if the cache exists and is valid
+    """
+    cache_file, manifest_file = _cache_paths(source_file, cache_file)
+    if not (os.path.exists(cache_file) and os.path.exists(manifest_file)):
+        return False
+    with open(manifest_file) as f:
+        manifest = json.load(f)
+
+    # compare processing parameters (through JSON, as they were saved)
+    if manifest.get("params") != json.loads(json.dumps(params)):
+        print("Cache parameters changed - rebuilding cache")
+        return False
+    # the cache only holds the columns it was built for
+    missing = set(columns or []) - set(manifest.get("columns", []))
+    if missing:
+        print(f"Cache lacks columns {sorted(missing)} - rebuilding cache")
+        return False
+    # compare source file
+    cached = manifest.get("source_file", {})
+    current = file_fingerprint(source_file, with_hash=False)
+    if current["size"] != cached.get("size"):
+        print("Source file changed - rebuilding cache")
+        return False
+    if current["mtime"] != cached.get("mtime"):
+        if file_fingerprint(source_file)["sha256"] != cached.get("sha256"):
+            print("Source file changed - rebuilding cache")
+            return False
+        # same contents - only touched. update manifest to skip hashing next time
+        manifest["source_file"]["mtime"] = current["mtime"]
+        with open(manifest_file, "w") as f:
+            json.dump(manifest, f, indent=2)
+    return True
+
+
+def _cache_paths(source_file, cache_file=None):
+    """ Paths of a cache of source_file and of its manifest (see save_df_cache) """
+    if cache_file is None:
+        return verify_file_extension(source_file, ".parquet"), cache_manifest_path(source_file)
+    cache_file = verify_file_extension(cache_file, ".parquet")
+    return cache_file, cache_manifest_path(cache_file)
+
+
 def write_mat_file(filename, data_dict):
     """
     Save data to new '.mat' file
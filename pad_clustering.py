@@ -0,0 +1,138 @@
+""" Clustering of adjacent hit pads in each layer of each event, for all events of a run at once """
+import numpy as np
+import pandas as pd
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from .instrumentation import instrumented
+from .tb_helpers_v2025 import channel_to_sensor_coord
+from .run_params import PLANE_COL, CHANNEL_COL, AMPLITUDE_COL, EVENT_ID_COL, LAYERS, ROWS, COLS
+
+CLUSTER_COLUMNS = [EVENT_ID_COL, PLANE_COL, CHANNEL_COL, AMPLITUDE_COL]  # flattened columns used by cluster_hits
+# (column, row) offsets of the neighbours linked to each pad (the opposite offsets are covered by the other pad)
+NEIGHBOUR_OFFSETS = {4: [(1, 0), (0, 1)],
+                     8: [(1, 0), (0, 1), (1, 1), (-1, 1)]}
+
+
+@instrumented()
+def cluster_hits(df, connectivity=8):
+    """
+    Group the adjacent hit pads of each layer of each event into clusters.
+    Every (event, layer) hit set is placed on its own ROWS x COLS grid through a sorted (event, layer, pad) key,
+    the neighbour pairs of all hits are found with one sorted lookup per neighbour offset, and the clusters are the
+    connected components of the resulting graph (a vectorized union-find) - no per-event python work is done.
+
+    :param pd.DataFrame df: flattened data (as returned by df_handling.flatten_calo_df)
+    :param int connectivity: 8 (pads touching by a side or a corner are adjacent) or 4 (by a side only)
+    :return: cluster index of every row of df (-1 for hits outside the detector geometry),
+             pd.DataFrame with one row per cluster (see cluster_table), in (event ID, layer) order
+    """
+    n_layers = max(LAYERS) + 1
+    n_pads = ROWS * COLS
+    planes = df[PLANE_COL].to_numpy().astype(np.int64)
+    channels = df[CHANNEL_COL].to_numpy().astype(np.int64)
+    # ignore hits outside the detector geometry
+    valid = (planes >= 0) & (planes < n_layers) & (channels >= 0) & (channels < n_pads)
+    rows_valid = np.flatnonzero(valid)
+    planes = planes[valid]
+    col, row = channel_to_sensor_coord(channels[valid])
+    event_ids, event_idx = _event_index(df[EVENT_ID_COL].to_numpy()[valid])
+
+    # sort the hits by (event, layer, pad)
+    group = event_idx * n_layers + planes
+    keys = group * n_pads + row * COLS + col
+    order = np.argsort(keys, kind="stable")
+    keys, group, col, row = keys[order], group[order], col[order], row[order]
+
+    # link every hit to the hit pads at the neighbour offsets in the same event and layer, and repeated hits of
+    # a pad to each other
+    n_hits = len(keys)
+    repeated = np.flatnonzero(keys[1:] == keys[:-1])
+    src, dst = [repeated], [repeated + 1]
+    for d_col, d_row in NEIGHBOUR_OFFSETS[connectivity]:
+        # keys are sorted, so are the neighbour keys: a single sorted lookup finds the neighbours of all hits
+        target = keys + (d_row * COLS + d_col)
+        pos = np.searchsorted(keys, target)  # first hit of the neighbour pad, if it was hit
+        n_col, n_row = col + d_col, row + d_row
+        found = np.flatnonzero((keys.take(pos, mode="clip") == target) & (n_col >= 0) & (n_col < COLS) &
+                               (n_row >= 0) & (n_row < ROWS))
+        src.append(found)
+        dst.append(pos[found])
+    src, dst = np.concatenate(src), np.concatenate(dst)
+    graph = coo_matrix((np.ones(len(src), dtype=np.int8), (src, dst)), shape=(n_hits, n_hits))
+    num_clusters, labels = connected_components(graph, directed=False)
+
+    # number clusters in (event, layer) order, the order of the hits (connected_components usually does already)
+    if np.any(labels > np.concatenate([[-1], np.maximum.accumulate(labels)[:-1]]) + 1):
+        _, first_hit, labels = np.unique(labels, return_index=True, return_inverse=True)
+        renumber = np.empty(num_clusters, dtype=np.int64)
+        renumber[np.argsort(first_hit, kind="stable")] = np.arange(num_clusters)
+        labels = renumber[labels.reshape(-1)]
+
+    cluster = np.full(len(df), -1, dtype=np.int64)
+    cluster[rows_valid[order]] = labels
+    energy = df[AMPLITUDE_COL].to_numpy()[valid][order].astype(float)
+    new_pad = np.concatenate([[True], keys[1:] != keys[:-1]]) if n_hits else np.zeros(0, dtype=bool)
+    clusters = cluster_table(labels, num_clusters, event_ids[group // n_layers], group % n_layers, col, row, energy,
+                             new_pad)
+    return cluster, clusters
+
+
+def cluster_table(labels, num_clusters, event_ids, planes, col, row, energy, new_pad=None):
+    """
+    Size (number of pads), energy, energy-weighted centroid and seed (hit with the highest energy) of every cluster.
+
+    :param numpy.ndarray labels: cluster index of every hit
+    :param int num_clusters: number of clusters
+    :param numpy.ndarray event_ids: event ID of every hit
+    :param numpy.ndarray planes: layer number of every hit
+    :param numpy.ndarray col: pad column of every hit
+    :param numpy.ndarray row: pad row of every hit
+    :param numpy.ndarray energy: amplitude of every hit
+    :param numpy.ndarray new_pad: optional boolean array, False for repeated hits of a pad (default is all True)
+    :return: pd.DataFrame with one row per cluster
+    """
+    hits = np.bincount(labels, minlength=num_clusters)
+    size = hits if new_pad is None else np.bincount(labels, weights=new_pad, minlength=num_clusters).astype(np.int64)
+    cluster_energy = np.bincount(labels, weights=energy, minlength=num_clusters)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        centroid_col = np.bincount(labels, weights=energy * col, minlength=num_clusters) / cluster_energy
+        centroid_row = np.bincount(labels, weights=energy * row, minlength=num_clusters) / cluster_energy
+    seed = _segment_argmax(labels, hits, energy)
+    return pd.DataFrame({EVENT_ID_COL: event_ids[seed], PLANE_COL: planes[seed], "size": size,
+                         "energy": cluster_energy.astype(np.int64), "col": centroid_col, "row": centroid_row,
+                         "seed_channel": row[seed] * COLS + col[seed], "seed_energy": energy[seed].astype(np.int64)})
+
+
+def _event_index(event_ids):
+    """
+    Event index of every hit (events numbered in increasing event ID order).
+
+    :param numpy.ndarray event_ids: event ID of every hit
+    :return: numpy.ndarray of the event IDs, numpy.ndarray of the event index of every hit
+    """
+    if np.any(event_ids[1:] < event_ids[:-1]):
+        ids, idx = np.unique(event_ids, return_inverse=True)
+        return ids, idx.reshape(-1)
+    # usually sorted already (hits are ordered by event)
+    new_event = np.ones(len(event_ids), dtype=bool)
+    new_event[1:] = event_ids[1:] != event_ids[:-1]
+    return event_ids[new_event], np.cumsum(new_event) - 1
+
+
+def _segment_argmax(labels, counts, values):
+    """
+    Index of the first entry with the highest value of each segment (without sorting the values).
+
+    :param numpy.ndarray labels: segment index of every entry
+    :param numpy.ndarray counts: number of entries of each segment (none may be empty)
+    :param numpy.ndarray values: values
+    :return: numpy.ndarray of entry indices, one per segment
+    """
+    if len(counts) == 0:
+        return np.zeros(0, dtype=np.int64)
+    # group the entries by segment (a stable sort is fast here: labels are nearly sorted)
+    by_segment = np.argsort(labels, kind="stable")
+    grouped = values[by_segment]
+    is_max = np.flatnonzero(grouped == np.repeat(np.maximum.reduceat(grouped, np.cumsum(counts) - counts), counts))
+    first = np.concatenate([[True], labels[by_segment[is_max[1:]]] != labels[by_segment[is_max[:-1]]]])
+    return by_segment[is_max[first]]
@@ -0,0 +1,205 @@
+""" Per-pad efficiency and hit-track residuals of all layers, from telescope tracks extrapolated to the DUT """
+import numpy as np
+import pandas as pd
+import awkward as ak
+from .tb_helpers_v2025 import channel_to_sensor_coord, pad_centres, pad_edges
+from .run_params import PLANE_COL, CHANNEL_COL, TRACK_X_COL, TRACK_Y_COL, LAYERS, LAYERS_NAMES, CHANNELS, ROWS, COLS
+from .run_params import PAD_SIZE, SENSOR_OFFSET
+
+RESIDUAL_MAX_DISTANCE = 3 * PAD_SIZE  # hits farther from a track (mm) are not used for its residuals
+HIT_TRACK_BRANCHES = [PLANE_COL, CHANNEL_COL, TRACK_X_COL, TRACK_Y_COL]  # branches of the merged tree used
+
+
+class PadEfficiency:
+    """
+    Efficiency and residuals of every pad of all layers, accumulated chunk by chunk from merged DUT/telescope events
+    (chunks must not split events).
+    Every track is extrapolated to the pad it points at (pad_centres lookup). The pad is efficient in a layer if the
+    event has a hit in it in that layer. The residual of a track in a layer is the centre of the nearest hit pad of
+    the layer minus the track position (hits within max_distance of the track).
+    """
+    def __init__(self, single_track=True, pad_size=PAD_SIZE, offset=SENSOR_OFFSET,
+                 max_distance=RESIDUAL_MAX_DISTANCE):
+        """
+        :param bool single_track: only use events with exactly one track (so that every hit belongs to the track)
+        :param float pad_size: pad pitch (mm)
+        :param tuple offset: position of the sensor centre in the track coordinates (mm)
+        :param float max_distance: largest distance (mm) between a track and the hits used for its residuals
+        """
+        self.shape = (max(LAYERS) + 1, len(CHANNELS))
+        self.single_track = single_track
+        self.max_distance = max_distance
+        self.centre_x, self.centre_y = pad_centres(pad_size, offset)
+        self.x_edges, self.y_edges = pad_edges(pad_size, offset)
+        # channel of every (column, row) pad (-1 for pads without a channel)
+        self.col, self.row = channel_to_sensor_coord(np.asarray(CHANNELS, dtype=np.int64))
+        self.pad_channel = np.full((COLS, ROWS), -1, dtype=np.int64)
+        self.pad_channel[self.col, self.row] = CHANNELS
+
+        self.num_events = 0
+        self.tracks = np.zeros(len(CHANNELS), dtype=np.int64)  # number of tracks pointing at each pad
+        self.efficient = np.zeros(self.shape, dtype=np.int64)  # number of those tracks with a hit in the pad
+        self.res_count = np.zeros(self.shape, dtype=np.int64)  # number of residuals (by the pad of the track)
+        self.res_sum = np.zeros((2,) + self.shape)  # sum of x, y residuals
+        self.res_sum2 = np.zeros((2,) + self.shape)
+
+    def fill(self, hit_event, planes, channels, track_event, track_x, track_y, num_events):
+        """
+        Add the hits and tracks of a chunk of events.
+
+        :param numpy.ndarray hit_event: event index (in the chunk) per hit, in increasing order
+        :param numpy.ndarray planes: plane number per hit
+        :param numpy.ndarray channels: channel number per hit
+        :param numpy.ndarray track_event: event index (in the chunk) per track, in increasing order
+        :param numpy.ndarray track_x: track x position at the DUT (mm)
+        :param numpy.ndarray track_y: track y position at the DUT (mm)
+        :param int num_events: number of events in the chunk
+        :return:
+        """
+        n_layers, n_channels = self.shape
+        track_x = np.asarray(track_x, dtype=float)
+        track_y = np.asarray(track_y, dtype=float)
+        self.num_events += num_events
+
+        # number of tracks pointing at each pad: bin all impact points on the pads at once
+        counts, _, _ = np.histogram2d(track_x, track_y, bins=(self.x_edges, self.y_edges))
+        self.tracks += counts[self.col, self.row].astype(np.int64)
+
+        # channel of each track's pad (tracks off the sensor or pointing at a pad without a channel are dropped)
+        col = np.searchsorted(self.x_edges, track_x, side="right") - 1
+        row = np.searchsorted(self.y_edges, track_y, side="right") - 1
+        on_sensor = (col >= 0) & (col < COLS) & (row >= 0) & (row < ROWS)
+        track_channel = np.full(len(track_x), -1, dtype=np.int64)
+        track_channel[on_sensor] = self.pad_channel[col[on_sensor], row[on_sensor]]
+        keep = track_channel >= 0
+        track_event = np.asarray(track_event, dtype=np.int64)[keep]
+        track_channel, track_x, track_y = track_channel[keep], track_x[keep], track_y[keep]
+
+        planes = np.asarray(planes, dtype=np.int64)
+        channels = np.asarray(channels, dtype=np.int64)
+        valid = (planes >= 0) & (planes < n_layers) & (channels >= 0) & (channels < n_channels)
+        hit_event, planes, channels = np.asarray(hit_event, dtype=np.int64)[valid], planes[valid], channels[valid]
+
+        # efficiency: look up the (event, layer, pad) of every track in every layer among the hits
+        hit_keys = (hit_event * n_layers + planes) * n_channels + channels
+        if np.any(hit_keys[1:] < hit_keys[:-1]):  # (usually sorted already: hits are ordered by event)
+            hit_keys = np.sort(hit_keys)
+        layers = np.arange(n_layers)
+        track_keys = (track_event[:, None] * n_layers + layers[None, :]) * n_channels + track_channel[:, None]
+        if len(hit_keys):
+            found = hit_keys[np.minimum(np.searchsorted(hit_keys, track_keys), len(hit_keys) - 1)] == track_keys
+        else:
+            found = np.zeros(track_keys.shape, dtype=bool)
+        idx = (layers[None, :] * n_channels + track_channel[:, None]).ravel()
+        self.efficient += np.bincount(idx, weights=found.ravel(), minlength=self.efficient.size).astype(
+            np.int64).reshape(self.shape)
+
+        # residuals: pair every hit with every track of its event, and keep the nearest hit per (track, layer)
+        tracks_per_event = np.bincount(track_event, minlength=num_events)
+        first_track = np.cumsum(tracks_per_event) - tracks_per_event
+        repeats = tracks_per_event[hit_event]
+        pair_hit = np.repeat(np.arange(len(hit_event)), repeats)
+        pair_track = np.repeat(first_track[hit_event] - np.cumsum(repeats) + repeats, repeats) + np.arange(
+            len(pair_hit))
+        dx = self.centre_x[channels[pair_hit]] - track_x[pair_track]
+        dy = self.centre_y[channels[pair_hit]] - track_y[pair_track]
+        dist2 = dx ** 2 + dy ** 2
+        close = dist2 <= self.max_distance ** 2
+        pair_hit, pair_track, dx, dy, dist2 = pair_hit[close], pair_track[close], dx[close], dy[close], dist2[close]
+        group = pair_track * n_layers + planes[pair_hit]
+        order = np.lexsort((dist2, group))
+        nearest = order[np.concatenate([[True], group[order][1:] != group[order][:-1]])] if len(order) else order
+
+        idx = planes[pair_hit[nearest]] * n_channels + track_channel[pair_track[nearest]]
+        size = self.res_count.size
+        self.res_count += np.bincount(idx, minlength=size).reshape(self.shape)
+        for i, res in enumerate((dx[nearest], dy[nearest])):
+            self.res_sum[i] += np.bincount(idx, weights=res, minlength=size).reshape(self.shape)
+            self.res_sum2[i] += np.bincount(idx, weights=res ** 2, minlength=size).reshape(self.shape)
+
+    def fill_arrays(self, arrays):
+        """
+        Add the events of a chunk of merged jagged data (one entry per trigger, as written by merge_sentel).
+
+        :param ak.Array arrays: merged jagged data with the HIT_TRACK_BRANCHES
+        :return:
+        """
+        num_tracks = ak.to_numpy(ak.num(arrays[TRACK_X_COL], axis=1))
+        if self.single_track:
+            arrays = arrays[num_tracks == 1]
+            num_tracks = num_tracks[num_tracks == 1]
+        num_hits = ak.to_numpy(ak.num(arrays[CHANNEL_COL], axis=1))
+        events = np.arange(len(arrays))
+        self.fill(np.repeat(events, num_hits),
+                  ak.to_numpy(ak.flatten(arrays[PLANE_COL], axis=1)),
+                  ak.to_numpy(ak.flatten(arrays[CHANNEL_COL], axis=1)),
+                  np.repeat(events, num_tracks),
+                  ak.to_numpy(ak.flatten(arrays[TRACK_X_COL], axis=1)),
+                  ak.to_numpy(ak.flatten(arrays[TRACK_Y_COL], axis=1)), len(arrays))
+
+    def efficiency(self):
+        """
+        Efficiency of every pad of every layer, and its binomial error.
+
+        :return: efficiency, error ((layers, channels) numpy.ndarrays, NaN for pads without tracks)
+        """
+        with np.errstate(invalid="ignore", divide="ignore"):
+            eff = self.efficient / self.tracks
+            err = np.sqrt(eff * (1 - eff) / self.tracks)
+        return eff, err
+
+    def residual_stats(self):
+        """
+        Mean and standard deviation of the x and y residuals of every pad of every layer (by the pad of the track).
+
+        :return: mean, std ((2, layers, channels) numpy.ndarrays of x and y, NaN for pads without residuals)
+        """
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = self.res_sum / self.res_count
+            std = np.sqrt(np.maximum(self.res_sum2 / self.res_count - mean ** 2, 0))
+        return mean, std
+
+    def layer_summary(self):
+        """
+        Efficiency and residuals of every layer (all pads together).
+
+        :return: pd.DataFrame with one row per layer (in LAYERS order)
+        """
+        total = self.tracks.sum()
+        count = self.res_count.sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            eff = self.efficient.sum(axis=1) / total
+            mean = self.res_sum.sum(axis=2) / count
+            std = np.sqrt(np.maximum(self.res_sum2.sum(axis=2) / count - mean ** 2, 0))
+        return pd.DataFrame({"layer": LAYERS, "layer_slot": LAYERS_NAMES[:len(LAYERS)], "tracks": total,
+                             "efficiency": eff[LAYERS], "mean_dx": mean[0, LAYERS], "mean_dy": mean[1, LAYERS],
+                             "std_dx": std[0, LAYERS], "std_dy": std[1, LAYERS]})
+
+    def table(self):
+        """
+        Efficiency and residuals of every pad of every layer.
+
+        :return: pd.DataFrame with one row per (layer, channel) (layers in LAYERS order)
+        """
+        eff, err = self.efficiency()
+        mean, std = self.residual_stats()
+        n_channels = len(CHANNELS)
+        layers = np.repeat(LAYERS, n_channels)
+        return pd.DataFrame({
+            "layer": layers,
+            "layer_slot": np.repeat(LAYERS_NAMES[:len(LAYERS)], n_channels),
+            "channel": np.tile(CHANNELS, len(LAYERS)),
+            "column": np.tile(self.col, len(LAYERS)),
+            "row": np.tile(self.row, len(LAYERS)),
+            "x": np.tile(self.centre_x, len(LAYERS)),
+            "y": np.tile(self.centre_y, len(LAYERS)),
+            "tracks": np.tile(self.tracks, len(LAYERS)),
+            "efficient": self.efficient[LAYERS].ravel(),
+            "efficiency": eff[LAYERS].ravel(),
+            "efficiency_error": err[LAYERS].ravel(),
+            "residuals": self.res_count[LAYERS].ravel(),
+            "mean_dx": mean[0][LAYERS].ravel(),
+            "mean_dy": mean[1][LAYERS].ravel(),
+            "std_dx": std[0][LAYERS].ravel(),
+            "std_dy": std[1][LAYERS].ravel(),
+        })
@@ -0,0 +1,60 @@
+import os
+import matplotlib.pyplot as plt
+from .. import init_funcs
+from .. import io_funcs
+from .. import run_params
+from .. import utils
+from .. import plotting as tb_plt
+from ..pad_clustering import cluster_hits, CLUSTER_COLUMNS
+
+
+def find_clusters(connectivity=8):
+    """
+    Cluster the adjacent hit pads of each layer of each event of the current run (see run_params.init_vars and
+    pad_clustering.cluster_hits). Saves the cluster table ('run_<run number>_clusters.parquet') and the cluster
+    size and energy distributions to 'clusters/' in the run's results directory, and prints a per-layer summary.
+
+    :param int connectivity: 8 (pads touching by a side or a corner are adjacent) or 4 (by a side only)
+    :return: pd.DataFrame with one row per cluster
+    """
+    data = init_funcs.get_data(run_params.DUT_INPUT_FILE, run_params.INPUT_FILE_TYPE,
+                               root_tree=run_params.DUT_ROOT_TREE, parquet_filter=run_params.PARQUET_FILTER,
+                               columns=CLUSTER_COLUMNS)
+    _, clusters = cluster_hits(data, connectivity)
+    num_events = init_funcs.count_events(data)
+    print(f"Found {len(clusters)} clusters in {num_events} events")
+
+    path = run_params.RESULTS_DIR + "clusters/"
+    os.makedirs(path, exist_ok=True)
+    run = run_params.RUN_NUM
+    io_funcs.save_df(clusters, path + f"run_{run}_clusters.parquet")
+
+    # per layer: clusters per event, size, fraction of single-pad clusters and energy
+    layers = clusters.groupby(run_params.PLANE_COL)
+    summary = layers["size"].agg(clusters="count", mean_size="mean")
+    summary["per_event"] = summary["clusters"] / max(num_events, 1)
+    summary["single_pad"] = layers["size"].apply(lambda size: (size == 1).mean())
+    summary["mean_energy"] = layers["energy"].mean()
+    print(summary.reindex(run_params.LAYERS).dropna().to_string(float_format="{:.4g}".format))
+
+    tb_plt.plot_1d_hist(clusters["size"], bin_step=1, log=True, title=f"Run {run} - cluster size",
+                        x_label="Pads", path=path, out_filename=f"run_{run}_cluster_size.png")
+    tb_plt.plot_1d_hist(clusters["energy"], bin_num=100, log=True, title=f"Run {run} - cluster energy",
+                        x_label="Energy [ADC counts]", path=path, out_filename=f"run_{run}_cluster_energy.png")
+    plt.close('all')
+    return clusters
+
+
+if __name__ == "__main__":
+
+    arg_params = [["-r", "--runnum", int, "the run number"],
+                  ["-n", "--neighbours", int, "8 (pads touching by a side or a corner are adjacent, default) or 4"],
+                  ["-c", "--channel_mask", str, "'auto' or path of a saved channel mask (as used to process the run)"]]
+    args = utils.get_args(arg_params)
+    if args.runnum is None:
+        print("A run number is required (-r)")
+    else:
+        run_params.init_vars(args.runnum, ".root", f"./analysis_results/dut_plots/run_{args.runnum}/", None)
+        init_funcs.init_channel_mask(run_params.DUT_INPUT_FILE, run_params.INPUT_FILE_TYPE, run_params.DUT_ROOT_TREE,
+                                     args.channel_mask)
+        find_clusters(args.neighbours if args.neighbours else 8)
@@ -0,0 +1,71 @@
+import os
+import numpy as np
+from .. import init_funcs
+from .. import io_funcs
+from .. import run_params
+from .. import utils
+from .. import plotting as tb_plt
+from ..tb_helpers_v2025 import hits_to_sensor_maps
+
+
+def display_events(event_ids=None, top=None):
+    """
+    Plot the layer heatmaps of single events of the current run (see run_params.init_vars): the given events, or
+    the events with the highest shower energy. Figures are saved to 'event_display/event_<event ID>.png' in the
+    run's results directory. Events are found through the run's event index, and only the rows
+    of the requested events are read from the hit table.
+
+    :param list event_ids: event IDs (TLU numbers) to display
+    :param int top: number of events with the highest shower energy to display (if event_ids is None)
+    :return: list of the event IDs displayed
+    """
+    index, table_file = init_funcs.get_event_index(run_params.DUT_INPUT_FILE, run_params.INPUT_FILE_TYPE,
+                                                   run_params.DUT_ROOT_TREE)
+    if event_ids is None:
+        event_ids = index.top_events(top if top else 10)
+
+    # find the rows of each event
+    found, row_ranges = [], []
+    for event_id in event_ids:
+        rows = index.rows(int(event_id))
+        if rows is None:
+            print(f"Event {event_id} not found in run {run_params.RUN_NUM}")
+            continue
+        found.append(int(event_id))
+        row_ranges.append(rows)
+    columns = [run_params.PLANE_COL, run_params.CHANNEL_COL, run_params.AMPLITUDE_COL, run_params.SHOWER_ENERGY_COL]
+    hits = io_funcs.read_rows(table_file, row_ranges, columns=columns)
+
+    # plot each event (its rows are consecutive in hits)
+    path = run_params.RESULTS_DIR + "event_display/"
+    os.makedirs(path, exist_ok=True)
+    n_layers = max(run_params.LAYERS) + 1
+    offsets = np.cumsum([0] + [stop - start for start, stop in row_ranges])
+    for i, event_id in enumerate(found):
+        event = hits.iloc[offsets[i]:offsets[i + 1]]
+        maps = hits_to_sensor_maps(event[run_params.PLANE_COL].to_numpy(), event[run_params.CHANNEL_COL].to_numpy(),
+                                   event[run_params.AMPLITUDE_COL].to_numpy(), n_layers)
+        shower_energy = event[run_params.SHOWER_ENERGY_COL].iloc[0]
+        tb_plt.plot_event_display(maps[run_params.LAYERS], run_params.LAYERS_NAMES,
+                                  title=f"Run {run_params.RUN_NUM} - event {event_id} - "
+                                        f"shower energy {shower_energy} ADC counts",
+                                  path=path, out_filename=f"event_{event_id}.png")
+    print(f"Saved {len(found)} event displays to {path}")
+    return found
+
+
+if __name__ == "__main__":
+
+    arg_params = [["-r", "--runnum", int, "the run number"],
+                  ["-e", "--events", str, "comma-separated event IDs (TLU numbers) to display"],
+                  ["-n", "--top", int, "display the TOP events with the highest shower energy (default 10)"],
+                  ["-c", "--channel_mask", str, "'auto' or path of a saved channel mask (as used to process the run)"]]
+    args = utils.get_args(arg_params)
+    if args.runnum is None:
+        print("A run number is required (-r)")
+    else:
+        run_params.init_vars(args.runnum, ".root", f"./analysis_results/dut_plots/run_{args.runnum}/", None)
+        init_funcs.init_channel_mask(run_params.DUT_INPUT_FILE, run_params.INPUT_FILE_TYPE, run_params.DUT_ROOT_TREE,
+                                     args.channel_mask)
+        events = [int(event) for event in args.events.split(",")] if args.events else None
+        display_events(events, args.top)
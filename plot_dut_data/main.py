@@ -1,38 +1,65 @@
-import pandas as pd
 from .. import init_funcs
 from .. import run_params
 from .. import plotting as tb_plt
+from ..hist_cube import HistCube, HIST_COLUMNS
+from ..plot_renderer import PlotRenderer
 
 layers = run_params.LAYERS
 channels = run_params.CHANNELS
 
 
-def plot_manager(df):
+@init_funcs.uses_columns(*HIST_COLUMNS)
+def plot_manager(data):
     """
-    Given a DataFrame, create plots for test-beams
+    Given a DataFrame (or the histograms of a streamed run), write the histograms of the run to a ROOT file and
+    (unless run_params.OUTPUT is 'root') create plots for test-beams
 
-    :param pd.DataFrame df: input data
+    :param data: input data - flattened pd.DataFrame or HistCube
     :return:
     """
 
-    # get eventID, showerEnergy >> remove duplicates >> plot 1D histogram of showerEnergy
-    tb_plt.plot_shower_energy_dist(df)
+    # bin all channel, layer and shower energies and channel occupancy in a single pass
+    hists = data if isinstance(data, HistCube) else HistCube.from_df(data, jobs=run_params.PLOT_JOBS)
 
-    # get eventID, planeID, planeEnergy >> remove duplicates >> plot longitudinal profile
-    tb_plt.plot_average_longitudinal_profile(df)
+    # write all histograms of the run to a single ROOT file (once the run is complete, when following a live run).
+    # the plots are optional
+    if run_params.FOLLOW_INTERVAL is None:
+        hists.save_root(init_funcs.get_hists_root_path(), f"Run {run_params.RUN_NUM}")
+    if run_params.OUTPUT == "root":
+        return
 
-    # for each layer >> plot 1D histogram of planeEnergy and 2D heatmap of channels
-    tb_plt.plot_all_channel_frequency(df)
-    # for each channel >> plot energy distribution (1D histogram)
-    for i, layer in enumerate(layers):
-        layer_name = run_params.LAYERS_NAMES[i]
-        tb_plt.plot_layer_energy_dist(df, layer, layer_name)
-        for channel in channels:
-            tb_plt.plot_channel_energy_dist(df, channel, layer, layer_name)
+    # get shower energies >> plot 1D histogram of showerEnergy
+    tb_plt.plot_shower_energy_dist(hists)
 
+    # get layer energies >> plot longitudinal profile
+    tb_plt.plot_average_longitudinal_profile(hists)
+
+    # render the remaining figures (on run_params.PLOT_JOBS worker processes).
+    # when following a live run, only figures whose histograms changed since the last update are rendered
+    with PlotRenderer(run_params.PLOT_JOBS, skip_unchanged=run_params.FOLLOW_INTERVAL is not None) as renderer:
+        # for each layer >> plot 1D histogram of planeEnergy and 2D heatmap of channels
+        for spec in tb_plt.channel_frequency_specs(hists):
+            renderer.submit(tb_plt.plot_heatmap, spec)
+        # for each layer >> plot energy distribution (1D histogram)
+        for i, layer in enumerate(layers):
+            layer_name = run_params.LAYERS_NAMES[i]
+            renderer.submit(tb_plt.plot_1d_hist_binned, tb_plt.layer_energy_dist_spec(hists, layer, layer_name))
+        if run_params.CHANNEL_PLOTS == "single":
+            # for each channel >> plot energy distribution (1D histogram)
+            for i, layer in enumerate(layers):
+                layer_name = run_params.LAYERS_NAMES[i]
+                for channel in channels:
+                    renderer.submit(tb_plt.plot_1d_hist_binned,
+                                    tb_plt.channel_energy_dist_spec(hists, channel, layer, layer_name))
+        else:
+            # energy distribution of all layers in one figure, and of all channels of each layer in one figure
+            renderer.submit(tb_plt.plot_1d_hist_grid, tb_plt.all_layers_energy_dist_spec(hists))
+            for i, layer in enumerate(layers):
+                renderer.submit(tb_plt.plot_channel_hist_grid,
+                                tb_plt.channel_energy_dist_grid_spec(hists, layer, run_params.LAYERS_NAMES[i]))
 
 if __name__ == "__main__":
 
-    init_funcs.init_process(".root", plot_manager, res_dir="./analysis_results/dut_plots/")
+    init_funcs.init_process(".root", plot_manager, res_dir="./analysis_results/dut_plots/", streamable=True)
     # init_funcs.init_process(".parquet", plot_manager)
 
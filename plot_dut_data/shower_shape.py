@@ -0,0 +1,46 @@
+import os
+import matplotlib.pyplot as plt
+from .. import init_funcs
+from .. import run_params
+from .. import utils
+from .. import plotting as tb_plt
+
+
+def plot_shower_shapes():
+    """
+    Reconstruct (or load from cache) the per-event shower shapes of the current run (see run_params.init_vars and
+    shower_shape.shower_shapes), print their summary and plot the distributions of the hit multiplicity,
+    shower depth and transverse RMS to 'shower_shape/' in the run's results directory.
+
+    :return: pd.DataFrame of the shower shapes (one row per event)
+    """
+    shapes = init_funcs.get_shower_shapes(run_params.DUT_INPUT_FILE, run_params.INPUT_FILE_TYPE,
+                                          run_params.DUT_ROOT_TREE, parquet_filter=run_params.PARQUET_FILTER)
+    summary = ["hits", "layers_hit", "col", "row", "transverse_rms", "depth", "max_layer"]
+    print(shapes[summary].describe().to_string(float_format="{:.4g}".format))
+
+    path = run_params.RESULTS_DIR + "shower_shape/"
+    os.makedirs(path, exist_ok=True)
+    run = run_params.RUN_NUM
+    tb_plt.plot_1d_hist(shapes["hits"], bin_step=1, title=f"Run {run} - hit multiplicity", x_label="Hits",
+                        path=path, out_filename=f"run_{run}_hit_multiplicity.png")
+    tb_plt.plot_1d_hist(shapes["depth"].dropna(), bin_num=100, title=f"Run {run} - shower depth",
+                        x_label="Energy-weighted layer slot", path=path, out_filename=f"run_{run}_shower_depth.png")
+    tb_plt.plot_1d_hist(shapes["transverse_rms"].dropna(), bin_num=100, title=f"Run {run} - transverse RMS",
+                        x_label="Transverse RMS [pads]", path=path, out_filename=f"run_{run}_transverse_rms.png")
+    plt.close('all')
+    return shapes
+
+
+if __name__ == "__main__":
+
+    arg_params = [["-r", "--runnum", int, "the run number"],
+                  ["-c", "--channel_mask", str, "'auto' or path of a saved channel mask (as used to process the run)"]]
+    args = utils.get_args(arg_params)
+    if args.runnum is None:
+        print("A run number is required (-r)")
+    else:
+        run_params.init_vars(args.runnum, ".root", f"./analysis_results/dut_plots/run_{args.runnum}/", None)
+        init_funcs.init_channel_mask(run_params.DUT_INPUT_FILE, run_params.INPUT_FILE_TYPE, run_params.DUT_ROOT_TREE,
+                                     args.channel_mask)
+        plot_shower_shapes()
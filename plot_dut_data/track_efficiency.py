@@ -0,0 +1,90 @@
+import os
+import matplotlib.pyplot as plt
+from .. import io_funcs
+from .. import run_params
+from .. import utils
+from .. import plotting as tb_plt
+from ..pad_efficiency import PadEfficiency, HIT_TRACK_BRANCHES
+from ..tb_helpers_v2025 import channel_values_to_sensor_maps
+from ..dut_tele_sync_merge.merge_sentel import MERGED_FILE_PATH, MERGED_ROOT_TREE
+
+
+def track_efficiency(run_number, merged_file=None, out_dir=None, all_tracks=False,
+                     step_size=run_params.STREAM_STEP_SIZE):
+    """
+    Compute the efficiency and the hit-track residuals of every pad of all layers of a run from its merged
+    DUT/telescope file (see pad_efficiency.PadEfficiency), reading the file in chunks. Saves a table of all pads
+    ('run_<run number>_pad_efficiency.csv'), a table of the layers ('run_<run number>_layer_efficiency.csv'), and
+    the efficiency, residual and track maps of all layers to out_dir.
+
+    :param int run_number: run number
+    :param str merged_file: optional path to the merged file. default is in merge_sentel.MERGED_FILE_PATH
+    :param str out_dir: optional directory of output files. default is 'track_efficiency/' in the run's results
+    :param bool all_tracks: use all tracks of every event (default is only events with a single track)
+    :param step_size: number of entries per chunk, or memory size string (e.g. "100 MB")
+    :return: PadEfficiency
+    """
+    if merged_file is None:
+        merged_file = MERGED_FILE_PATH + f"TB25_Run_{run_number}.root"
+    if out_dir is None:
+        out_dir = f"./analysis_results/dut_plots/run_{run_number}/track_efficiency/"
+    os.makedirs(out_dir, exist_ok=True)
+
+    eff = PadEfficiency(single_track=not all_tracks)
+    for arrays in io_funcs.iterate_root(merged_file, MERGED_ROOT_TREE, step_size, branches=HIT_TRACK_BRANCHES):
+        eff.fill_arrays(arrays)
+    print(f"Read {eff.num_events} events with {eff.tracks.sum()} tracks on the sensor")
+
+    table = eff.table()
+    table.to_csv(out_dir + f"run_{run_number}_pad_efficiency.csv", index=False)
+    summary = eff.layer_summary()
+    summary.to_csv(out_dir + f"run_{run_number}_layer_efficiency.csv", index=False)
+    print(summary.to_string(index=False, float_format="{:.4g}".format))
+
+    plot_track_efficiency(eff, summary, run_number, out_dir)
+    return eff
+
+
+def plot_track_efficiency(eff, summary, run_number, path):
+    """
+    Plot the efficiency and mean residual maps of all layers, and the number of tracks per pad.
+
+    :param PadEfficiency eff: accumulated efficiency and residuals
+    :param pd.DataFrame summary: per-layer summary (see PadEfficiency.layer_summary)
+    :param int run_number: run number
+    :param str path: directory of output files
+    :return:
+    """
+    layers = run_params.LAYERS
+    names = run_params.LAYERS_NAMES
+    efficiency, _ = eff.efficiency()
+    tb_plt.plot_layer_maps(channel_values_to_sensor_maps(efficiency[layers]), names, (0, 1),
+                           title=f"Run {run_number} - pad efficiency", path=path,
+                           out_filename=f"run_{run_number}_pad_efficiency.png", colorbar_label="Efficiency",
+                           layer_labels=[f"{value:.3f}" for value in summary["efficiency"]])
+
+    mean, _ = eff.residual_stats()
+    limit = run_params.PAD_SIZE / 2
+    for i, axis in enumerate(("x", "y")):
+        tb_plt.plot_layer_maps(channel_values_to_sensor_maps(mean[i][layers]), names, (-limit, limit),
+                               title=f"Run {run_number} - mean {axis} residual (hit - track) by track pad",
+                               path=path, out_filename=f"run_{run_number}_residual_{axis}.png",
+                               colorbar_label=f"Mean {axis} residual [mm]", cmap="coolwarm",
+                               layer_labels=[f"{value:.3g} mm" for value in summary[f"mean_d{axis}"]])
+
+    tracks = channel_values_to_sensor_maps(eff.tracks, fill_value=0)
+    tb_plt.plot_heatmap(tracks, title=f"Run {run_number} - tracks per pad", x_label="Column", y_label="Row",
+                        path=path, out_filename=f"run_{run_number}_tracks_per_pad.png", colorbar_label="Tracks")
+    plt.close('all')
+
+
+if __name__ == "__main__":
+
+    arg_params = [["-r", "--runnum", int, "the run number"],
+                  ["-f", "--file", str, "path to the merged file (default in ./merged_dut_tele/)"],
+                  ["-t", "--tracks", str, "'single' (only events with a single track, default) or 'all'"]]
+    args = utils.get_args(arg_params)
+    if args.runnum is None:
+        print("A run number is required (-r)")
+    else:
+        track_efficiency(args.runnum, merged_file=args.file, all_tracks=args.tracks == "all")
@@ -0,0 +1,231 @@
+""" Rendering of plots from figure specs, serially or on a pool of worker processes """
+import os
+import hashlib
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+import matplotlib
+import matplotlib.pyplot as plt
+from . import instrumentation
+from .io_funcs import verify_file_extension
+
+_shared_pool = None  # (number of jobs, worker pool) used by all renderers inside shared_pool
+
+
+class PlotRenderer:
+    """
+    Renders figures from specs (a plotting function and its keyword arguments).
+    Specs should only hold pre-binned data, titles and output paths, so that they are cheap to send to workers.
+    A figure that fails is reported and does not stop the others.
+    With skip_unchanged, a figure is only rendered if its spec changed since it was last rendered (in this process)
+    or its file is missing - used to refresh the plots of a run that is still being taken.
+
+    Usage:
+        with PlotRenderer(jobs=8) as renderer:
+            renderer.submit(plotting.plot_1d_hist_binned, spec)
+    """
+    _rendered_digests = {}  # output file -> digest of the spec it was last rendered from (shared by all renderers)
+
+    def __init__(self, jobs=1, batch_size=16, skip_unchanged=False):
+        """
+        :param int jobs: number of worker processes. 1 (or None) renders in the current process.
+        :param int batch_size: number of specs sent to a worker at once
+        :param bool skip_unchanged: do not re-render figures whose spec did not change since they were last rendered
+        """
+        self.jobs = jobs if jobs else 1
+        self.batch_size = batch_size
+        self.skip_unchanged = skip_unchanged
+        self.failed = []  # list of (output file name, error)
+        self.num_rendered = 0
+        self.num_skipped = 0
+        self._batch = []
+        self._futures = []  # (future, output files of the batch)
+        self._executor = None
+        self._shared = self.jobs > 1 and _shared_pool is not None and _shared_pool[0] == self.jobs
+        if self._shared:
+            self._executor = _shared_pool[1]
+        elif self.jobs > 1:
+            self._executor = ProcessPoolExecutor(max_workers=self.jobs, initializer=_init_worker)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def submit(self, plot_func, spec):
+        """
+        Render a figure (or queue it for a worker).
+
+        :param function plot_func: module-level plotting function (e.g. plotting.plot_1d_hist_binned)
+        :param dict spec: keyword arguments of plot_func. None specs are ignored.
+        :return:
+        """
+        if spec is None:
+            return
+        if self.skip_unchanged and not self._changed(plot_func, spec):
+            self.num_skipped += 1
+            return
+        if self._executor is None:
+            self._collect(_render_batch([(plot_func, spec)]))
+            return
+        self._batch.append((plot_func, spec))
+        if len(self._batch) >= self.batch_size:
+            self._flush()
+
+    def close(self):
+        """
+        Wait for all figures to be rendered and report failures.
+
+        :return: list of (output file name, error) of the figures that failed
+        """
+        if self._executor is not None:
+            self._flush()
+            broken = False
+            for future, out_files in self._futures:
+                try:
+                    self._collect(future.result())
+                except Exception as e:  # a worker died - the whole batch is lost
+                    self.failed.extend((out_file, repr(e)) for out_file in out_files)
+                    broken = broken or isinstance(e, BrokenProcessPool)
+            if not self._shared:
+                self._executor.shutdown()
+            elif broken:
+                _restart_shared_pool()
+            self._executor = None
+            self._futures = []
+
+        print(f"Rendered {self.num_rendered} figures" +
+              (f" ({self.num_skipped} unchanged figures skipped)" if self.skip_unchanged else ""))
+        if self.failed:
+            print(f"{len(self.failed)} figures failed:")
+            for out_filename, error in self.failed:
+                print(f"    {out_filename}: {error}")
+                self._rendered_digests.pop(out_filename, None)  # retry on the next update
+        return self.failed
+
+    def _changed(self, plot_func, spec):
+        """ Check (and record) whether a figure's spec changed since the figure was last rendered """
+        out_file = spec_output_file(spec)
+        digest = spec_digest(plot_func, spec)
+        if self._rendered_digests.get(out_file) == digest and os.path.exists(out_file):
+            return False
+        self._rendered_digests[out_file] = digest
+        return True
+
+    def _flush(self):
+        if self._batch:
+            self._futures.append((self._executor.submit(_render_batch, self._batch, True),
+                                  [spec_output_file(spec) for _, spec in self._batch]))
+            self._batch = []
+
+    def _collect(self, result):
+        num_rendered, failed, stats = result
+        self.num_rendered += num_rendered
+        self.failed.extend(failed)
+        instrumentation.merge_stats(stats)  # stage measurements of worker processes
+
+
+@contextmanager
+def shared_pool(jobs):
+    """
+    Keep a single pool of jobs worker processes for all PlotRenderers (of jobs workers) created inside the block,
+    e.g. for every update of a run that is followed, instead of starting and stopping the workers for each renderer.
+
+    Usage:
+        with shared_pool(8):
+            for update in updates:
+                with PlotRenderer(jobs=8) as renderer:
+                    ...
+
+    :param int jobs: number of worker processes. Nothing is shared for 1 (or None)
+    :return:
+    """
+    global _shared_pool
+    if not jobs or jobs <= 1 or _shared_pool is not None:
+        yield
+        return
+    _shared_pool = (jobs, ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker))
+    try:
+        yield
+    finally:
+        _shared_pool[1].shutdown()
+        _shared_pool = None
+
+
+def _restart_shared_pool():
+    """ Replace the shared pool after one of its workers died (a broken pool cannot run new tasks) """
+    global _shared_pool
+    jobs, executor = _shared_pool
+    executor.shutdown()
+    _shared_pool = (jobs, ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker))
+
+
+def _init_worker():
+    """ Worker processes only write files """
+    matplotlib.use("Agg")
+    instrumentation.reset()  # do not report measurements inherited from the parent process
+
+
+def _render_batch(batch, in_worker=False):
+    """
+    Render a batch of figure specs.
+
+    :param list batch: list of (plotting function, keyword arguments)
+    :param bool in_worker: True if called in a worker process (its stage measurements are returned)
+    :return: number of rendered figures, list of (output file name, error) of failed figures,
+             stage measurements of the worker (see instrumentation.get_stats)
+    """
+    num_rendered = 0
+    failed = []
+    for plot_func, spec in batch:
+        try:
+            plot_func(**spec)
+            num_rendered += 1
+        except Exception as e:
+            failed.append((spec_output_file(spec), f"{type(e).__name__}: {e}"))
+        finally:
+            plt.close('all')
+    return num_rendered, failed, instrumentation.get_stats(clear=True) if in_worker else {}
+
+
+def spec_output_file(spec):
+    """
+    Output file of a figure spec (as saved by plotting.save_fig).
+
+    :param dict spec: keyword arguments of a plotting function
+    :return: path of the output file (the title if the spec has no output file name)
+    """
+    out_filename = spec.get("out_filename") or spec.get("title")
+    return verify_file_extension(spec.get("path", "./") + str(out_filename), ".png")
+
+
+def spec_digest(plot_func, spec):
+    """
+    Digest of a figure spec: identical digests give identical figures.
+
+    :param function plot_func: plotting function
+    :param dict spec: keyword arguments of plot_func
+    :return: str
+    """
+    digest = hashlib.sha1(f"{plot_func.__module__}.{plot_func.__qualname__}".encode())
+    _update_digest(digest, spec)
+    return digest.hexdigest()
+
+
+def _update_digest(digest, value):
+    """ Add a spec value to a digest (recursing into dicts and lists of sub-figure specs) """
+    if isinstance(value, dict):
+        for key in sorted(value):
+            digest.update(key.encode())
+            _update_digest(digest, value[key])
+    elif isinstance(value, (list, tuple)) and any(isinstance(item, (dict, np.ndarray)) for item in value):
+        digest.update(f"{type(value).__name__}{len(value)}".encode())
+        for item in value:
+            _update_digest(digest, item)
+    elif isinstance(value, np.ndarray):
+        digest.update(str((value.dtype, value.shape)).encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    else:
+        digest.update(repr(value).encode())
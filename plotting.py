@@ -2,107 +2,247 @@ import copy
 import warnings
 import numpy as np
 import matplotlib.pyplot as plt
-from matplotlib import cm, colors
+from matplotlib import cm, colors, ticker
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import PolyCollection
 from . import run_params
 from .io_funcs import verify_file_extension
-from .df_handling import unique_df, filter_df
-from .tb_helpers_v2025 import get_layer_energies, calc_freq
-from .run_params import EVENT_ID_COL, CHANNEL_COL, AMPLITUDE_COL, SHOWER_ENERGY_COL, ROWS, COLS, LAYERS
+from .instrumentation import instrumented
+from .tb_helpers_v2025 import counts_to_sensor_map, channel_to_sensor_coord
+from .run_params import ROWS, COLS, LAYERS
 
+_FIGURE_TEMPLATES = {}  # plot type -> figure template, reused by all figures of that type (see HistFigureTemplate)
 
-def plot_shower_energy_dist(df):
+
+@instrumented()
+def plot_shower_energy_dist(hists):
     """
     Plot histogram of shower energy.
 
-    :param pandas.DataFrame df: input data
+    :param HistCube hists: pre-binned histograms of the run
     :return:
     """
-    # get shower energies
-    showers = unique_df(df[[EVENT_ID_COL, SHOWER_ENERGY_COL]])
-    shower_energies = showers[SHOWER_ENERGY_COL].to_numpy()
-    # set x-axis limits
-    x_lim = set_lims(shower_energies)
     # plot and save histogram
-    plot_1d_hist(shower_energies, bin_step=50, title='Total energy distribution (showers)', x_label='ADC counts',
-                 path=run_params.RESULTS_DIR, out_filename='shower_energy_distribution.png', x_lim=x_lim)
+    plot_1d_hist_binned(**hists.showers.plot_spec(overflow=hists.overflow("showers")),
+                        title='Total energy distribution (showers)', x_label='ADC counts',
+                        path=run_params.RESULTS_DIR, out_filename='shower_energy_distribution.png')
     plt.close('all')
 
 
-def plot_layer_energy_dist(df, layer_num, layer_name, ax=None):
+@instrumented()
+def plot_layer_energy_dist(hists, layer_num, layer_name, ax=None):
     """
     Plot histogram of layer energy.
 
-    :param pandas.DataFrame df: input data
+    :param HistCube hists: pre-binned histograms of the run
     :param int layer_num: layer number
     :param plt.Axes ax: axes object to plot histogram onto
     :param str layer_name: name for layer (e.g. number of W plates)
     :return:
     """
-    # get layer energy
-    layer_energies = get_layer_energies(df, layer_num)
-    # set x-axis limits
-    x_lim = set_lims(layer_energies)
-    # plot and save histogram
-    plot_1d_hist(layer_energies, ax, bin_step=10,
-                 title=f'Total energy distribution - layer slot {layer_name}', x_label='ADC counts',
-                 path=run_params.RESULTS_DIR, out_filename=f'layer_slot_{layer_name}_energy_distribution.png',
-                 x_lim=x_lim)
+    plot_1d_hist_binned(ax=ax, **layer_energy_dist_spec(hists, layer_num, layer_name))
+
+
+def layer_energy_dist_spec(hists, layer_num, layer_name):
+    """
+    Get the plot_1d_hist_binned arguments of a layer energy histogram.
+
+    :param HistCube hists: pre-binned histograms of the run
+    :param int layer_num: layer number
+    :param str layer_name: name for layer (e.g. number of W plates)
+    :return: dict of keyword arguments
+    """
+    return dict(**hists.layers.plot_spec(layer_num, overflow=hists.overflow("layers", layer_num)),
+                title=f'Total energy distribution - layer slot {layer_name}', x_label='ADC counts',
+                path=run_params.RESULTS_DIR, out_filename=f'layer_slot_{layer_name}_energy_distribution.png')
 
 
-def plot_channel_energy_dist(df, pad_num, layer_num, layer_name):
+@instrumented()
+def plot_channel_energy_dist(hists, pad_num, layer_num, layer_name):
     """
     Plot histogram of channel energy.
 
-    :param pandas.DataFrame df: input data
+    :param HistCube hists: pre-binned histograms of the run
     :param int pad_num: pad (channel) number
     :param int layer_num: layer number
     :param str layer_name: name for layer (e.g. number of W plates)
     :return:
     """
-    # get channel data
-    channel_df = filter_df(df, planes=layer_num, channels=pad_num)
-    channel_energies = channel_df[AMPLITUDE_COL].to_numpy()
-    if len(channel_energies) > 0:
-        # set x-axis lim
-        x_lim = set_lims(channel_energies)
+    spec = channel_energy_dist_spec(hists, pad_num, layer_num, layer_name)
+    if spec is not None:
         # plot and save histogram
-        path = run_params.RESULTS_DIR
-        path += f'energy_per_channel/layer_slot_{layer_name}/'
-        plot_1d_hist(channel_energies, bin_step=1, title=f'Channel {pad_num} Layer slot {layer_name}',
-                     x_label='ADC counts', path=path,
-                     out_filename=f'channel_{pad_num}_layer_slot_{layer_name}_energy_distribution.png', x_lim=x_lim)
+        plot_1d_hist_binned(**spec)
         plt.close('all')
 
 
-def plot_all_layers_energy_dist(df):
+def channel_energy_dist_spec(hists, pad_num, layer_num, layer_name):
+    """
+    Get the plot_1d_hist_binned arguments of a channel energy histogram.
+
+    :param HistCube hists: pre-binned histograms of the run
+    :param int pad_num: pad (channel) number
+    :param int layer_num: layer number
+    :param str layer_name: name for layer (e.g. number of W plates)
+    :return: dict of keyword arguments, None if the channel has no entries
+    """
+    idx = (layer_num, pad_num)
+    if hists.channels.entries[idx] == 0:
+        return None
+    path = run_params.RESULTS_DIR
+    path += f'energy_per_channel/layer_slot_{layer_name}/'
+    return dict(**hists.channels.plot_spec(idx), title=f'Channel {pad_num} Layer slot {layer_name}',
+                x_label='ADC counts', path=path,
+                out_filename=f'channel_{pad_num}_layer_slot_{layer_name}_energy_distribution.png')
+
+
+@instrumented()
+def plot_all_layers_energy_dist(hists):
     """
-    Plot histogram of layer energy per layer.
+    Plot histogram of layer energy per layer, all layers in a single figure.
 
-    :param pandas.DataFrame df: input data
+    :param HistCube hists: pre-binned histograms of the run
     :return:
     """
+    plot_1d_hist_grid(**all_layers_energy_dist_spec(hists))
+    plt.close('all')
 
-    # Create a figure and a 3x4 grid of subplots
-    fig, ax = plt.subplots(3, 4, figsize=(30, 15), constrained_layout=True)
-    ax = ax.flatten()  # Flatten the 2D array of axes for easy iteration
 
-    path = run_params.RESULTS_DIR
-    # plot histogram per layer
-    for layer in LAYERS:
-        ax_num = layer
-        # plot histogram of current layer
-        plot_layer_energy_dist(df, layer, path, ax[ax_num])
-        ax[ax_num].set_title(f"Layer slot {run_params.LAYERS_NAMES[layer]}")
+def all_layers_energy_dist_spec(hists):
+    """
+    Get the plot_1d_hist_grid arguments of the summary figure of the layer energy histograms of all layers.
+
+    :param HistCube hists: pre-binned histograms of the run
+    :return: dict of keyword arguments
+    """
+    hist_specs = []
+    for i, layer in enumerate(LAYERS):
+        layer_name = run_params.LAYERS_NAMES[i]
+        spec = layer_energy_dist_spec(hists, layer, layer_name)
+        spec['title'] = f"Layer slot {layer_name}"
+        hist_specs.append(spec)
+    return dict(hist_specs=hist_specs, n_cols=4, path=run_params.RESULTS_DIR,
+                out_filename="energy_dist_all_layers.png")
+
+
+@instrumented()
+def plot_1d_hist_grid(hist_specs, n_cols=4, title=None, path='./', out_filename=None):
+    """
+    Draws several already binned 1D histograms in a grid of subplots and saves them as a single figure.
+
+    :param list hist_specs: list of dicts of plot_1d_hist_binned keyword arguments (one per subplot)
+    :param int n_cols: number of columns of the grid
+    :param str title: Optional. Title of the figure. Default is None.
+    :param str path: Optional. Path to which the figure will be saved. Default is current directory.
+    :param str out_filename: Optional. File name of the figure. Default is the title param.
+    :return:
+    """
+    n_rows = int(np.ceil(len(hist_specs) / n_cols))
+    fig, ax = plt.subplots(n_rows, n_cols, figsize=(7.5 * n_cols, 5 * n_rows), constrained_layout=True,
+                           squeeze=False)
+    ax = ax.flatten()  # Flatten the 2D array of axes for easy iteration
 
+    for i, spec in enumerate(hist_specs):
+        plot_1d_hist_binned(ax=ax[i], **spec)
     # delete unused axes
-    fig.delaxes(ax[8])
-    fig.delaxes(ax[11])
+    for i in range(len(hist_specs), len(ax)):
+        fig.delaxes(ax[i])
+
+    if title is not None:
+        fig.suptitle(title)
+    save_fig(fig, path, out_filename if out_filename is not None else title)
 
-    # save figure
-    save_fig(fig, path=path, out_filename="energy_dist_all_layers")
-    plt.close('all')
 
+def channel_energy_dist_grid_spec(hists, layer_num, layer_name):
+    """
+    Get the plot_channel_hist_grid arguments of the channel energy histograms of a layer.
+    All channels share the x-axis range: from the layer's minimum (or 0) to the largest upper limit
+    (mean + 5 std) of its channels.
 
+    :param HistCube hists: pre-binned histograms of the run
+    :param int layer_num: layer number
+    :param str layer_name: name for layer (e.g. number of W plates)
+    :return: dict of keyword arguments, None if the layer has no entries
+    """
+    channels = hists.channels
+    entries = channels.entries[layer_num]
+    has_entries = entries > 0
+    if not has_entries.any():
+        return None
+    stats = channels.stats()
+    x_min = min(np.min(stats["min"][layer_num][has_entries]), 0)
+    x_max = np.max(np.where(stats["x_lim_max"][layer_num] > stats["min"][layer_num],
+                            stats["x_lim_max"][layer_num], stats["max"][layer_num])[has_entries])
+    n_bins = channels.counts.shape[-1]
+    first = int(np.clip((x_min - channels.low) // channels.bin_step, 0, n_bins - 1))
+    last = int(np.clip((x_max - channels.low) // channels.bin_step, first, n_bins - 1))
+    edges = channels.low + np.arange(first, last + 2) * channels.bin_step
+    return dict(counts=channels.counts[layer_num][:, first:last + 1], edges=edges, entries=entries,
+                title=f'Channel energy distributions - layer slot {layer_name}', x_label='ADC counts',
+                path=run_params.RESULTS_DIR, out_filename=f'channels_layer_slot_{layer_name}_energy_distribution.png')
+
+
+@instrumented()
+def plot_channel_hist_grid(counts, edges, entries, log=False, title='Channel histograms', x_label='', path='./',
+                           out_filename=None):
+    """
+    Draws the already binned 1D histograms of all channels of a layer as small multiples, laid out like the pads
+    on the sensor (see tb_helpers_v2025.channel_to_sensor_coord), and saves them as a single figure.
+    All histograms are drawn as one collection on a single axes: each fills its pad's cell, with the x-axis range
+    shared by all pads and the y-axis scaled to the channel's highest bin.
+
+    :param numpy.ndarray counts: (channels, bins) array of bin counts
+    :param numpy.ndarray edges: bin edges shared by all channels (bins + 1)
+    :param numpy.ndarray entries: number of entries per channel
+    :param bool log: Optional. Flag for using log scale for the y-axes. Default is False.
+    :param str title: Optional. Title of the figure. Default is 'Channel histograms'.
+    :param str x_label: Optional. Label of the x-axis (shown in the figure's x label). Default is an empty string.
+    :param str path: Optional. Path to which the figure will be saved. Default is current directory.
+    :param str out_filename: Optional. File name of the figure. Default is the title param.
+    :return:
+    """
+    margin = 0.08  # fraction of a pad's cell left empty on each side
+    counts = np.asarray(counts, dtype=float)
+    if log:
+        counts = np.log10(counts + 1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        heights = np.nan_to_num(counts / counts.max(axis=1, keepdims=True))
+
+    # outline of each histogram as a step polygon, in units of the pad's cell (the cell is 1x1)
+    x = margin + (np.repeat(edges, 2)[1:-1] - edges[0]) / (edges[-1] - edges[0]) * (1 - 2 * margin)
+    y = margin + np.repeat(heights, 2, axis=1) * (1 - 2 * margin)
+    n_channels, n_points = y.shape
+    cols, rows = channel_to_sensor_coord(np.arange(n_channels))
+    verts = np.empty((n_channels, n_points + 2, 2))
+    verts[:, 1:-1, 0] = x + cols[:, None]
+    verts[:, 1:-1, 1] = y + rows[:, None]
+    verts[:, 0] = verts[:, 1] * [1, 0] + np.column_stack([np.zeros(n_channels), rows + margin])
+    verts[:, -1] = verts[:, -2] * [1, 0] + np.column_stack([np.zeros(n_channels), rows + margin])
+
+    fig, ax = plt.subplots(1, figsize=(1.2 * COLS, 1.0 * ROWS))
+    ax.add_collection(PolyCollection(verts[entries > 0], facecolors='tab:blue', edgecolors='tab:blue',
+                                     linewidths=0.5))
+    for ch in range(n_channels):
+        ax.text(cols[ch] + 1 - margin, rows[ch] + 1 - margin, f"{ch}\n{entries[ch]}", ha='right', va='top',
+                fontsize=6)
+
+    # pad grid: column/row number ticks (row 0 at the bottom, as on the sensor)
+    ax.set_xlim(0, COLS)
+    ax.set_ylim(0, ROWS)
+    ax.set_xticks(np.arange(COLS) + 0.5, labels=range(COLS))
+    ax.set_yticks(np.arange(ROWS) + 0.5, labels=range(ROWS))
+    ax.set_xticks(range(COLS + 1), minor=True)
+    ax.set_yticks(range(ROWS + 1), minor=True)
+    ax.tick_params(which='minor', length=0)
+    ax.grid(which='minor', color='gray', linewidth=0.5)
+
+    y_label = 'Row (entries, ' + ('log scale, ' if log else '') + 'normalized per pad)'
+    x_range = f'{x_label} {format_latex(edges[0])} - {format_latex(edges[-1])} per pad'
+    style_fig(ax, title, f'Column ({x_range.strip()})', y_label)
+    save_fig(fig, path, out_filename if out_filename is not None else title)
+
+
+@instrumented()
 def plot_1d_hist(data, ax=None, bin_num=None, bin_step=None, log=False, title='Histogram', x_label='',
                  y_label='Entries', path='./', out_filename=None, x_lim=None, y_lim=None,
                  x_ticks=None, x_ticks_labels=None):
@@ -129,71 +269,154 @@ def plot_1d_hist(data, ax=None, bin_num=None, bin_step=None, log=False, title='H
     if data is None or len(data) == 0:
         # warnings.warn("Cannot plot empty data.")
         return
-
-    # create figure if needed
-    if ax is None:
-        fig, ax = plt.subplots(1)
-        save = True
-    else:
-        save = False
-
-    # set output file name
-    if out_filename is None:
-        out_filename = title
+    data = np.asarray(data)
+    stats = data_stats(data)
 
     # count overflow
     overflow = 0
     if x_lim is not None:
-        overflow = len(np.where(data > x_lim[1]))
-        # print(np.where(data > x_lim[1]))
+        overflow = int(np.count_nonzero(data > x_lim[1]))
 
     # set histogram binning
     bins = 'auto'
     if bin_num:
         bins = bin_num
     elif bin_step:
-        min_val = min(np.min(data), 0)
-        bins = get_equal_bins(min_val, np.max(data), step=bin_step)
+        min_val = min(stats['min'], 0)
+        bins = get_equal_bins(min_val, stats['max'], step=bin_step)
+    counts, edges = np.histogram(data, bins=bins, range=(stats['min'], stats['max']))  # (ignored for given edges)
 
-    # calculate histogram statistics
-    mean_val = np.mean(data)
-    std_val = np.std(data)
-    entry_count = len(data)
+    # create histogram and save
+    plot_1d_hist_binned(counts, edges, stats['entries'], stats['mean'], stats['std'], overflow, ax, log, title,
+                        x_label, y_label, path, out_filename, x_lim, y_lim, x_ticks, x_ticks_labels)
 
-    # create histogram
-    ax.hist(data, bins=bins, histtype='bar', ec='black')
+
+@instrumented()
+def plot_1d_hist_binned(counts, edges, entries, mean, std, overflow, ax=None, log=False, title='Histogram',
+                        x_label='', y_label='Entries', path='./', out_filename=None, x_lim=None, y_lim=None,
+                        x_ticks=None, x_ticks_labels=None):
+    """
+    Draws an already binned 1D histogram and saves.
+
+    :param numpy.ndarray counts: bin counts
+    :param numpy.ndarray edges: bin edges (len(counts) + 1)
+    :param int entries: number of entries (for the legend)
+    :param double mean: mean value (for the legend)
+    :param double std: standard deviation (for the legend)
+    :param int overflow: number of entries above the x-axis limit (for the legend)
+    :param plt.Axes ax: Optional. Axes to plot histogram onto. If None, creates a new figure.
+    :param bool log: Optional. Flag for using log scale for the y-axis. Default is False.
+    :param str title: Optional. Title of the histogram. Default is 'Histogram'.
+    :param str x_label: Optional. Label of the x-axis. Default is an empty string.
+    :param str y_label: Optional. Label of the y-axis. Default is 'Entries'.
+    :param str path: Optional. Path to which the plot will be saved. Default is current directory.
+    :param str out_filename: Optional. File name of the histogram. Default is the title param.
+    :param tuple x_lim: Optional. x-axis limits. Default is None.
+    :param tuple y_lim: Optional. y-axis limits. Default is None.
+    :param list x_ticks: list of x ticks. Necessary if x_ticks_labels is not None
+    :param list x_ticks_labels: list of x ticks labels
+    :return:
+    """
+    # validate input data
+    if counts is None or len(counts) == 0:
+        return
+
+    # set output file name
+    if out_filename is None:
+        out_filename = title
+
+    mean_str = format_latex(mean)
+    std_str = format_latex(std)
+    legend_lst = [f'Entries = {entries}\nMean Value = {mean_str}\nStd = {std_str}\nOverflow = {overflow}']
+
+    if ax is None:
+        # update the histogram figure template in place and save
+        fig = _hist_template().update(counts, edges, legend_lst[0], log, title, x_label, y_label, x_lim, y_lim,
+                                      x_ticks, x_ticks_labels)
+        save_fig(fig, path, out_filename)
+        return
+
+    # create histogram on the given axes
+    ax.stairs(counts, edges, fill=True, ec='black')
     ax.grid(axis='y', alpha=0.75)  # add vertical grid
 
-    # set labels etc. and save figure
-    mean_str = format_latex(mean_val)
-    std_str = format_latex(std_val)
-    legend_lst = [f'Entries = {entry_count}\nMean Value = {mean_str}\nStd = {std_str}\nOverflow = {overflow}']
+    # set labels etc.
     style_fig(ax, title, x_label, y_label, x_lim, y_lim, log, legend_lst, x_ticks, x_ticks_labels)
-    if save:
-        save_fig(fig, path, out_filename)
 
-    
-def plot_average_longitudinal_profile(df):
+
+class HistFigureTemplate:
+    """
+    A 1D histogram figure that is drawn once and updated in place for every histogram (bin contents, limits,
+    titles and legend text), instead of building a new figure per histogram.
+    The figure is not managed by pyplot, so plt.close('all') does not close it.
+    """
+    def __init__(self):
+        self.fig = Figure()
+        FigureCanvasAgg(self.fig)
+        self.ax = self.fig.subplots(1)
+        self.artist = self.ax.stairs([0], [0, 1], fill=True, ec='black')
+        self.ax.grid(axis='y', alpha=0.75)  # add vertical grid
+        self.legend = self.ax.legend([self.artist], [''], loc='best')
+
+    def update(self, counts, edges, legend_text, log=False, title='Histogram', x_label='', y_label='Entries',
+               x_lim=None, y_lim=None, x_ticks=None, x_ticks_labels=None):
+        """
+        Set the histogram shown by the template.
+
+        :param numpy.ndarray counts: bin counts
+        :param numpy.ndarray edges: bin edges (len(counts) + 1)
+        :param str legend_text: text of the legend entry
+        :param bool log: flag for using log scale for the y-axis
+        :param str title: title of the histogram
+        :param str x_label: label of the x-axis
+        :param str y_label: label of the y-axis
+        :param tuple x_lim: x-axis limits. Default is the range of the bins.
+        :param tuple y_lim: y-axis limits. Default is set from the highest bin.
+        :param list x_ticks: list of x ticks. Necessary if x_ticks_labels is not None
+        :param list x_ticks_labels: list of x ticks labels
+        :return: the template's plt.Figure
+        """
+        ax = self.ax
+        self.artist.set_data(counts, edges)
+        self.legend.get_texts()[0].set_text(legend_text)
+
+        # reset the axes' scale and ticks (style_fig only sets them when requested)
+        max_count = max(np.max(counts), 1)
+        if log:
+            ax.set_ylim(0.5, max_count * 2)  # (positive limits first, so that switching to log scale does not warn)
+            ax.set_yscale('log')
+        else:
+            ax.set_yscale('linear')
+            ax.set_ylim(0, max_count * 1.05)
+        ax.set_xlim(edges[0], edges[-1])
+        if x_ticks is None:
+            ax.xaxis.set_major_locator(ticker.AutoLocator())
+            ax.xaxis.set_major_formatter(ticker.ScalarFormatter())
+
+        style_fig(ax, title, x_label, y_label, x_lim, y_lim, log, x_ticks=x_ticks, x_ticks_labels=x_ticks_labels)
+        return self.fig
+
+
+def _hist_template():
+    """ The histogram figure template of the current process (created on first use) """
+    if "hist_1d" not in _FIGURE_TEMPLATES:
+        _FIGURE_TEMPLATES["hist_1d"] = HistFigureTemplate()
+    return _FIGURE_TEMPLATES["hist_1d"]
+
+
+@instrumented()
+def plot_average_longitudinal_profile(hists):
     """
     Calculate average energy deposition in each layer and plot longitudinal profile.
 
-    :param pandas.DataFrame df: input data
+    :param HistCube hists: pre-binned histograms of the run
     :return:
     """
-    mean_vals = []
-    std_vals = []
-
     # Get average ADC for each layer
-    for i, layer in enumerate(LAYERS):
-        # get layer energy
-        layer_data = get_layer_energies(df, layer)
-        if len(layer_data) == 0:
+    mean_vals, std_vals = hists.longitudinal_profile()
+    for layer, mean_val in zip(LAYERS, mean_vals):
+        if np.isnan(mean_val):
             print(f"No events in layer index {layer} (as numbered by electronics)")
-            mean_vals.append(np.nan)
-            std_vals.append(np.nan)
-            continue
-        mean_vals.append(np.mean(layer_data))
-        std_vals.append(np.std(layer_data) / np.sqrt(len(layer_data)))
 
     # plot and save
     scatter_plot(LAYERS, mean_vals, y_error=std_vals, title='Average Longitudinal Profile', x_label='Layer Slot',
@@ -202,6 +425,7 @@ def plot_average_longitudinal_profile(df):
     plt.close('all')
 
 
+@instrumented()
 def scatter_plot(x, y, x_error=None, y_error=None, log=False, title='Scatter plot', x_label='', y_label='',
                  path='./', out_filename=None, x_lim=None, y_lim=None, x_ticks=None, x_ticks_labels=None,
                  invert_x=False):
@@ -244,34 +468,43 @@ def scatter_plot(x, y, x_error=None, y_error=None, log=False, title='Scatter plo
     return
 
 
-def plot_all_channel_frequency(df):
+@instrumented()
+def plot_all_channel_frequency(hists):
     """
     Plot a 2D heatmap of the channels frequency of hits
 
-    :param pandas.DataFrame df: input data
+    :param HistCube hists: pre-binned histograms of the run
     :return:
     """
-    # # get number of events
-    # num_events = len(np.unique(df[EVENT_ID_COL].to_numpy()))
-
-    path = run_params.RESULTS_DIR
     # plot frequency per layer
-    for i, layer in enumerate(LAYERS):
-        # get channels data in given layer
-        channel_data = filter_df(df, planes=layer)
-        channel_data = unique_df(channel_data[[EVENT_ID_COL, CHANNEL_COL]])
-        channel_hits = channel_data[CHANNEL_COL].to_numpy()
-        if len(channel_hits) > 0:
-            # calculate number of hits per channel
-            freq = calc_freq(channel_hits)
-            # plot for single layer
-            plot_heatmap(freq, title=f"Layer Slot {run_params.LAYERS_NAMES[i]}", x_label='Column', y_label='Row', path=path,
-                         out_filename=f"channel_frequency_layer_slot_{run_params.LAYERS_NAMES[i]}.png")
-            plt.close('all')
+    for spec in channel_frequency_specs(hists):
+        plot_heatmap(**spec)
+        plt.close('all')
 
     return
 
 
+def channel_frequency_specs(hists):
+    """
+    Get the plot_heatmap arguments of the channels frequency heatmap of each layer.
+
+    :param HistCube hists: pre-binned histograms of the run
+    :return: list of dicts of keyword arguments (layers without hits are skipped)
+    """
+    path = run_params.RESULTS_DIR
+    specs = []
+    for i, layer in enumerate(LAYERS):
+        # get number of events with a hit per channel in given layer
+        channel_hits = hists.occupancy[layer]
+        if channel_hits.sum() > 0:
+            freq = counts_to_sensor_map(channel_hits)
+            specs.append(dict(data=freq, title=f"Layer Slot {run_params.LAYERS_NAMES[i]}", x_label='Column',
+                              y_label='Row', path=path,
+                              out_filename=f"channel_frequency_layer_slot_{run_params.LAYERS_NAMES[i]}.png"))
+    return specs
+
+
+@instrumented()
 def plot_heatmap(data, fig=None, ax=None, log=False, title='Heatmap', x_label='', y_label='', path='./',
                  out_filename=None, v_min=None, v_max=None, colorbar_label="Counts"):
     """
@@ -323,6 +556,118 @@ def plot_heatmap(data, fig=None, ax=None, log=False, title='Heatmap', x_label=''
     return im
 
 
+@instrumented()
+def plot_event_display(maps, layer_names, title='Event display', path='./', out_filename=None,
+                       colorbar_label='Amplitude [ADC counts]'):
+    """
+    Plots the pad maps of all layers of a single event in one figure (one heatmap per layer, with a shared color
+    scale) and saves. The figure is a template drawn once and updated in place for every event.
+
+    :param numpy.ndarray maps: (layers, ROWS, COLS) array of the pad values of each layer (see
+                               tb_helpers_v2025.hits_to_sensor_maps), in display order
+    :param list layer_names: name of each layer (for the subplot titles)
+    :param str title: Optional. Title of the figure. Default is 'Event display'.
+    :param str path: Optional. Path to which the figure will be saved. Default is current directory.
+    :param str out_filename: Optional. File name of the figure. Default is the title param.
+    :param str colorbar_label: Optional. Label for colorbar.
+    :return:
+    """
+    key = ("event_display", len(maps), colorbar_label)
+    if key not in _FIGURE_TEMPLATES:
+        _FIGURE_TEMPLATES[key] = EventDisplayTemplate(len(maps), colorbar_label)
+    fig = _FIGURE_TEMPLATES[key].update(maps, layer_names, title)
+    save_fig(fig, path, out_filename if out_filename is not None else title)
+
+
+@instrumented()
+def plot_layer_maps(maps, layer_names, v_range, title='Layer maps', path='./', out_filename=None, colorbar_label='',
+                    cmap='jet', layer_labels=None):
+    """
+    Plots per-pad values of all layers (e.g. efficiency) in one figure, with a fixed color range, and saves.
+    Pads with NaN values (e.g. without tracks) are white. Uses the event display figure template.
+
+    :param numpy.ndarray maps: (layers, ROWS, COLS) array of the pad values of each layer, in display order
+    :param list layer_names: name of each layer (for the subplot titles)
+    :param tuple v_range: (min, max) values of the color scale
+    :param str title: Optional. Title of the figure. Default is 'Layer maps'.
+    :param str path: Optional. Path to which the figure will be saved. Default is current directory.
+    :param str out_filename: Optional. File name of the figure. Default is the title param.
+    :param str colorbar_label: Optional. Label for colorbar.
+    :param str cmap: Optional. Name of the color map. Default is 'jet'.
+    :param list layer_labels: Optional. Text added to the title of each layer (e.g. its mean value).
+    :return:
+    """
+    key = ("layer_maps", len(maps), colorbar_label, cmap)
+    if key not in _FIGURE_TEMPLATES:
+        _FIGURE_TEMPLATES[key] = EventDisplayTemplate(len(maps), colorbar_label, cmap=cmap)
+    fig = _FIGURE_TEMPLATES[key].update(maps, layer_names, title, v_range=v_range, layer_labels=layer_labels)
+    save_fig(fig, path, out_filename if out_filename is not None else title)
+
+
+class EventDisplayTemplate:
+    """
+    A figure of the pad heatmaps of all layers, drawn once and updated in place for every event
+    (see HistFigureTemplate).
+    """
+    def __init__(self, n_layers, colorbar_label, n_cols=4, cmap="jet"):
+        """
+        :param int n_layers: number of heatmaps
+        :param str colorbar_label: label for colorbar
+        :param int n_cols: number of columns of the grid of heatmaps
+        :param str cmap: name of the color map
+        """
+        n_rows = int(np.ceil(n_layers / n_cols))
+        self.fig = Figure(figsize=(5 * n_cols, 3.6 * n_rows), constrained_layout=True)
+        FigureCanvasAgg(self.fig)
+        axes = self.fig.subplots(n_rows, n_cols, squeeze=False).flatten()
+        self.norm = colors.Normalize(vmin=0, vmax=1)
+        cmap = copy.copy(cm.get_cmap(cmap))
+        cmap.set_under('white')
+        cmap.set_bad('white')
+        self.images = []
+        self.axes = axes[:n_layers]
+        for i, ax in enumerate(self.axes):
+            self.images.append(ax.imshow(np.zeros((ROWS, COLS)), cmap=cmap, norm=self.norm))
+            set_heatmap_style(ax)
+            # fewer ticks, and tick labels only on the outer heatmaps (ticks are most of the drawing time)
+            ax.set_xticks(list(range(0, COLS, 5)))
+            ax.set_yticks(list(range(ROWS - 1, -1, -4)), labels=list(range(0, ROWS, 4)))
+            ax.tick_params(labelsize=6, labelleft=i % n_cols == 0, labelbottom=i + n_cols >= n_layers)
+        for ax in axes[n_layers:]:
+            self.fig.delaxes(ax)
+        self.fig.colorbar(self.images[0], ax=list(self.axes), orientation='vertical', label=colorbar_label)
+        self.fig.suptitle(" ")  # reserve space for the title
+        # compute the layout once - it does not change between events
+        self.fig.canvas.draw()
+        self.fig.set_layout_engine('none')
+
+    def update(self, maps, layer_names, title, v_range=None, layer_labels=None):
+        """
+        Set the event (or values) shown by the template.
+
+        :param numpy.ndarray maps: (layers, ROWS, COLS) array of the pad values of each layer
+        :param list layer_names: name of each layer (for the subplot titles)
+        :param str title: title of the figure
+        :param tuple v_range: optional (min, max) of the color scale. By default the scale starts at 0, and pads
+                              without hits (0) are white
+        :param list layer_labels: optional text added to the title of each layer. Default is the sum of the layer
+        :return: the template's plt.Figure
+        """
+        if v_range is None:
+            self.norm.vmin, self.norm.vmax = 0, max(float(np.max(maps)), 1.0)
+        else:
+            self.norm.vmin, self.norm.vmax = v_range
+        for i, (ax, image, layer_map, name) in enumerate(zip(self.axes, self.images, maps, layer_names)):
+            if v_range is None:
+                image.set_data(np.where(layer_map > 0, layer_map, -1))  # pads without hits are white (under the range)
+            else:
+                image.set_data(layer_map)  # (NaN pads are white)
+            label = layer_labels[i] if layer_labels is not None else format_latex(layer_map.sum())
+            ax.set_title(f"Layer slot {name} ({label})", fontsize=10)
+        self.fig.suptitle(title)
+        return self.fig
+
+
 def adjust_colors(data, log=False):
     """
     Set color scheme for heatmaps.
@@ -352,11 +697,9 @@ def set_heatmap_style(ax):
     ax.set_xticks(list(range(COLS)))
     ax.set_yticks(list(range(ROWS)), labels=y_labels)
 
-    # set grid lines to form pads visually
-    for i in range(COLS-1):
-        if i < ROWS-1:
-            ax.axhline(0.5 + i, color='gray', linewidth=0.5)
-        ax.axvline(0.5 + i, color='gray', linewidth=0.5)
+    # set grid lines to form pads visually (one line collection per direction)
+    ax.hlines(0.5 + np.arange(ROWS - 1), -0.5, COLS - 0.5, color='gray', linewidth=0.5)
+    ax.vlines(0.5 + np.arange(COLS - 1), -0.5, ROWS - 0.5, color='gray', linewidth=0.5)
 
 
 def style_fig(ax, title, x_label, y_label, x_lim=None, y_lim=None, y_log=False, legend_lst=None,
@@ -401,6 +744,7 @@ def style_fig(ax, title, x_label, y_label, x_lim=None, y_lim=None, y_log=False,
             ax.set_xticks(x_ticks)
 
 
+@instrumented()
 def save_fig(fig, path, out_filename):
     """
     Save figure.
@@ -452,14 +796,33 @@ def get_equal_bins(min_val, max_val, step):
     return np.arange(min_val, max_val + step, step=step)
 
 
-def set_lims(data):
-    data = np.array(data)
+def data_stats(data):
+    """
+    Statistics of data, each computed once.
+
+    :param numpy.ndarray data: values
+    :return: dict of entries, min, max, mean, std
+    """
+    data = np.asarray(data)
+    if len(data) == 0:
+        return dict(entries=0, min=np.nan, max=np.nan, mean=np.nan, std=np.nan)
+    return dict(entries=len(data), min=np.min(data), max=np.max(data), mean=np.mean(data), std=np.std(data))
+
+
+def set_lims(data, stats=None):
+    """
+    Get x-axis limits of data: (min, mean + 5 std).
+
+    :param data: values
+    :param dict stats: optional statistics of data (as returned by data_stats), to avoid recomputing them
+    :return: tuple of limits, or None if they cannot be set
+    """
+    if stats is None:
+        stats = data_stats(data)
     x_lim = None
-    if len(data) > 0:
-        x_min = np.min(data)
-        x_mean = np.mean(data)
-        x_std = np.std(data)
-        x_max = x_mean + 5 * x_std
+    if stats['entries'] > 0:
+        x_min = stats['min']
+        x_max = stats['mean'] + 5 * stats['std']
         if x_max > x_min:
             x_lim = (x_min, x_max)
     return x_lim
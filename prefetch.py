@@ -0,0 +1,69 @@
+""" Reading the input of upcoming runs on a background thread while the current run is processed """
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+
+class RunPrefetcher:
+    """
+    Reads the input of the runs of a batch ahead of their processing, on a background thread, so that reading and
+    decompressing run N+1 overlaps the analysis of run N (uproot's decompression and file reads release the GIL).
+    At most depth runs are read ahead of the run being processed, which caps the memory held by prefetched runs.
+    A run whose read fails is returned as None (it is then read by its process as usual).
+
+    Usage:
+        with RunPrefetcher(read_func, runs, depth=1) as prefetcher:
+            for run in runs:
+                data = prefetcher.get(run)  # read_func(run), read while the previous run was processed
+    """
+    def __init__(self, read_func, keys, depth=1):
+        """
+        :param function read_func: function reading the input of a run, given its key
+        :param list keys: keys of the runs, in the order they are processed
+        :param int depth: number of runs read ahead of the run being processed
+        """
+        self.read_func = read_func
+        self.depth = max(depth, 1)
+        self._keys = collections.deque(keys)
+        self._pending = collections.deque()  # (key, future) of the runs being read ahead, in order
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+        self._fill()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def get(self, key):
+        """
+        Get the input of the next run (waiting for its read to finish), and start reading the next run ahead.
+
+        :param key: key of the run (must be the next key of the batch)
+        :return: the result of read_func for the run, or None if it failed
+        """
+        pending_key, future = self._pending.popleft()
+        if pending_key != key:
+            raise ValueError(f"Runs must be requested in order: expected {pending_key}, got {key}")
+        try:
+            data = future.result()
+        except Exception as e:
+            print(f"Prefetching run {key} failed ({type(e).__name__}: {e}) - reading it again")
+            data = None
+        self._fill()  # the run's data is handed over: read the next run ahead
+        return data
+
+    def close(self):
+        """
+        Stop reading ahead (runs not started are cancelled, the run being read is finished and dropped).
+
+        :return:
+        """
+        self._keys.clear()
+        self._pending.clear()
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def _fill(self):
+        """ Submit runs until depth runs are pending """
+        while self._keys and len(self._pending) < self.depth:
+            key = self._keys.popleft()
+            self._pending.append((key, self._executor.submit(self.read_func, key)))
@@ -6,6 +6,13 @@ RESULTS_DIR = None  # relative directory to save results
 INPUT_FILE_TYPE = None  # '.root' or '.parquet'
 DUT_INPUT_FILE = None  # path to input files
 PARQUET_FILTER = None  # optional filter to apply when reading .parquet files
+PLOT_JOBS = 1  # number of worker processes used to fill histograms and render plots
+FOLLOW_INTERVAL = None  # seconds between polls when following a run that is still being taken (None otherwise)
+PROFILE = None  # optional profiling of each run: 'cpu' (cProfile), 'memory' (tracemalloc) or 'all'
+CHANNEL_MASK_SOURCE = None  # 'auto' (detect hot/dead channels of each run) or path of a saved channel mask
+OUTPUT = "all"  # 'all' (histograms file and PNG plots) or 'root' (only the histograms file of the run)
+CHANNEL_MASK = None  # boolean (layers, channels) array of channels ignored in the current run. None - NOISY_CHANNELS
+PREFETCHED = None  # input of the current run read ahead while the previous run was processed (see init_funcs)
 
 # ---------- CONSTANTS ---------- #
 ROWS = 13
@@ -15,7 +22,23 @@ TELE_ROOT_TREE = "TrackingInfo/Tracks"  # name of ROOT tree of telescope input f
 LAYERS = list(range(10, -1, -1))  # layer numbers
 LAYERS_NAMES = [str(i) for i in range(0, 11)]  # option to change the layer numbers (to match #W plates)
 CHANNELS = list(range(256))  # channel numbers (per layer)
+PAD_SIZE = 5.0  # pad pitch (mm)
+SENSOR_OFFSET = (0.0, 0.0)  # position of the sensor centre in the telescope track coordinates at the DUT (mm)
 NOISY_CHANNELS = {}  # channels to be ignored (should be a set of tuples (layer, channel))
+HOT_CHANNEL_FACTOR = 5.0  # hot channel: occupancy above this factor times the median of its neighbouring pads
+DEAD_CHANNEL_FACTOR = 0.05  # dead channel: occupancy below this fraction of the median of its neighbouring pads
+MIN_CHANNEL_COUNTS = 20  # minimal number of hits (observed for hot, expected for dead) to classify a channel
+CHANNEL_PLOTS = "grid"  # channel energy plots: 'grid' (one figure of all channels per layer) or 'single' (per channel)
+ADC_RANGE = (0, 1023)  # amplitude range covered by the per-channel histograms (values outside are under/overflow)
+LAYER_ENERGY_BIN_STEP = 10  # bin width of the per-layer energy histograms
+SHOWER_ENERGY_BIN_STEP = 50  # bin width of the shower energy histogram
+MEMORY_BUDGET = 4 * 1024 ** 3  # bytes. Larger runs are read in chunks (streaming mode) when the process allows it
+FLAT_MEMORY_FACTOR = 6  # estimated memory of the flattened data relative to the uncompressed ROOT branches read
+STREAM_STEP_SIZE = "100 MB"  # size of each chunk in streaming mode (number of entries or uproot memory size string)
+USE_CACHE = True  # cache flattened ROOT data ('.parquet' next to input files) and run histograms (results dir)
+CACHE_VERSION = 3  # version of the flattened data format. changing it invalidates existing caches
+STORE_VERSION = 1  # version of the histogram store (hist_cube.HistCube). bump when the reduction code changes
+SHAPE_VERSION = 1  # version of the shower shape table (shower_shape.shower_shapes). bump when its code changes
 
 # Directories and file names
 DUT_FILE_PATH = "./detector/Converted/ZS_Data/"
@@ -31,8 +54,12 @@ EVENT_ID_COL = "TLU_number"  # ID of event
 PLANE_ENERGY_COL = "planeEnergy"  # sum of energy in layer (sum per event & layer)
 SHOWER_ENERGY_COL = "showerEnergy"  # sum of energy in shower (sum per event)
 
+# Telescope track column names (merged DUT/telescope tree)
+TRACK_X_COL = "x_dut"  # track x position at the DUT (mm)
+TRACK_Y_COL = "y_dut"  # track y position at the DUT (mm)
 
-def init_vars(run, ext, res_dir, filters):
+
+def init_vars(run, ext, res_dir, filters, jobs=None):
     """
     Initialize file dependent variables
 
@@ -40,6 +67,7 @@ def init_vars(run, ext, res_dir, filters):
     :param str ext: extension of input file
     :param str res_dir: relative directory to save results
     :param str filters: optional filters if input file is of type '.parquet'
+    :param int jobs: optional number of worker processes used to render plots (default is 1)
     :return:
     """
     # set variables
@@ -53,7 +81,21 @@ def init_vars(run, ext, res_dir, filters):
     INPUT_FILE_TYPE = ext
 
     global DUT_INPUT_FILE
-    DUT_INPUT_FILE = DUT_FILE_PATH + INPUT_FILE_REGEX[:-6] + str(RUN_NUM) + "_hits" + INPUT_FILE_TYPE
+    DUT_INPUT_FILE = get_input_file(RUN_NUM, INPUT_FILE_TYPE)
 
     global PARQUET_FILTER
     PARQUET_FILTER = filters
+
+    global PLOT_JOBS
+    PLOT_JOBS = jobs if jobs else 1
+
+
+def get_input_file(run, ext):
+    """
+    Path of the DUT input file of a run
+
+    :param int run: run number
+    :param str ext: extension of input file
+    :return: path to input file
+    """
+    return DUT_FILE_PATH + INPUT_FILE_REGEX[:-6] + str(run) + "_hits" + ext
@@ -0,0 +1,103 @@
+""" Flattened hit table of a run shared with worker processes through a memory-mapped Arrow file """
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from . import instrumentation
+from .io_funcs import save_shared_df, map_shared_df
+from .event_index import EventIndex
+from .run_params import EVENT_ID_COL
+
+SHARED_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()  # default directory of the files
+
+_worker_table = None  # hit table mapped by a worker process
+
+
+class SharedHitTable:
+    """
+    A flattened hit table exported once to an Arrow IPC file (see io_funcs.save_shared_df), which worker processes
+    memory-map instead of receiving a pickled copy: N workers share the pages of a single copy of the table and
+    do not deserialize it. The file is kept in shared memory (/dev/shm) when available.
+    Work is given to the workers as row ranges of whole events (the hits of each event must be contiguous).
+
+    Usage:
+        with SharedHitTable(df) as table:
+            results = table.map(func, table.event_ranges(8), jobs=8)  # func(hit table, (start, stop))
+    """
+    def __init__(self, df, filename=None):
+        """
+        :param pd.DataFrame df: flattened hit table
+        :param str filename: optional path of the exported file (kept on close).
+                             default is a temporary file in SHARED_DIR, removed on close
+        """
+        self._owned = filename is None
+        if filename is None:
+            fd, filename = tempfile.mkstemp(prefix="hits_", suffix=".arrow", dir=SHARED_DIR)
+            os.close(fd)
+        self.filename = save_shared_df(df, filename)
+        self.num_rows = len(df)
+        self._event_starts = EventIndex.from_hits(df[EVENT_ID_COL].to_numpy()).starts
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """
+        Remove the exported file (unless it was given by the caller).
+
+        :return:
+        """
+        if self._owned and os.path.exists(self.filename):
+            os.remove(self.filename)
+
+    def event_ranges(self, n):
+        """
+        Split the table into up to n row ranges of about the same number of rows, without splitting events.
+
+        :param int n: number of ranges
+        :return: list of (start, stop) row ranges
+        """
+        if self.num_rows == 0:
+            return []
+        targets = np.linspace(0, self.num_rows, max(n, 1) + 1)[1:-1]
+        starts = self._event_starts[np.minimum(np.searchsorted(self._event_starts, targets),
+                                               len(self._event_starts) - 1)]
+        bounds = np.unique(np.concatenate([[0], starts, [self.num_rows]]))
+        return [(int(start), int(stop)) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+    def map(self, func, items, jobs=1):
+        """
+        Call func(hit table, item) for every item, on worker processes that map the exported table.
+
+        :param function func: module-level function (sent to the workers by reference)
+        :param list items: arguments of func (e.g. row ranges, see event_ranges)
+        :param int jobs: number of worker processes. 1 (or None) runs in the current process
+        :return: list of results, in the order of items
+        """
+        if not jobs or jobs <= 1:
+            table = map_shared_df(self.filename)
+            return [func(table, item) for item in items]
+
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(self.filename,)) as executor:
+            futures = [executor.submit(_run_item, func, item) for item in items]
+            results = []
+            for future in futures:
+                result, stats = future.result()
+                instrumentation.merge_stats(stats)  # stage measurements of worker processes
+                results.append(result)
+        return results
+
+
+def _init_worker(filename):
+    """ Map the shared hit table once per worker process """
+    global _worker_table
+    instrumentation.reset()  # do not report measurements inherited from the parent process
+    _worker_table = map_shared_df(filename)
+
+
+def _run_item(func, item):
+    """ Run func on the worker's hit table, and return its result and the worker's stage measurements """
+    return func(_worker_table, item), instrumentation.get_stats(clear=True)
@@ -0,0 +1,88 @@
+""" Per-event shower shape of a run, reconstructed for all events at once from the flattened hits """
+import numpy as np
+import pandas as pd
+from .instrumentation import instrumented
+from .tb_helpers_v2025 import channel_to_sensor_coord
+from .run_params import PLANE_COL, CHANNEL_COL, AMPLITUDE_COL, EVENT_ID_COL, SHOWER_ENERGY_COL, LAYERS
+
+SHAPE_COLUMNS = [EVENT_ID_COL, PLANE_COL, CHANNEL_COL, AMPLITUDE_COL]  # flattened columns used by shower_shapes
+
+
+@instrumented()
+def shower_shapes(df):
+    """
+    Reconstruct the shower shape of every event of a flattened hit table with segment reductions (bincounts) over
+    the hits - no per-event python work is done.
+    Positions are in pad units (column, row of channel_to_sensor_coord) and weighted by the hit amplitudes.
+    Depths are in layer slots (position of the layer in LAYERS - 0 is the first layer).
+    Output columns:
+        - TLU_number, showerEnergy - event ID and sum of hit amplitudes
+        - hits, layers_hit - hit multiplicity and number of layers with hits
+        - col, row - shower centroid (all layers)
+        - transverse_rms - RMS distance of the energy from the shower centroid
+        - depth - shower barycentre along the layers
+        - max_layer - slot of the layer with the most energy
+        - col_<layer>, row_<layer> - centroid in each layer (NaN if the layer has no energy)
+
+    :param pd.DataFrame df: flattened data (as returned by df_handling.flatten_calo_df)
+    :return: pd.DataFrame with one row per event (in increasing event ID order)
+    """
+    n_layers = max(LAYERS) + 1
+    n_slots = len(LAYERS)
+    layer_slot = np.full(n_layers, -1, dtype=np.int64)
+    layer_slot[LAYERS] = np.arange(n_slots)
+
+    planes = df[PLANE_COL].to_numpy().astype(np.int64)
+    channels = df[CHANNEL_COL].to_numpy().astype(np.int64)
+    # ignore hits outside the detector geometry
+    valid = (planes >= 0) & (planes < n_layers) & (channels >= 0)
+    valid[valid] = layer_slot[planes[valid]] >= 0
+    slots = layer_slot[planes[valid]]
+    col, row = channel_to_sensor_coord(channels[valid])
+    energy = df[AMPLITUDE_COL].to_numpy()[valid].astype(float)
+    event_ids, event_idx = np.unique(df[EVENT_ID_COL].to_numpy()[valid], return_inverse=True)
+    event_idx = event_idx.reshape(-1)
+    n_events = len(event_ids)
+
+    # whole shower: multiplicity, energy, centroid and barycentre along the layers
+    hits = np.bincount(event_idx, minlength=n_events)
+    shower_energy, col_sum, row_sum, slot_sum = _segment_sums(event_idx, n_events, energy, energy * col,
+                                                              energy * row, energy * slots)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        centroid_col = col_sum / shower_energy
+        centroid_row = row_sum / shower_energy
+        depth = slot_sum / shower_energy
+        # transverse spread around the shower centroid
+        dist2 = (col - centroid_col[event_idx]) ** 2 + (row - centroid_row[event_idx]) ** 2
+        transverse_rms = np.sqrt(_segment_sums(event_idx, n_events, energy * dist2)[0] / shower_energy)
+
+    # per layer: one segment per (event, layer slot)
+    layer_idx = event_idx * n_slots + slots
+    layer_hits = np.bincount(layer_idx, minlength=n_events * n_slots).reshape(n_events, n_slots)
+    layer_energy, layer_col_sum, layer_row_sum = (
+        sums.reshape(n_events, n_slots)
+        for sums in _segment_sums(layer_idx, n_events * n_slots, energy, energy * col, energy * row))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        layer_col = np.where(layer_energy != 0, layer_col_sum / layer_energy, np.nan)
+        layer_row = np.where(layer_energy != 0, layer_row_sum / layer_energy, np.nan)
+    max_layer = np.argmax(layer_energy, axis=1) if n_slots else np.zeros(n_events, dtype=np.int64)
+
+    shapes = {EVENT_ID_COL: event_ids, SHOWER_ENERGY_COL: shower_energy.astype(np.int64), "hits": hits,
+              "layers_hit": np.count_nonzero(layer_hits, axis=1), "col": centroid_col, "row": centroid_row,
+              "transverse_rms": transverse_rms, "depth": depth, "max_layer": max_layer}
+    for slot, layer in enumerate(LAYERS):
+        shapes[f"col_{layer}"] = layer_col[:, slot]
+        shapes[f"row_{layer}"] = layer_row[:, slot]
+    return pd.DataFrame(shapes)
+
+
+def _segment_sums(idx, n, *values):
+    """
+    Sum each array of values over the segments given by idx.
+
+    :param numpy.ndarray idx: segment index of each entry
+    :param int n: number of segments
+    :param values: numpy.ndarrays of values (one per entry)
+    :return: list of numpy.ndarrays of the sums of each segment (one per values array)
+    """
+    return [np.bincount(idx, weights=vals, minlength=n) for vals in values]
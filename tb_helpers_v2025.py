@@ -1,6 +1,6 @@
 import numpy as np
 from .df_handling import filter_df, unique_df
-from .run_params import EVENT_ID_COL, PLANE_COL, PLANE_ENERGY_COL, ROWS, COLS
+from .run_params import EVENT_ID_COL, PLANE_COL, PLANE_ENERGY_COL, ROWS, COLS, CHANNELS, PAD_SIZE, SENSOR_OFFSET
 
 
 # def get_noisy_ch(layer):
@@ -29,6 +29,34 @@ def channel_to_sensor_coord(ch):
     return col, row
 
 
+def pad_centres(pad_size=PAD_SIZE, offset=SENSOR_OFFSET):
+    """
+    Lookup table of the physical position of the centre of each channel's pad (see channel_to_sensor_coord),
+    in the coordinates of the telescope tracks at the DUT.
+
+    :param float pad_size: pad pitch (mm)
+    :param tuple offset: position of the sensor centre (mm)
+    :return: x, y of the pad centres (numpy.ndarrays indexed by channel number)
+    """
+    col, row = channel_to_sensor_coord(np.asarray(CHANNELS, dtype=np.int64))
+    x = (col + 0.5 - COLS / 2) * pad_size + offset[0]
+    y = (row + 0.5 - ROWS / 2) * pad_size + offset[1]
+    return x, y
+
+
+def pad_edges(pad_size=PAD_SIZE, offset=SENSOR_OFFSET):
+    """
+    Physical edges of the pad columns and rows (see pad_centres).
+
+    :param float pad_size: pad pitch (mm)
+    :param tuple offset: position of the sensor centre (mm)
+    :return: x edges (COLS + 1), y edges (ROWS + 1) (numpy.ndarrays)
+    """
+    x_edges = (np.arange(COLS + 1) - COLS / 2) * pad_size + offset[0]
+    y_edges = (np.arange(ROWS + 1) - ROWS / 2) * pad_size + offset[1]
+    return x_edges, y_edges
+
+
 def get_layer_energies(df, layer):
     """
     Get energies deposited in given layer
@@ -52,17 +80,57 @@ def calc_freq(data):
     :param list data: list of channels hit
     :return: numpy.ndarray of counts
     """
-    # define the "shape of sensor"
-    freq = np.zeros((ROWS, COLS))
     # count appearances per channels
-    unique_channels, counts = np.unique(data, return_counts=True)
-    # set count in ndarray
-    for i, ch in enumerate(unique_channels):
-        # get channel coordinates on the sensor surface
-        x, y = channel_to_sensor_coord(ch)
-        freq[ROWS-y-1, x] = counts[i]  # TB count is from the bottom left corner; Python counts from the top left
-    return freq
+    counts = np.bincount(np.asarray(data, dtype=np.int64), minlength=ROWS * COLS)
+    return counts_to_sensor_map(counts)
+
 
+def hits_to_sensor_maps(planes, channels, values, n_layers):
+    """
+    Given hits of all layers, return the sum of their values per channel of each layer.
+    Shaped as the channels are layed on the surface (see counts_to_sensor_map).
+
+    :param numpy.ndarray planes: layer number per hit
+    :param numpy.ndarray channels: channel number per hit
+    :param numpy.ndarray values: value per hit (e.g. amplitude)
+    :param int n_layers: number of layers (highest layer number + 1)
+    :return: numpy.ndarray of shape (n_layers, ROWS, COLS), indexed by layer number
+    """
+    x, y = channel_to_sensor_coord(np.asarray(channels, dtype=np.int64))
+    # flat index of each hit's pad, TB count is from the bottom left corner; Python counts from the top left
+    idx = (np.asarray(planes, dtype=np.int64) * ROWS + ROWS - y - 1) * COLS + x
+    sums = np.bincount(idx, weights=np.asarray(values, dtype=float), minlength=n_layers * ROWS * COLS)
+    return sums.reshape(n_layers, ROWS, COLS)
+
+
+def channel_values_to_sensor_maps(values, fill_value=np.nan):
+    """
+    Given values per channel (indexed by channel number in the last axis), return them shaped as the channels are
+    layed on the surface (see counts_to_sensor_map). Pads without a channel are set to fill_value.
+
+    :param numpy.ndarray values: (..., channels) array of values
+    :param float fill_value: value of pads without a channel
+    :return: numpy.ndarray of shape (..., ROWS, COLS)
+    """
+    values = np.asarray(values, dtype=float)
+    maps = np.full(values.shape[:-1] + (ROWS, COLS), fill_value)
+    x, y = channel_to_sensor_coord(np.arange(values.shape[-1]))
+    maps[..., ROWS - y - 1, x] = values  # TB count is from the bottom left corner; Python counts from the top left
+    return maps
 
 
+def counts_to_sensor_map(counts):
+    """
+    Given the number of hits per channel (indexed by channel number), return them
+    shaped as the channels are layed on the surface.
 
+    :param numpy.ndarray counts: number of hits per channel
+    :return: numpy.ndarray of counts
+    """
+    # define the "shape of sensor"
+    freq = np.zeros((ROWS, COLS))
+    channels = np.nonzero(counts)[0]
+    # get channel coordinates on the sensor surface
+    x, y = channel_to_sensor_coord(channels)
+    freq[ROWS-y-1, x] = counts[channels]  # TB count is from the bottom left corner; Python counts from the top left
+    return freq
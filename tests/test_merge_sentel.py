@@ -0,0 +1,45 @@
+""" Merging of DUT and telescope trees without any valid telescope trigger """
+import awkward as ak
+import pytest
+import uproot
+from .. import run_params
+from ..benchmarks.synthetic_data import generate_run
+from ..dut_tele_sync_merge.merge_sentel import merge_dut_tele, merge_dut_tele_streaming, TELE_EVENT_COL, \
+    MERGED_ROOT_TREE
+
+NUM_EVENTS = 200
+
+
+def _rewrite_tele(tele_file, invalid):
+    """ Rewrite the telescope tree empty (invalid=False) or with every trigger number set to -1 (invalid=True) """
+    with uproot.open(tele_file) as fin:
+        tracks = fin[run_params.TELE_ROOT_TREE].arrays()
+    data = {field: tracks[field] for field in tracks.fields if not field.startswith("n")}
+    if invalid:
+        data[TELE_EVENT_COL] = ak.full_like(data[TELE_EVENT_COL], -1)
+    else:
+        data = {field: arr[:0] for field, arr in data.items()}
+    with uproot.recreate(tele_file) as fout:
+        fout.mktree(run_params.TELE_ROOT_TREE, {field: arr.type.content for field, arr in data.items()})
+        fout[run_params.TELE_ROOT_TREE].extend(data)
+
+
+@pytest.mark.parametrize("invalid", [False, True], ids=["empty", "invalid"])
+def test_streaming_merge_without_telescope_triggers(tmp_path, invalid):
+    dut_file, tele_file = generate_run(1, NUM_EVENTS, out_dir=str(tmp_path), chunk_size=50)
+    _rewrite_tele(tele_file, invalid)
+    with uproot.open(tele_file) as fin:
+        num_tele = fin[run_params.TELE_ROOT_TREE].num_entries
+
+    _, counts = merge_dut_tele_streaming(1, dut_file, tele_file, out_dir=str(tmp_path) + "/", step_size=50)
+    assert counts == {"matched": 0, "dut_unmatched": NUM_EVENTS, "tele_unmatched": num_tele}
+
+
+@pytest.mark.parametrize("invalid", [False, True], ids=["empty", "invalid"])
+def test_merge_without_telescope_triggers(tmp_path, invalid):
+    dut_file, tele_file = generate_run(1, NUM_EVENTS, out_dir=str(tmp_path), chunk_size=50)
+    _rewrite_tele(tele_file, invalid)
+
+    output_file = merge_dut_tele(1, dut_file, tele_file, out_dir=str(tmp_path) + "/")
+    with uproot.open(output_file) as fin:
+        assert fin[MERGED_ROOT_TREE].num_entries == 0
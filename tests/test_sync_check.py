@@ -0,0 +1,47 @@
+""" Trigger slips found by the DUT/telescope sync check """
+import numpy as np
+import pytest
+from ..dut_tele_sync_merge.sync_check import sync_stats
+
+NUM_TRIGGERS = 100000
+
+
+def _synthetic_run(slip_start, slip_stop, label_shift, missing=0.02, seed=0):
+    """
+    DUT and telescope trigger numbers and timestamps of a run whose telescope trigger numbers of triggers
+    slip_start to slip_stop are shifted by label_shift, and missing a fraction of the telescope triggers.
+    """
+    rng = np.random.default_rng(seed)
+    dut_times = np.cumsum(np.round(rng.exponential(20000, NUM_TRIGGERS)) + 1)
+    triggers = np.arange(NUM_TRIGGERS)
+    # clock ratio 10 with a slow drift, and timestamp noise
+    tele_times = dut_times * 10 * (1 + 2e-6 * np.linspace(0, 1, NUM_TRIGGERS)) + 12345 + rng.normal(0, 3, NUM_TRIGGERS)
+    tele_triggers = triggers.copy()
+    tele_triggers[slip_start:slip_stop] += label_shift
+    keep = rng.random(NUM_TRIGGERS) >= missing
+    return triggers, dut_times, tele_triggers[keep], tele_times[keep]
+
+
+@pytest.mark.parametrize("slip_start, slip_stop, label_shift", [
+    (30000, NUM_TRIGGERS, -1),  # persistent: up to the end of the run
+    (30000, NUM_TRIGGERS, 2),
+    (30000, 40000, -1),  # 5 fit windows long
+    (30000, 30200, 1),  # shorter than a fit window
+], ids=["persistent", "persistent_2", "long", "short"])
+def test_slips(slip_start, slip_stop, label_shift):
+    report, _ = sync_stats(*_synthetic_run(slip_start, slip_stop, label_shift))
+    assert not report["sync_ok"]
+    assert len(report["slips"]) == 1
+    slip = report["slips"][0]
+    # the telescope timestamp of trigger i labelled i + label_shift belongs to DUT trigger i
+    assert slip["shift"] == -label_shift
+    assert abs(slip["first_trigger"] - slip_start) <= 3 and abs(slip["last_trigger"] - (slip_stop - 1)) <= 3
+    assert report["slipped_triggers"] >= 0.95 * (1 - 0.02) * (slip_stop - slip_start)
+    assert report["mismatched_triggers"] <= 0.001 * report["matched"]
+
+
+def test_no_slips():
+    report, _ = sync_stats(*_synthetic_run(0, 0, 0))
+    assert report["sync_ok"]
+    assert report["slips"] == [] and report["offset_jumps"] == []
+    assert abs(report["clock_ratio"] / 10 - 1) < 1e-5